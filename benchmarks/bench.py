@@ -0,0 +1,262 @@
+"""Бенчмарки без сети: функции загрузки, CLI и обработчики бота на локальном стенде (mock_server)
+
+Для каждого сценария выводятся пропускная способность (оп/с), задержки p50/p99 (мс)
+и пик выделенной памяти (КБ, tracemalloc). Результаты можно сохранить в JSON и сравнить с базовыми:
+при замедлении p50 больше чем на --max-regression сценарий помечается как регрессия и код выхода = 1.
+
+Примеры:
+    python -m benchmarks.bench
+    python -m benchmarks.bench --iterations 500 --latency 20 --json bench.json
+    python -m benchmarks.bench --baseline bench.json --max-regression 0.25"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import contextlib
+import subprocess
+import tracemalloc
+from types import SimpleNamespace
+from dataclasses import dataclass, asdict
+
+from benchmarks.mock_server import MockConfig, start_in_thread
+
+ROOT: str = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@dataclass
+class BenchResult:
+    """Результат одного сценария"""
+    name: str
+    iterations: int
+    throughput: float   # Операций в секунду
+    p50_ms: float
+    p99_ms: float
+    memory_kb: float    # Пик выделенной памяти за одну операцию
+
+
+def percentile(values: list, percent: float) -> float:
+    """Перцентиль по отсортированному списку (ближайший ранг)"""
+    ordered: list = sorted(values)
+    index: int = min(len(ordered) - 1, max(0, round(percent / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def _memory_peak(call) -> float:
+    """Пик выделенной памяти за один вызов, КБ"""
+    tracemalloc.start()
+    try:
+        call()
+        return tracemalloc.get_traced_memory()[1] / 1024
+    finally:
+        tracemalloc.stop()
+
+
+def bench_sync(name: str, fn, iterations: int) -> BenchResult:
+    """Последовательные вызовы fn(i)"""
+    fn(-1)  # Прогрев: соединения, импорты и кэши, которые должны быть теплыми
+    memory_kb: float = _memory_peak(lambda: fn(-2))
+    latencies: list = []
+    started: float = time.perf_counter()
+    for i in range(iterations):
+        begin: float = time.perf_counter()
+        fn(i)
+        latencies.append(time.perf_counter() - begin)
+    elapsed: float = time.perf_counter() - started
+    return BenchResult(name, iterations, iterations / elapsed,
+                       percentile(latencies, 50) * 1000, percentile(latencies, 99) * 1000, memory_kb)
+
+
+def bench_async(name: str, fn, iterations: int, concurrency: int) -> BenchResult:
+    """Вызовы await fn(i), не больше concurrency одновременно"""
+
+    async def run() -> tuple:
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies: list = []
+
+        async def one(i: int) -> None:
+            async with semaphore:
+                begin: float = time.perf_counter()
+                await fn(i)
+                latencies.append(time.perf_counter() - begin)
+
+        await fn(-1)  # Прогрев: соединения и кэши, которые должны быть теплыми
+        started: float = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(iterations)))
+        elapsed: float = time.perf_counter() - started
+
+        tracemalloc.start()
+        await fn(-2)
+        memory_kb: float = tracemalloc.get_traced_memory()[1] / 1024
+        tracemalloc.stop()
+
+        import http_client
+        await http_client.close_async_session()
+        return latencies, elapsed, memory_kb
+
+    latencies, elapsed, memory_kb = asyncio.run(run())
+    return BenchResult(name, iterations, iterations / elapsed,
+                       percentile(latencies, 50) * 1000, percentile(latencies, 99) * 1000, memory_kb)
+
+
+def bench_cli(name: str, argv: list, iterations: int, env: dict, cwd: str) -> BenchResult:
+    """Запуск CLI отдельным процессом: время старта интерпретатора, импортов и запроса"""
+    latencies: list = []
+    started: float = time.perf_counter()
+    for _ in range(iterations):
+        begin: float = time.perf_counter()
+        subprocess.run([sys.executable, *argv], env=env, cwd=cwd, check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        latencies.append(time.perf_counter() - begin)
+    elapsed: float = time.perf_counter() - started
+    return BenchResult(name, iterations, iterations / elapsed,
+                       percentile(latencies, 50) * 1000, percentile(latencies, 99) * 1000, 0.0)
+
+
+def letter_name(number: int) -> str:
+    """Синтетическое название места только из букв (названия с цифрами бот отклоняет): 0 → 'Городаа'"""
+    letters: str = 'абвгдежзиклмнопрстуфхцчшэюя'
+    suffix: str = ''
+    while number or len(suffix) < 2:
+        number, index = divmod(number, len(letters))
+        suffix = letters[index] + suffix
+    return f'Город{suffix}'
+
+
+class StubMessage:
+    """Сообщение Telegram для вызова обработчиков бота без сети: ответы только запоминаются"""
+
+    def __init__(self) -> None:
+        self.answers: list = []
+
+    async def answer(self, text: str, **kwargs) -> None:
+        self.answers.append(text)
+
+    async def answer_photo(self, photo, caption: str | None = None, **kwargs) -> SimpleNamespace:
+        self.answers.append(caption)
+        return SimpleNamespace(photo=[SimpleNamespace(file_id='bench-file-id')])
+
+
+def run_benchmarks(iterations: int, concurrency: int, cli_iterations: int, env: dict, workdir: str) -> list:
+    """Все сценарии. Модули проекта импортируются здесь - после настройки окружения на стенд"""
+    import weather
+    import currency_exchange
+    import rate_engine
+    import locations
+    import bot
+    from aiogram.filters import CommandObject
+
+    api_key: str = env['API_KEY']
+    engine = rate_engine.RateEngine(api_key)
+    cities: list = [letter_name(i) for i in range(iterations + 10)]  # Разные места - промахи кэша
+    known: list = list(locations.get_index().names[:20])  # Города из индекса - как в командах пользователей
+
+    results: list = [
+        bench_sync('weather.fetch_weather_data (без кэша)', lambda i: weather.fetch_weather_data('москва'), iterations),
+        bench_sync('weather.get_weather_data (кэш)', lambda i: weather.get_weather_data('Москва'), iterations),
+        bench_sync('weather.get_weather_png (промах кэша)', lambda i: weather.get_weather_png(cities[i]), iterations),
+        bench_sync('currency.get_current_exchange_rate', lambda i: currency_exchange.get_current_exchange_rate(
+            api_key, 'USD', 'RUB'), iterations),
+        bench_sync('rate_engine.RateEngine.rate (таблица)', lambda i: engine.rate('EUR', 'RUB'), iterations),
+        bench_sync('currency.get_history_exchange_rate (хранилище)', lambda i: currency_exchange.get_history_exchange_rate(
+            api_key, 'USD', 'RUB', '2024', '01', '15'), iterations),
+        bench_async('weather.fetch_weather_data_async', lambda i: weather.fetch_weather_data_async(cities[i]),
+                    iterations, concurrency),
+        bench_async('rate_engine.fetch_rate_table_async', lambda i: rate_engine.fetch_rate_table_async(api_key, 'EUR'),
+                    iterations, concurrency),
+    ]
+
+    # Обработчики бота
+    def handler(func, command: str, args):
+        async def call(i: int) -> None:
+            value = args(i) if callable(args) else args
+            message = StubMessage()
+            await func(message, CommandObject(prefix='/', command=command, args=value))
+            # Замер ответа об ошибке вместо самой команды ничего не говорит о ее скорости
+            errors: list = [answer for answer in message.answers if answer and answer.startswith('[!]')]
+            if errors:
+                raise RuntimeError(f"/{command} {value}: {errors[0]}")
+        return call
+
+    results += [
+        bench_async('bot.cmd_weather', handler(bot.cmd_weather, 'weather', lambda i: known[i % len(known)]),
+                    iterations, concurrency),
+        bench_async('bot.cmd_rate', handler(bot.cmd_rate, 'rate', 'EUR RUB'), iterations, concurrency),
+        bench_async('bot.cmd_convert', handler(bot.cmd_convert, 'convert', '100 USD KZT'), iterations, concurrency),
+    ]
+
+    # Командная строка: каждый запуск - новый процесс
+    if cli_iterations:
+        results += [
+            bench_cli('cli: weather.py --noimage', [os.path.join(ROOT, 'weather.py'), '--noimage', '--city', 'Казань'],
+                      cli_iterations, env, workdir),
+            bench_cli('cli: currency_exchange.py current', [os.path.join(ROOT, 'currency_exchange.py'), 'current'],
+                      cli_iterations, env, workdir),
+        ]
+    return results
+
+
+def print_results(results: list, regressions: set) -> None:
+    """Таблица результатов"""
+    print(f"{'Сценарий':<50} {'оп/с':>10} {'p50, мс':>9} {'p99, мс':>9} {'память, КБ':>11}")
+    for result in results:
+        mark: str = '  <- регрессия' if result.name in regressions else ''
+        print(f"{result.name:<50} {result.throughput:>10.1f} {result.p50_ms:>9.3f} {result.p99_ms:>9.3f} "
+              f"{result.memory_kb:>11.1f}{mark}")
+
+
+def find_regressions(results: list, baseline_path: str, max_regression: float) -> set:
+    """Сценарии, у которых p50 вырос больше чем на max_regression относительно базовых результатов"""
+    with open(baseline_path, encoding='utf-8') as file:
+        baseline: dict = {item['name']: item for item in json.load(file)}
+    return {result.name for result in results
+            if result.name in baseline and result.p50_ms > baseline[result.name]['p50_ms'] * (1 + max_regression)}
+
+
+def main() -> None:
+    """Точка входа с парсингом аргументов из командной строки."""
+    parser = argparse.ArgumentParser(description='Бенчмарки на локальном стенде wttr.in и exchangerate-api.com')
+    parser.add_argument('--iterations', type=int, default=200, help='Вызовов на сценарий')
+    parser.add_argument('--concurrency', type=int, default=50, help='Одновременных вызовов в async-сценариях')
+    parser.add_argument('--cli-iterations', type=int, default=5, help='Запусков CLI (0 - пропустить)')
+    parser.add_argument('--latency', type=float, default=0.0, help='Задержка ответа стенда, мс')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Доля ответов 503')
+    parser.add_argument('--json', help='Сохранить результаты в JSON')
+    parser.add_argument('--baseline', help='JSON с базовыми результатами для поиска регрессий')
+    parser.add_argument('--max-regression', type=float, default=0.25, help='Допустимое замедление p50 (0.25 = 25%%)')
+    args = parser.parse_args()
+
+    base_url, server, stop = start_in_thread(MockConfig(latency=args.latency / 1000, error_rate=args.error_rate))
+    workdir: str = tempfile.mkdtemp(prefix='bench_')
+
+    # Модули читают адреса и пути из окружения при импорте
+    env: dict = {**os.environ, 'WTTR_URL': base_url, 'EXCHANGE_API_URL': f'{base_url}/v6', 'API_KEY': 'bench',
+                 'BOT_TOKEN': '0:bench', 'HISTORY_DB': os.path.join(workdir, 'history.sqlite3'),
+                 'IMAGE_CACHE_DIR': os.path.join(workdir, 'images', 'cache'), 'PYTHONPATH': ROOT,
+                 'HTTP_RATE_LIMIT': '0'}  # Измеряется сам код, а не ограничитель частоты
+    os.environ.update(env)
+    os.chdir(workdir)
+    sys.path.insert(0, ROOT)
+
+    try:
+        with contextlib.redirect_stdout(open(os.devnull, 'w')):  # Сообщения модулей не мешают измерениям
+            results: list = run_benchmarks(args.iterations, args.concurrency, args.cli_iterations, env, workdir)
+    finally:
+        stop()
+
+    regressions: set = find_regressions(results, args.baseline, args.max_regression) if args.baseline else set()
+    print_results(results, regressions)
+    print(f"[i] Запросов к стенду: {server.config.counters}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as file:
+            json.dump([asdict(result) for result in results], file, ensure_ascii=False, indent=4)
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""Бенчмарк задержки event loop при одновременной обработке карточек погоды (image_pipeline.py)
+
+Пока идут одновременные запросы карточек, фоновая задача "тикает" каждые --tick мс и измеряет,
+насколько позже срока она просыпается. Эта задержка - время, на которое остановлены все остальные чаты бота.
+Режимы:
+ inline - обработка прямо в event loop (как было бы без пула)
+ thread - asyncio.to_thread (GIL: Python-часть Pillow все равно мешает loop)
+ pool   - ImagePipeline: пул процессов с ограниченной очередью
+Каждая карточка уникальна (своя ширина), поэтому кэш карточек не срабатывает (до ширины/2 запросов).
+При --max-lag p99 задержки в режиме pool выше порога дает код выхода 1.
+
+Примеры:
+    python -m benchmarks.loop_lag
+    python -m benchmarks.loop_lag --requests 200 --tiles 4 --workers 4 --max-lag 20"""
+
+import os
+import sys
+import time
+import shutil
+import asyncio
+import argparse
+import tempfile
+import contextlib
+
+from benchmarks.bench import percentile
+
+ROOT: str = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURE: str = os.path.join(ROOT, 'benchmarks', 'fixtures', 'weather.png')
+
+
+async def measure_lag(work, tick: float) -> tuple:
+    """Выполняет await work() и параллельно замеряет опоздания тиков. Возвращает (опоздания, сек; время работы)"""
+    lags: list = []
+    done = asyncio.Event()
+
+    async def ticker() -> None:
+        while not done.is_set():
+            expected: float = time.perf_counter() + tick
+            await asyncio.sleep(tick)
+            lags.append(max(0.0, time.perf_counter() - expected))
+
+    ticker_task = asyncio.create_task(ticker())
+    await asyncio.sleep(tick * 2)  # Тикер успевает запуститься
+    started: float = time.perf_counter()
+    await work()
+    elapsed: float = time.perf_counter() - started
+    done.set()
+    await ticker_task
+    return lags, elapsed
+
+
+def print_row(mode: str, requests: int, lags: list, elapsed: float) -> None:
+    print(f"{mode:<8} {requests / elapsed:>10.1f} {percentile(lags, 50) * 1000:>9.2f} "
+          f"{percentile(lags, 99) * 1000:>9.2f} {max(lags) * 1000:>9.2f}")
+
+
+def main() -> None:
+    """Точка входа с парсингом аргументов из командной строки."""
+    parser = argparse.ArgumentParser(description='Задержка event loop при одновременной обработке карточек погоды')
+    parser.add_argument('--requests', type=int, default=100, help='Карточек в каждом режиме')
+    parser.add_argument('--concurrency', type=int, default=20, help='Одновременных запросов карточек')
+    parser.add_argument('--tiles', type=int, default=4, help='Городов в одной карточке')
+    parser.add_argument('--workers', type=int, default=min(4, os.cpu_count() or 1), help='Процессов в пуле')
+    parser.add_argument('--tick', type=float, default=5.0, help='Интервал тикера, мс')
+    parser.add_argument('--modes', nargs='+', choices=['inline', 'thread', 'pool'], default=['inline', 'thread', 'pool'])
+    parser.add_argument('--max-lag', type=float, help='Порог p99 задержки в режиме pool, мс')
+    args = parser.parse_args()
+
+    workdir: str = tempfile.mkdtemp(prefix='loop_lag_')
+    os.environ.update({'IMAGE_CACHE_DIR': os.path.join(workdir, 'images', 'cache'), 'LOG_ENABLED': '0'})
+    sys.path.insert(0, ROOT)
+    import image_pipeline
+    from image_cache import get_image_cache
+
+    # Разное содержимое картинок городов: исходная картинка + байт в конце (PNG его игнорирует)
+    with open(FIXTURE, 'rb') as file:
+        content: bytes = file.read()
+    images: list = [get_image_cache().put(f'город{i}', content + bytes([i])) for i in range(args.tiles)]
+    pipeline = image_pipeline.ImagePipeline(workers=args.workers, queue_size=args.concurrency * 2,
+                                            queue_timeout=60.0, folder=os.path.join(workdir, 'derived'))
+    # Уникальная ширина на запрос - промах кэша карточек. Ширины меньше исходной, чтобы было уменьшение
+    full_width: int = 360 * min(args.tiles, image_pipeline.IMAGE_TILE_COLUMNS)
+
+    def width(i: int) -> int:
+        return full_width - 1 - i % (full_width // 2)
+
+    def render_inline(i: int) -> None:
+        pipeline.render_sync(images, width=width(i))
+
+    async def run(mode: str) -> None:
+        # Каждый режим начинает с пустой папки карточек
+        shutil.rmtree(pipeline.folder)
+        os.makedirs(pipeline.folder)
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def one(i: int) -> None:
+            async with semaphore:
+                if mode == 'inline':
+                    render_inline(i)
+                    await asyncio.sleep(0)
+                elif mode == 'thread':
+                    await asyncio.to_thread(render_inline, i)
+                else:
+                    await pipeline.render(images, width=width(i))
+
+        await asyncio.gather(*(one(i) for i in range(args.requests)))
+
+    async def bench() -> dict:
+        await pipeline.start()  # Запуск процессов не входит в измерения
+        results: dict = {}
+        for mode in args.modes:
+            results[mode] = await measure_lag(lambda: run(mode), args.tick / 1000)
+        pipeline.shutdown()
+        return results
+
+    with contextlib.redirect_stdout(open(os.devnull, 'w')):
+        results: dict = asyncio.run(bench())
+
+    print(f"Карточек: {args.requests}, городов в карточке: {args.tiles}, одновременно: {args.concurrency}, "
+          f"процессов: {args.workers}, тикер: {args.tick} мс")
+    print(f"{'Режим':<8} {'карт./с':>10} {'p50, мс':>9} {'p99, мс':>9} {'max, мс':>9}   (задержка event loop)")
+    for mode, (lags, elapsed) in results.items():
+        print_row(mode, args.requests, lags, elapsed)
+
+    if args.max_lag is not None and 'pool' in results:
+        p99: float = percentile(results['pool'][0], 99) * 1000
+        if p99 > args.max_lag:
+            print(f"[!] p99 задержки event loop в режиме pool {p99:.2f} мс > {args.max_lag} мс")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+"""Локальный стенд вместо wttr.in и exchangerate-api.com для бенчмарков и проверок без сети
+
+Отдает записанные ответы из benchmarks/fixtures:
+ /{место}?format=j1                      → j1.json
+ /{место}_pm_lang=ru.png                 → weather.png
+ /v6/{ключ}/pair/{база}/{цель}           → курс пары (считается из latest_USD.json)
+ /v6/{ключ}/latest/{база}                → таблица курсов относительно базы
+ /v6/{ключ}/history/{база}/{Г}/{М}/{Д}   → таблица курсов на дату (слегка меняется по дням)
+ /v6/{ключ}/quota                        → остаток квоты (сам запрос квоту не расходует)
+
+Настраиваются задержка ответа, доля ошибок 503 и ошибка API quota-reached.
+Запуск отдельно:  python -m benchmarks.mock_server --port 8080 --latency 50 --error-rate 0.01
+Переменные окружения для модулей бота:
+ WTTR_URL=http://127.0.0.1:8080  EXCHANGE_API_URL=http://127.0.0.1:8080/v6"""
+
+import os
+import json
+import time
+import random
+import asyncio
+import argparse
+import threading
+from dataclasses import dataclass, field
+from aiohttp import web
+
+FIXTURES_DIR: str = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+@dataclass
+class MockConfig:
+    """Поведение стенда"""
+    latency: float = 0.0        # Средняя задержка ответа, сек
+    jitter: float = 0.0         # Разброс задержки (равномерно ±jitter), сек
+    error_rate: float = 0.0     # Доля ответов 503
+    quota_rate: float = 0.0     # Доля ответов API с ошибкой quota-reached
+    quota_after: int = -1       # После стольких запросов к API все ответы - quota-reached (-1 - выкл.)
+    counters: dict = field(default_factory=dict)  # Запросы по типам ответов
+
+
+class MockServer:
+    """Приложение aiohttp со стендом"""
+
+    def __init__(self, config: MockConfig | None = None) -> None:
+        self.config: MockConfig = config or MockConfig()
+        with open(os.path.join(FIXTURES_DIR, 'j1.json'), 'rb') as file:
+            self.j1: bytes = file.read()
+        with open(os.path.join(FIXTURES_DIR, 'weather.png'), 'rb') as file:
+            self.png: bytes = file.read()
+        with open(os.path.join(FIXTURES_DIR, 'latest_USD.json'), encoding='utf-8') as file:
+            self.latest: dict = json.load(file)
+        self.api_requests: int = 0
+
+        self.app = web.Application()
+        self.app.router.add_get('/v6/{key}/pair/{base}/{target}', self.pair)
+        self.app.router.add_get('/v6/{key}/latest/{base}', self.latest_rates)
+        self.app.router.add_get('/v6/{key}/quota', self.quota)
+        self.app.router.add_get('/v6/{key}/history/{base}/{yyyy}/{mm}/{dd}', self.history)
+        self.app.router.add_get('/v6/{key}/history/{base}/{yyyy}/{mm}/{dd}/{amount}', self.history)
+        self.app.router.add_get('/{location}', self.wttr)
+
+    def _count(self, name: str) -> None:
+        self.config.counters[name] = self.config.counters.get(name, 0) + 1
+
+    async def _delay_and_fail(self) -> web.Response | None:
+        """Задержка и, возможно, ошибка 503"""
+        config = self.config
+        if config.latency or config.jitter:
+            await asyncio.sleep(max(0.0, config.latency + random.uniform(-config.jitter, config.jitter)))
+        if config.error_rate and random.random() < config.error_rate:
+            self._count('error_503')
+            return web.Response(status=503, text='Service Unavailable')
+        return None
+
+    def _quota_error(self) -> web.Response | None:
+        """Ответ API quota-reached, если он положен по настройкам"""
+        self.api_requests += 1
+        config = self.config
+        if (0 <= config.quota_after < self.api_requests) or (config.quota_rate and random.random() < config.quota_rate):
+            self._count('quota_reached')
+            return web.json_response({'result': 'error', 'error-type': 'quota-reached'}, status=429)
+        return None
+
+    def _rates(self, base_code: str, factor: float = 1.0) -> dict | None:
+        """Таблица курсов относительно base_code, пересчитанная из таблицы USD"""
+        rates: dict = self.latest['conversion_rates']
+        if base_code not in rates:
+            return None
+        base_rate: float = rates[base_code]
+        return {code: round(rate / base_rate * factor, 6) if code != base_code else 1
+                for code, rate in rates.items()}
+
+    async def wttr(self, request: web.Request) -> web.Response:
+        failed = await self._delay_and_fail()
+        if failed is not None:
+            return failed
+        if request.match_info['location'].endswith('.png'):
+            self._count('wttr_png')
+            return web.Response(body=self.png, content_type='image/png')
+        self._count('wttr_j1')
+        return web.Response(body=self.j1, content_type='application/json')
+
+    async def pair(self, request: web.Request) -> web.Response:
+        failed = await self._delay_and_fail() or self._quota_error()
+        if failed is not None:
+            return failed
+        self._count('pair')
+        rates = self._rates(request.match_info['base'])
+        target: str = request.match_info['target']
+        if rates is None or target not in rates:
+            return web.json_response({'result': 'error', 'error-type': 'unsupported-code'}, status=404)
+        return web.json_response({'result': 'success', 'base_code': request.match_info['base'],
+                                  'target_code': target, 'conversion_rate': rates[target]})
+
+    async def latest_rates(self, request: web.Request) -> web.Response:
+        failed = await self._delay_and_fail() or self._quota_error()
+        if failed is not None:
+            return failed
+        self._count('latest')
+        rates = self._rates(request.match_info['base'])
+        if rates is None:
+            return web.json_response({'result': 'error', 'error-type': 'unsupported-code'}, status=404)
+        now: int = int(time.time())  # Время обновления - как у живого сервиса (раз в сутки), иначе таблица сразу "устаревает"
+        return web.json_response({**self.latest, 'base_code': request.match_info['base'], 'conversion_rates': rates,
+                                  'time_last_update_unix': now - now % 86400,
+                                  'time_next_update_unix': now - now % 86400 + 86400})
+
+    async def quota(self, request: web.Request) -> web.Response:
+        failed = await self._delay_and_fail()
+        if failed is not None:
+            return failed
+        self._count('quota')
+        total: int = self.config.quota_after if self.config.quota_after >= 0 else 1500
+        return web.json_response({'result': 'success', 'requests_quota': total,
+                                  'requests_remaining': max(total - self.api_requests, 0),
+                                  'refresh_day_of_month': 1})
+
+    async def history(self, request: web.Request) -> web.Response:
+        failed = await self._delay_and_fail() or self._quota_error()
+        if failed is not None:
+            return failed
+        self._count('history')
+        day: int = int(request.match_info['dd'])
+        rates = self._rates(request.match_info['base'], factor=1 + (day % 7 - 3) / 100)  # Курсы "гуляют" по дням
+        if rates is None:
+            return web.json_response({'result': 'error', 'error-type': 'unsupported-code'}, status=404)
+        return web.json_response({'result': 'success', 'base_code': request.match_info['base'],
+                                  'year': int(request.match_info['yyyy']), 'month': int(request.match_info['mm']),
+                                  'day': day, 'conversion_rates': rates})
+
+
+def start_in_thread(config: MockConfig | None = None, host: str = '127.0.0.1', port: int = 0) -> tuple:
+    """Запускает стенд в отдельном потоке со своим event loop.
+    Возвращает (базовый URL, MockServer, функция остановки)"""
+
+    server = MockServer(config)
+    started = threading.Event()
+    state: dict = {}
+
+    def run() -> None:
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        runner = web.AppRunner(server.app, access_log=None)
+        loop.run_until_complete(runner.setup())
+        site = web.TCPSite(runner, host, port)
+        loop.run_until_complete(site.start())
+        state['port'] = site._server.sockets[0].getsockname()[1]
+        state['loop'] = loop
+        state['runner'] = runner
+        started.set()
+        loop.run_forever()
+        loop.run_until_complete(runner.cleanup())
+        loop.close()
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    started.wait()
+
+    def stop() -> None:
+        state['loop'].call_soon_threadsafe(state['loop'].stop)
+        thread.join(timeout=5)
+
+    return f'http://{host}:{state["port"]}', server, stop
+
+
+def main() -> None:
+    """Запуск стенда из командной строки"""
+    parser = argparse.ArgumentParser(description='Локальный стенд wttr.in и exchangerate-api.com')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--latency', type=float, default=0.0, help='Задержка ответа, мс')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Разброс задержки, мс')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Доля ответов 503')
+    parser.add_argument('--quota-rate', type=float, default=0.0, help='Доля ответов quota-reached')
+    parser.add_argument('--quota-after', type=int, default=-1, help='quota-reached после N запросов к API')
+    args = parser.parse_args()
+
+    server = MockServer(MockConfig(latency=args.latency / 1000, jitter=args.jitter / 1000,
+                                   error_rate=args.error_rate, quota_rate=args.quota_rate,
+                                   quota_after=args.quota_after))
+    print(f"[i] Стенд: WTTR_URL=http://{args.host}:{args.port} EXCHANGE_API_URL=http://{args.host}:{args.port}/v6")
+    web.run_app(server.app, host=args.host, port=args.port, access_log=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""Несколько экземпляров бота на одном стенде: сколько запросов уходит к сервисам с общим хранилищем и без
+
+Запускается --replicas процессов. Каждый одновременно запрашивает погоду для одних и тех же городов
+и таблицу курсов (как при одинаковых командах пользователей в разных экземплярах), а затем делает
+--quota-calls запросов таблицы в обход кэша - проверка общего лимита квоты (API_MONTHLY_QUOTA=--quota).
+Хранилища: local (у каждого процесса свое, как без общего состояния), sqlite и fakeredis
+(RedisBackend с tests/fake_redis.py по сети). Итог - запросы к стенду по видам.
+
+Примеры:
+    python -m benchmarks.replicas
+    python -m benchmarks.replicas --replicas 8 --cities 20 --backends sqlite fakeredis"""
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+import contextlib
+import multiprocessing
+
+from benchmarks.mock_server import MockConfig, start_in_thread
+from tests import fake_redis
+
+ROOT: str = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def replica(env: dict, redis_address: tuple | None, cities: list, quota_calls: int, start) -> None:
+    """Один экземпляр бота (отдельный процесс). Модули проекта импортируются после настройки окружения"""
+    os.environ.update(env)
+    sys.path.insert(0, ROOT)
+    with contextlib.redirect_stdout(open(os.devnull, 'w')):
+        import shared_state
+        if redis_address is not None:
+            shared_state.set_backend(shared_state.RedisBackend(fake_redis.connect(redis_address)))
+        import weather
+        import rate_engine
+
+        engine = rate_engine.RateEngine('bench')
+        start.wait()  # Все экземпляры начинают одновременно
+        for city in cities:
+            weather.get_weather_data(city)
+        engine.rate('EUR', 'RUB')
+        for _ in range(quota_calls):
+            rate_engine.fetch_rate_table('bench', 'USD')
+
+
+def run(backend: str, args, base_url: str, server, workdir: str) -> dict:
+    """Один прогон: все экземпляры с хранилищем backend. Возвращает запросы к стенду за прогон"""
+    env: dict = {'WTTR_URL': base_url, 'EXCHANGE_API_URL': f'{base_url}/v6', 'LOG_ENABLED': '0', 'METRICS_PORT': '0',
+                 'HTTP_RATE_LIMIT': '0', 'HISTORY_DB': os.path.join(workdir, f'{backend}_history.sqlite3'),
+                 'IMAGE_CACHE_DIR': os.path.join(workdir, backend, 'images'), 'API_MONTHLY_QUOTA': str(args.quota),
+                 'SHARED_BACKEND': f"sqlite:{os.path.join(workdir, 'shared.sqlite3')}" if backend == 'sqlite' else 'local'}
+    manager = None
+    redis_address: tuple | None = None
+    if backend == 'fakeredis':
+        redis_address, manager = fake_redis.serve()
+
+    context = multiprocessing.get_context('spawn')
+    start = context.Event()
+    cities: list = ['Москва', 'Казань', 'Уфа', 'Пермь', 'Омск', 'Тула', 'Сочи', 'Курск', 'Томск', 'Чита'][:args.cities]
+    processes: list = [context.Process(target=replica, args=(env, redis_address, cities, args.quota_calls, start))
+                       for _ in range(args.replicas)]
+    for process in processes:
+        process.start()
+    time.sleep(args.startup)  # Процессы успевают импортировать модули
+    before: dict = dict(server.config.counters)
+    start.set()
+    for process in processes:
+        process.join()
+    if manager is not None:
+        manager.shutdown()
+    return {name: count - before.get(name, 0) for name, count in server.config.counters.items()
+            if count - before.get(name, 0)}
+
+
+def main() -> None:
+    """Точка входа с парсингом аргументов из командной строки."""
+    parser = argparse.ArgumentParser(description='Запросы к сервисам от нескольких экземпляров бота')
+    parser.add_argument('--replicas', type=int, default=4, help='Экземпляров бота (процессов)')
+    parser.add_argument('--cities', type=int, default=10, help='Городов (не больше 10)')
+    parser.add_argument('--quota', type=int, default=10, help='Общий лимит запросов к exchangerate-api')
+    parser.add_argument('--quota-calls', type=int, default=5, help='Запросов таблицы курсов в обход кэша на экземпляр')
+    parser.add_argument('--latency', type=float, default=50.0, help='Задержка ответа стенда, мс')
+    parser.add_argument('--startup', type=float, default=3.0, help='Пауза на запуск процессов, сек')
+    parser.add_argument('--backends', nargs='+', choices=['local', 'sqlite', 'fakeredis'],
+                        default=['local', 'sqlite', 'fakeredis'])
+    args = parser.parse_args()
+
+    base_url, server, stop = start_in_thread(MockConfig(latency=args.latency / 1000))
+    workdir: str = tempfile.mkdtemp(prefix='replicas_')
+    try:
+        results: dict = {backend: run(backend, args, base_url, server, workdir) for backend in args.backends}
+    finally:
+        stop()
+
+    print(f"Экземпляров: {args.replicas}, городов: {args.cities}, лимит квоты: {args.quota}, "
+          f"запросов таблицы в обход кэша: {args.replicas} x {args.quota_calls}")
+    print(f"{'Хранилище':<10} {'wttr j1':>8} {'latest':>8}   (запросов к стенду)")
+    for backend, counters in results.items():
+        print(f"{backend:<10} {counters.get('wttr_j1', 0):>8} {counters.get('latest', 0):>8}")
+
+
+if __name__ == "__main__":
+    main()
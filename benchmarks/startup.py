@@ -0,0 +1,141 @@
+"""Время старта CLI: импорт модулей и полный запуск команды напрямую и через демон (cli_daemon.py)
+
+Сценарии:
+ - import <модуль> - время импорта в новом интерпретаторе (python -X importtime, накопленное время модуля)
+ - cli: ...        - запуск команды отдельным процессом от старта интерпретатора до выхода
+                     (напрямую; python weather.py через демон; python cli_daemon.py weather без импорта модулей)
+Таблица и --json/--baseline те же, что у benchmarks.bench: регрессии старта ищутся так же.
+
+Примеры:
+    python -m benchmarks.startup
+    python -m benchmarks.startup --iterations 50 --latency 20 --json startup.json
+    python -m benchmarks.startup --baseline startup.json --max-regression 0.25"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+from dataclasses import asdict
+
+from benchmarks.mock_server import MockConfig, start_in_thread
+from benchmarks.bench import ROOT, BenchResult, percentile, bench_cli, print_results, find_regressions
+
+# Модули, которые импортирует CLI
+MODULES: tuple = ('weather', 'currency_exchange', 'cli_daemon')
+
+
+def import_time(module: str, iterations: int, env: dict, cwd: str) -> list:
+    """Время импорта module в новом интерпретаторе, сек (по строке -X importtime самого модуля)"""
+    times: list = []
+    for _ in range(iterations):
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], env=env, cwd=cwd,
+                                check=True, capture_output=True, text=True)
+        for line in reversed(result.stderr.splitlines()):
+            fields: list = [field.strip() for field in line.split('|')]
+            if len(fields) == 3 and fields[2] == module:
+                times.append(int(fields[1]) / 1_000_000)  # Накопленное время, мкс
+                break
+    return times
+
+
+def bench_import(module: str, iterations: int, env: dict, cwd: str) -> BenchResult:
+    times: list = import_time(module, iterations, env, cwd)
+    return BenchResult(f'import {module}', iterations, iterations / sum(times),
+                       percentile(times, 50) * 1000, percentile(times, 99) * 1000, 0.0)
+
+
+def start_daemon(env: dict, cwd: str, path: str, timeout: float = 30.0) -> subprocess.Popen:
+    """Запускает демон CLI и ждет появления сокета"""
+    process = subprocess.Popen([sys.executable, os.path.join(ROOT, 'cli_daemon.py'), 'serve', '--socket', path],
+                               env=env, cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline: float = time.monotonic() + timeout
+    while not os.path.exists(path):
+        if process.poll() is not None or time.monotonic() > deadline:
+            process.kill()
+            raise RuntimeError('Демон CLI не запустился')
+        time.sleep(0.05)
+    return process
+
+
+def run_benchmarks(iterations: int, env: dict, workdir: str) -> list:
+    """Все сценарии: импорт, CLI напрямую, CLI через демон"""
+    weather_args: list = ['--noimage', '--city', 'Казань']
+    currency_args: list = ['current']
+
+    results: list = [bench_import(module, iterations, env, workdir) for module in MODULES]
+    results += [
+        bench_cli('cli: weather.py --noimage', [os.path.join(ROOT, 'weather.py'), *weather_args],
+                  iterations, env, workdir),
+        bench_cli('cli: currency_exchange.py current', [os.path.join(ROOT, 'currency_exchange.py'), *currency_args],
+                  iterations, env, workdir),
+    ]
+
+    # Через демон: модули импортированы, HTTP-сессии и кэши теплые
+    socket_path: str = os.path.join(workdir, 'cli.sock')
+    daemon_env: dict = {**env, 'CLI_DAEMON_SOCKET': socket_path}
+    other_dir: str = os.path.join(workdir, 'client')
+    os.makedirs(other_dir, exist_ok=True)
+    # Кэш картинок демона - по относительному пути, как по умолчанию: запуски из workdir, затем из other_dir
+    # проверяют, что путь не зависит от каталога клиента
+    daemon = start_daemon({**env, 'IMAGE_CACHE_DIR': os.path.join('images', 'cache')}, workdir, socket_path)
+    try:
+        results += [
+            bench_cli('cli (демон): weather.py --noimage', [os.path.join(ROOT, 'weather.py'), *weather_args],
+                      iterations, daemon_env, workdir),
+            bench_cli('cli (демон): cli_daemon.py weather --noimage',
+                      [os.path.join(ROOT, 'cli_daemon.py'), 'weather', *weather_args], iterations, daemon_env, workdir),
+            bench_cli('cli (демон): cli_daemon.py currency_exchange current',
+                      [os.path.join(ROOT, 'cli_daemon.py'), 'currency_exchange', *currency_args],
+                      iterations, daemon_env, workdir),
+            bench_cli('cli (демон): weather.py (PNG)', [os.path.join(ROOT, 'weather.py'), '--city', 'Казань'],
+                      iterations, daemon_env, workdir),
+            bench_cli('cli (демон, другой каталог): weather.py (PNG)',
+                      [os.path.join(ROOT, 'weather.py'), '--city', 'Казань'], iterations, daemon_env, other_dir),
+        ]
+    finally:
+        daemon.terminate()
+        daemon.wait()
+    return results
+
+
+def main() -> None:
+    """Точка входа с парсингом аргументов из командной строки."""
+    parser = argparse.ArgumentParser(description='Время старта CLI: импорт и запуск напрямую и через демон')
+    parser.add_argument('--iterations', type=int, default=20, help='Запусков на сценарий')
+    parser.add_argument('--latency', type=float, default=0.0, help='Задержка ответа стенда, мс')
+    parser.add_argument('--json', help='Сохранить результаты в JSON')
+    parser.add_argument('--baseline', help='JSON с базовыми результатами для поиска регрессий')
+    parser.add_argument('--max-regression', type=float, default=0.25, help='Допустимое замедление p50 (0.25 = 25%%)')
+    args = parser.parse_args()
+
+    base_url, server, stop = start_in_thread(MockConfig(latency=args.latency / 1000))
+    workdir: str = tempfile.mkdtemp(prefix='startup_')
+
+    # Окружение процессов CLI и демона: стенд вместо сервисов, без CLI_DAEMON_SOCKET пользователя
+    env: dict = {**os.environ, 'WTTR_URL': base_url, 'EXCHANGE_API_URL': f'{base_url}/v6', 'API_KEY': 'bench',
+                 'HISTORY_DB': os.path.join(workdir, 'history.sqlite3'),
+                 'IMAGE_CACHE_DIR': os.path.join(workdir, 'images', 'cache'), 'PYTHONPATH': ROOT,
+                 'HTTP_RATE_LIMIT': '0'}
+    env.pop('CLI_DAEMON_SOCKET', None)
+
+    try:
+        results: list = run_benchmarks(args.iterations, env, workdir)
+    finally:
+        stop()
+
+    regressions: set = find_regressions(results, args.baseline, args.max_regression) if args.baseline else set()
+    print_results(results, regressions)
+    print(f"[i] Запросов к стенду: {server.config.counters}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as file:
+            json.dump([asdict(result) for result in results], file, ensure_ascii=False, indent=4)
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""Рассылка по подпискам на локальном стенде: сколько запросов к сервисам и к Bot API на N подписчиков
+
+Создается --subscribers подписок на погоду (в одну минуту, --cities разных мест) и столько же правил курса
+(--pairs пар, пороги вразброс). Затем выполняется слот погоды и проверка правил (scheduler.py), а сообщения
+уходят в заглушку Bot API (Notifier без ограничения скорости). Итог - время задач, запросы к стенду,
+число уведомлений и запросов отправки (после объединения сообщений одному чату), а также сколько заняла бы
+отправка при лимите TELEGRAM_SEND_RATE.
+
+Примеры:
+    python -m benchmarks.subscriptions
+    python -m benchmarks.subscriptions --subscribers 50000 --cities 200 --pairs 20 --latency 50"""
+
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import contextlib
+
+from benchmarks.mock_server import MockConfig, start_in_thread
+
+ROOT: str = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CURRENCIES: list = ['RUB', 'EUR', 'KZT', 'CNY', 'TRY', 'AED', 'GBP', 'JPY', 'CHF', 'UZS']
+
+
+async def run(args) -> dict:
+    """Подписки, слот погоды и проверка правил. Модули проекта импортируются после настройки окружения"""
+    import subscriptions
+    import notifier
+    import scheduler
+    import weather
+    import http_client
+    from rate_engine import RateEngine
+
+    store = subscriptions.get_store()
+    cities: list = [f'Город{i}' for i in range(args.cities)]
+    pairs: list = [(base, target) for base in ('USD', 'EUR') for target in CURRENCIES if base != target][:args.pairs]
+    started: float = time.perf_counter()
+    for chat_id in range(args.subscribers):
+        city: str = cities[chat_id % len(cities)]
+        store.add(subscriptions.Subscription(chat_id, subscriptions.WEATHER, location=city,
+                                             location_key=weather.normalize_location(city), minute=7 * 60))
+        base, target = pairs[chat_id % len(pairs)]
+        store.add(subscriptions.Subscription(chat_id, subscriptions.RATE, base=base, target=target,
+                                             op=random.choice('<>'), threshold=random.uniform(0, 200)))
+    create_seconds: float = time.perf_counter() - started
+
+    sends: list = []
+
+    async def send(chat_id: int, text: str) -> None:
+        sends.append(chat_id)
+
+    sender = notifier.Notifier(rate=1e9)
+    sender.start(send)
+    subscription_scheduler = scheduler.SubscriptionScheduler(RateEngine('bench'), sender, store)
+
+    started = time.perf_counter()
+    weather_alerts: int = await subscription_scheduler.run_weather(7 * 60)
+    weather_seconds: float = time.perf_counter() - started
+    started = time.perf_counter()
+    rate_alerts: int = await subscription_scheduler.run_rates()
+    rates_seconds: float = time.perf_counter() - started
+    started = time.perf_counter()
+    await sender.join()
+    send_seconds: float = time.perf_counter() - started
+    await sender.stop()
+    await http_client.close_async_session()
+
+    return {'create': create_seconds, 'weather': weather_seconds, 'rates': rates_seconds, 'send': send_seconds,
+            'alerts': weather_alerts + rate_alerts, 'weather_alerts': weather_alerts, 'rate_alerts': rate_alerts,
+            'sends': len(sends), 'send_rate': notifier.TELEGRAM_SEND_RATE}
+
+
+def main() -> None:
+    """Точка входа с парсингом аргументов из командной строки."""
+    parser = argparse.ArgumentParser(description='Рассылка по подпискам на локальном стенде')
+    parser.add_argument('--subscribers', type=int, default=10000, help='Подписчиков (у каждого погода и правило курса)')
+    parser.add_argument('--cities', type=int, default=100, help='Разных мест в подписках на погоду')
+    parser.add_argument('--pairs', type=int, default=10, help='Разных валютных пар в правилах (не больше 19)')
+    parser.add_argument('--latency', type=float, default=0.0, help='Задержка ответа стенда, мс')
+    args = parser.parse_args()
+
+    base_url, server, stop = start_in_thread(MockConfig(latency=args.latency / 1000))
+    workdir: str = tempfile.mkdtemp(prefix='subscriptions_')
+    os.environ.update({'WTTR_URL': base_url, 'EXCHANGE_API_URL': f'{base_url}/v6', 'LOG_ENABLED': '0',
+                       'METRICS_PORT': '0', 'HTTP_RATE_LIMIT': '0',
+                       'HISTORY_DB': os.path.join(workdir, 'history.sqlite3'),
+                       'IMAGE_CACHE_DIR': os.path.join(workdir, 'images', 'cache'),
+                       'SUBSCRIPTIONS_DB': os.path.join(workdir, 'subscriptions.sqlite3')})
+    sys.path.insert(0, ROOT)
+
+    try:
+        with contextlib.redirect_stdout(open(os.devnull, 'w')):
+            result: dict = asyncio.run(run(args))
+    finally:
+        stop()
+
+    print(f"Подписчиков: {args.subscribers}, мест: {args.cities}, валютных пар: {args.pairs}")
+    print(f"[t] Создание подписок:   {result['create'] * 1000:9.1f} мс")
+    print(f"[t] Слот погоды:         {result['weather'] * 1000:9.1f} мс ({result['weather_alerts']} уведомлений)")
+    print(f"[t] Проверка правил:     {result['rates'] * 1000:9.1f} мс ({result['rate_alerts']} уведомлений)")
+    print(f"[t] Рассылка (заглушка): {result['send'] * 1000:9.1f} мс")
+    print(f"[i] Запросов к стенду: {server.config.counters}")
+    print(f"[i] Уведомлений: {result['alerts']}, запросов отправки: {result['sends']} "
+          f"(при {result['send_rate']:g} сообщ./с - {result['sends'] / result['send_rate']:.0f} с)")
+
+
+if __name__ == "__main__":
+    main()
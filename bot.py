@@ -1,9 +1,329 @@
 import os
+import time
+import asyncio
+import argparse
+from datetime import datetime
+from aiogram import Bot, Dispatcher, Router
+from aiogram.filters import Command, CommandObject
+from aiogram.types import Message, FSInputFile
+from aiogram.methods import GetUpdates
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
 from dotenv import load_dotenv
 
+import http_client
+import metrics
+from metrics import log
+from weather import get_weather_async, get_weather_png_async, validate_city_arg, normalize_location
+from image_cache import CachedImage, get_image_cache
+from image_pipeline import IMAGE_TILE_MAX, PipelineBusy, get_pipeline
+from currency_exchange import get_history_exchange_rate_async, valid_currencies
+from rate_engine import RateEngine
+from prefetcher import Prefetcher
+from subscriptions import Subscription, WEATHER, RATE, SUBSCRIPTIONS_PER_CHAT, parse_minute, parse_rule
+from notifier import Notifier
+from scheduler import SubscriptionScheduler
+
 # Загружаем переменные из файла .env в окружение процесса
 load_dotenv()
 BOT_TOKEN = os.getenv("BOT_TOKEN")
+API_KEY = os.getenv("API_KEY")
+
+router = Router()
+
+# Таблица курсов: /rate и /convert считаются локально из одного запроса /latest
+rate_engine: RateEngine = RateEngine(API_KEY)
+
+# Прогрев кэшей для популярных городов и валютных пар
+prefetcher: Prefetcher = Prefetcher(rate_engine)
+
+# Подписки на уведомления: планировщик слотов и пакетная рассылка (запускаются при старте бота)
+notifier: Notifier = Notifier()
+scheduler: SubscriptionScheduler = SubscriptionScheduler(rate_engine, notifier)
+
+# Подпись к картинке в Telegram - не длиннее 1024 символов
+CAPTION_LIMIT: int = 1024
+
+HELP_TEXT = """Доступные команды:
+/weather [город] - текущая погода (по умолчанию Москва)
+/weather <город>, <город>, ... - погода в нескольких городах одной карточкой
+/rate [база] [цель] - текущий курс валюты (по умолчанию USD RUB)
+/convert <сумма> [база] [цель] - конвертация по текущему курсу
+/history <ГГГГ-ММ-ДД> [база] [цель] [сумма] - исторический курс валюты
+/subscribe weather <город> <ЧЧ:ММ> - погода каждый день в заданное время
+/subscribe rate <база>/<цель> <>|<> <порог> - уведомление, когда курс выше или ниже порога
+/subscriptions - список подписок
+/unsubscribe <номер>|all - отменить подписку"""
+
+SUBSCRIBE_USAGE = """[!] Формат:
+/subscribe weather Уфа 07:00
+/subscribe rate USD/RUB > 100"""
+
+
+class SendTimingMiddleware(BaseRequestMiddleware):
+    """Время запросов к Bot API (отправка сообщений и картинок) в метрике telegram_send_seconds.
+    Long polling getUpdates не учитывается: он по определению ждет до таймаута"""
+
+    async def __call__(self, make_request, bot: Bot, method):
+        if isinstance(method, GetUpdates):
+            return await make_request(bot, method)
+
+        started: float = time.perf_counter()
+        status: str = 'ok'
+        try:
+            return await make_request(bot, method)
+        except Exception as e:
+            status = type(e).__name__
+            raise
+        finally:
+            metrics.telegram_send_seconds.observe(time.perf_counter() - started,
+                                                  method=type(method).__name__, status=status)
+
+
+def parse_currency(currency: str) -> str | None:
+    """Приводит код валюты к верхнему регистру и проверяет его. None - если код не существует"""
+    currency = currency.strip().upper()
+    return currency if currency in valid_currencies else None
+
+
+@router.message(Command('start', 'help'))
+async def cmd_help(message: Message) -> None:
+    """Выводит список команд"""
+    await message.answer(HELP_TEXT)
+
+
+@router.message(Command('weather'))
+async def cmd_weather(message: Message, command: CommandObject) -> None:
+    """Погода в городе: текст и картинка wttr.in запрашиваются параллельно, картинка отправляется карточкой.
+    Несколько городов через запятую - одна карточка со всеми картинками"""
+    try:
+        cities: list = list(dict.fromkeys(validate_city_arg(city) for city in (command.args or 'Москва').split(',')))
+    except argparse.ArgumentTypeError as e:  # Короткое название или цифры в названии
+        await message.answer(str(e))
+        return
+    if len(cities) > IMAGE_TILE_MAX:
+        await message.answer(f"[!] Не больше {IMAGE_TILE_MAX} городов в одном запросе")
+        return
+    for city in cities:
+        prefetcher.record_location(city)
+
+    results: list = await asyncio.gather(*(asyncio.gather(get_weather_async(city), get_weather_png_async(city))
+                                           for city in cities))
+    texts: list = [text for text, _ in results if text is not None]
+    images: list = [image for _, image in results if image is not None]
+
+    if not texts and not images:
+        await message.answer(f"[!] Не удалось получить погоду для города {', '.join(cities)}")
+        return
+    if not images:
+        await message.answer('\n\n'.join(texts))
+        return
+
+    caption: str = '\n\n'.join(texts)
+    if len(caption) > CAPTION_LIMIT:
+        await message.answer(caption)  # Длинный текст - отдельным сообщением, картинка без подписи
+        caption = ''
+
+    try:
+        card: CachedImage = await get_pipeline().render(images)
+    except PipelineBusy as e:
+        log(f"[!] {e}: отправляем исходные картинки")
+    except Exception as e:  # Ошибка Pillow или пула процессов - пользователь все равно получит картинки
+        log(f"[!] Ошибка обработки картинки: {e}")
+    else:
+        await send_photo(message, card, caption, get_pipeline().set_file_id)
+        return
+
+    for image in images:
+        await send_photo(message, image, caption, get_image_cache().set_file_id)
+        caption = ''
+
+
+async def send_photo(message: Message, image: CachedImage, caption: str, remember_file_id) -> None:
+    """Отправляет картинку. После первой отправки запоминает file_id через remember_file_id(sha, file_id)"""
+    if image.file_id is not None:
+        # Картинка уже есть на серверах Telegram - файл не читаем и не загружаем заново
+        await message.answer_photo(image.file_id, caption=caption or None)
+    else:
+        sent: Message = await message.answer_photo(FSInputFile(image.path), caption=caption or None)
+        remember_file_id(image.sha, sent.photo[-1].file_id)
+
+
+@router.message(Command('rate'))
+async def cmd_rate(message: Message, command: CommandObject) -> None:
+    """Текущий курс валюты: /rate USD RUB"""
+    args: list = (command.args or '').split()
+    base_code = parse_currency(args[0]) if len(args) > 0 else 'USD'
+    target_code = parse_currency(args[1]) if len(args) > 1 else 'RUB'
+    if base_code is None or target_code is None:
+        await message.answer("[!] Название валюты не существует")
+        return
+    prefetcher.record_currency_pair(base_code, target_code)
+
+    rate: float = await rate_engine.rate_async(base_code, target_code)
+    if rate == 0.0:
+        await message.answer("[!] Не удалось получить курс валюты")
+        return
+    await message.answer(f"1 {base_code} стоит {rate:.4f} {target_code}")
+
+
+@router.message(Command('convert'))
+async def cmd_convert(message: Message, command: CommandObject) -> None:
+    """Конвертация по текущему курсу: /convert 100 USD RUB"""
+    args: list = (command.args or '').split()
+    try:
+        amount = float(args[0].replace(',', '.'))
+    except (IndexError, ValueError):
+        await message.answer("[!] Укажите сумму: /convert 100 USD RUB")
+        return
+    base_code = parse_currency(args[1]) if len(args) > 1 else 'USD'
+    target_code = parse_currency(args[2]) if len(args) > 2 else 'RUB'
+    if base_code is None or target_code is None:
+        await message.answer("[!] Название валюты не существует")
+        return
+    prefetcher.record_currency_pair(base_code, target_code)
+
+    rate: float = await rate_engine.rate_async(base_code, target_code)
+    if rate == 0.0:
+        await message.answer("[!] Не удалось получить курс валюты")
+        return
+    await message.answer(f"{amount} {base_code} стоит {amount * rate:.2f} {target_code}")
+
+
+@router.message(Command('history'))
+async def cmd_history(message: Message, command: CommandObject) -> None:
+    """Исторический курс валюты: /history 2024-01-05 USD RUB 100"""
+    args: list = (command.args or '').split()
+    try:
+        date = datetime.strptime(args[0], '%Y-%m-%d')
+        amount = float(args[3].replace(',', '.')) if len(args) > 3 else 1.0
+    except (IndexError, ValueError):
+        await message.answer("[!] Формат: /history ГГГГ-ММ-ДД USD RUB 100")
+        return
+    if date > datetime.now():
+        await message.answer("[!] Дата не может быть в будущем")
+        return
+    base_code = parse_currency(args[1]) if len(args) > 1 else 'USD'
+    target_code = parse_currency(args[2]) if len(args) > 2 else 'RUB'
+    if base_code is None or target_code is None:
+        await message.answer("[!] Название валюты не существует")
+        return
+
+    rate = await get_history_exchange_rate_async(API_KEY, base_code, target_code,
+                                                 f'{date.year}', f'{date.month:02}', f'{date.day:02}', amount)
+    if rate is None:
+        await message.answer("[!] Не удалось получить исторический курс валюты")
+        return
+    await message.answer(f"{date:%Y.%m.%d}: {amount} {base_code} стоил {rate} {target_code}")
+
+
+@router.message(Command('subscribe'))
+async def cmd_subscribe(message: Message, command: CommandObject) -> None:
+    """Подписка на уведомления: /subscribe weather Уфа 07:00, /subscribe rate USD/RUB > 100"""
+    kind, _, rest = (command.args or '').strip().partition(' ')
+    chat_id: int = message.chat.id
+    try:
+        if kind == WEATHER:
+            location, _, at = rest.strip().rpartition(' ')
+            location = validate_city_arg(location)
+            subscription = Subscription(chat_id, WEATHER, location=location, location_key=normalize_location(location),
+                                        minute=parse_minute(at))
+        elif kind == RATE:
+            base_code, target_code, op, threshold = parse_rule(rest)
+            subscription = Subscription(chat_id, RATE, base=base_code, target=target_code, op=op, threshold=threshold)
+        else:
+            await message.answer(SUBSCRIBE_USAGE)
+            return
+    except argparse.ArgumentTypeError as e:  # Некорректное название города
+        await message.answer(str(e))
+        return
+    except ValueError as e:
+        await message.answer(f"[!] {e}\n{SUBSCRIBE_USAGE}")
+        return
+
+    if scheduler.store.count(chat_id) >= SUBSCRIPTIONS_PER_CHAT:
+        await message.answer(f"[!] Не больше {SUBSCRIPTIONS_PER_CHAT} подписок в одном чате")
+        return
+    subscription = scheduler.subscribe(subscription)
+    await message.answer(f"[ok] Подписка {subscription.id}: {subscription.describe()}")
+
+
+@router.message(Command('subscriptions'))
+async def cmd_subscriptions(message: Message) -> None:
+    """Список подписок чата"""
+    chat_subscriptions: list = scheduler.store.for_chat(message.chat.id)
+    if not chat_subscriptions:
+        await message.answer("[i] Подписок нет. Добавить: /subscribe")
+        return
+    await message.answer('\n'.join(f"{subscription.id}: {subscription.describe()}"
+                                   for subscription in chat_subscriptions))
+
+
+@router.message(Command('unsubscribe'))
+async def cmd_unsubscribe(message: Message, command: CommandObject) -> None:
+    """Отмена подписки: /unsubscribe 12 или /unsubscribe all"""
+    arg: str = (command.args or '').strip()
+    if arg == 'all':
+        removed: int = scheduler.store.remove_chat(message.chat.id)
+        await message.answer(f"[ok] Удалено подписок: {removed}")
+        return
+    if not arg.isdigit():
+        await message.answer("[!] Укажите номер подписки (/subscriptions) или all")
+        return
+    if not scheduler.unsubscribe(message.chat.id, int(arg)):
+        await message.answer(f"[!] Подписки {arg} нет")
+        return
+    await message.answer(f"[ok] Подписка {arg} отменена")
+
+
+async def on_startup(dispatcher: Dispatcher, bot: Bot) -> None:
+    """Одна HTTP-сессия на весь процесс (общий пул соединений для всех чатов), запуск пула обработки картинок,
+    прогрева кэшей, рассылки по подпискам и эндпоинта /metrics (METRICS_PORT=0 - без эндпоинта)"""
+    http_client.get_async_session()
+    await get_pipeline().start()
+    dispatcher['prefetch_task'] = asyncio.create_task(prefetcher.run())
+    notifier.start(bot.send_message, on_blocked=scheduler.remove_chat)
+    dispatcher['scheduler_task'] = asyncio.create_task(scheduler.run())
+    dispatcher['metrics_runner'] = await metrics.start_server() if metrics.METRICS_PORT else None
+
+
+async def on_shutdown(dispatcher: Dispatcher) -> None:
+    """Останавливает прогрев, рассылку, эндпоинт метрик и пул обработки картинок, закрывает общую HTTP-сессию"""
+    dispatcher['prefetch_task'].cancel()
+    dispatcher['scheduler_task'].cancel()
+    await notifier.stop()
+    get_pipeline().shutdown()
+    if dispatcher['metrics_runner'] is not None:
+        await dispatcher['metrics_runner'].cleanup()
+    await http_client.close_async_session()
+
+
+def create_dispatcher() -> Dispatcher:
+    """Создает диспетчер с обработчиками команд"""
+    dispatcher = Dispatcher()
+    dispatcher.include_router(router)
+    dispatcher.startup.register(on_startup)
+    dispatcher.shutdown.register(on_shutdown)
+    return dispatcher
+
+
+async def main() -> None:
+    """Точка входа: запуск бота в режиме long polling"""
+
+    if not BOT_TOKEN:
+        raise RuntimeError("BOT_TOKEN не задан")
+    if not API_KEY:
+        raise RuntimeError("API_KEY не задан")
+
+    # Создаем папку для изображений, если ее нет
+    os.makedirs('images', exist_ok=True)
+
+    bot = Bot(token=BOT_TOKEN)
+    bot.session.middleware(SendTimingMiddleware())
+    dispatcher = create_dispatcher()
+    # handle_as_tasks (по умолчанию True) - каждое обновление обрабатывается в отдельной задаче,
+    # поэтому медленный ответ wttr.in не блокирует остальные чаты
+    await dispatcher.start_polling(bot)
+
 
-if not BOT_TOKEN:
-    raise RuntimeError("BOT_TOKEN не задан")
\ No newline at end of file
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,182 @@
+"""Кэш в памяти процесса с временем жизни записей (TTL) и вытеснением по LRU
+
+Режим stale-while-revalidate (stale_ttl > 0): после истечения TTL запись еще stale_ttl секунд
+отдается как есть, а обновление выполняется в фоне (поток или задача asyncio).
+Режим stale-if-error (stale_if_error > 0): если обновить запись не удалось (сервис недоступен,
+circuit breaker открыт), до stale_if_error секунд после истечения TTL отдается последнее значение.
+Общий кэш (shared, shared_state.SharedCache): при промахе значение сначала ищется в хранилище, общем для
+экземпляров бота, а запрос к сервису выполняет только один экземпляр.
+Для кэша с именем (name) время поиска пишется в метрику cache_lookup_seconds с результатом hit/stale/expired/miss."""
+
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable
+
+import metrics
+
+
+class TTLCache:
+    """LRU-кэш с TTL. Потокобезопасный, значение None не кэшируется"""
+
+    def __init__(self, ttl: float, maxsize: int = 256, stale_ttl: float = 0.0, name: str | None = None,
+                 stale_if_error: float = 0.0, shared=None) -> None:
+        self.ttl: float = ttl
+        self.maxsize: int = maxsize
+        self.stale_ttl: float = stale_ttl
+        self.stale_if_error: float = stale_if_error
+        self.name: str | None = name  # Метка cache в метриках (None - без метрик)
+        self.shared = shared          # shared_state.SharedCache или None
+
+        # key -> (значение, время записи). Порядок - от давно использованных к недавним
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self._refreshing: set = set()  # Ключи, которые сейчас обновляются в фоне
+
+        self.hits: int = 0
+        self.misses: int = 0
+        self.stale_hits: int = 0
+        self.stale_errors: int = 0  # Отдано устаревших значений из-за ошибки обновления
+        self.evictions: int = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def _lookup(self, key: Any) -> tuple:
+        """Возвращает (значение, результат): hit - свежая запись, stale - устаревшая, но ее можно отдать
+        с фоновым обновлением, expired - отдается только если обновить не удалось, miss - записи нет"""
+        if self.name is None:
+            return self._find(key)
+
+        started: float = time.perf_counter()
+        value, result = self._find(key)
+        metrics.cache_lookup_seconds.observe(time.perf_counter() - started, cache=self.name, result=result)
+        return value, result
+
+    def _find(self, key: Any) -> tuple:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None, 'miss'
+
+            value, stored_at = entry
+            age: float = time.monotonic() - stored_at
+            if age <= self.ttl:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return value, 'hit'
+            if age <= self.ttl + self.stale_ttl:
+                self._data.move_to_end(key)
+                self.stale_hits += 1
+                return value, 'stale'
+
+            self.misses += 1
+            if age <= self.ttl + self.stale_if_error:
+                return value, 'expired'
+            del self._data[key]
+            return None, 'miss'
+
+    def get(self, key: Any) -> Any:
+        """Свежее значение или None"""
+        value, result = self._lookup(key)
+        return value if result == 'hit' else None
+
+    def set(self, key: Any, value: Any, age: float = 0.0) -> None:
+        """Сохраняет значение, при переполнении вытесняет давно неиспользуемые записи.
+        age - сколько секунд назад значение получено (из общего кэша)"""
+        if value is None:
+            return
+        with self._lock:
+            self._data[key] = (value, time.monotonic() - age)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_fetch(self, key: Any, fetch: Callable[[], Any]) -> Any:
+        """Значение из кэша или результат fetch(). Устаревшее значение обновляется в фоновом потоке"""
+        value, result = self._lookup(key)
+        if result == 'hit':
+            return value
+        if result == 'stale':
+            if self._start_refresh(key):
+                threading.Thread(target=self._refresh, args=(key, fetch), daemon=True).start()
+            return value
+
+        return self._store_fetched(key, *self._fetch(key, fetch), value)
+
+    async def get_or_fetch_async(self, key: Any, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        """Асинхронный вариант get_or_fetch. Устаревшее значение обновляется в фоновой задаче"""
+        value, result = self._lookup(key)
+        if result == 'hit':
+            return value
+        if result == 'stale':
+            if self._start_refresh(key):
+                asyncio.get_running_loop().create_task(self._refresh_async(key, fetch))
+            return value
+
+        return self._store_fetched(key, *await self._fetch_async(key, fetch), value)
+
+    async def refresh_async(self, key: Any, fetch: Callable[[], Awaitable[Any]], max_age: float = 0.0) -> Any:
+        """Обновляет запись заранее, не дожидаясь устаревания (прогрев), в этом кэше и в общем.
+        Из общего кэша берется значение не старше max_age секунд - его только что обновил другой экземпляр.
+        Возвращает новое значение или None (fetch не удался, старая запись остается)"""
+        if self.shared is not None:
+            value, age = await self.shared.fetch_async(key, fetch, max_age)
+        else:
+            value, age = await fetch(), 0.0
+        if value is not None:
+            self.set(key, value, age)
+        return value
+
+    def _fetch(self, key: Any, fetch: Callable[[], Any]) -> tuple:
+        """(значение, возраст): через общий кэш экземпляров, если он задан"""
+        if self.shared is not None:
+            return self.shared.fetch(key, fetch)
+        return fetch(), 0.0
+
+    async def _fetch_async(self, key: Any, fetch: Callable[[], Awaitable[Any]]) -> tuple:
+        if self.shared is not None:
+            return await self.shared.fetch_async(key, fetch)
+        return await fetch(), 0.0
+
+    def _store_fetched(self, key: Any, fetched: Any, age: float, expired: Any) -> Any:
+        """Сохраняет полученное значение. Если fetch вернул None - отдает устаревшее (stale-if-error)"""
+        if fetched is None:
+            if expired is not None:
+                self.stale_errors += 1
+            return expired
+        self.set(key, fetched, age)
+        return fetched
+
+    def _start_refresh(self, key: Any) -> bool:
+        """Помечает ключ как обновляемый. False - обновление уже идет"""
+        with self._lock:
+            if key in self._refreshing:
+                return False
+            self._refreshing.add(key)
+            return True
+
+    def _refresh(self, key: Any, fetch: Callable[[], Any]) -> None:
+        try:
+            self.set(key, *self._fetch(key, fetch))  # При ошибке fetch вернет None и старое значение останется
+        finally:
+            self._refreshing.discard(key)
+
+    async def _refresh_async(self, key: Any, fetch: Callable[[], Awaitable[Any]]) -> None:
+        try:
+            self.set(key, *await self._fetch_async(key, fetch))
+        finally:
+            self._refreshing.discard(key)
+
+    def clear(self) -> None:
+        """Очищает кэш (счетчики сохраняются)"""
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        """Счетчики попаданий, промахов, устаревших попаданий (в том числе при ошибках) и вытеснений"""
+        return {'size': len(self._data), 'hits': self.hits, 'misses': self.misses,
+                'stale_hits': self.stale_hits, 'stale_errors': self.stale_errors, 'evictions': self.evictions}
@@ -0,0 +1,190 @@
+"""Circuit breaker для внешних сервисов
+
+Состояния:
+ closed    - запросы идут как обычно, подряд идущие сбои (таймауты, ошибки соединения, 5xx) считаются
+ open      - после failure_threshold сбоев подряд запросы сразу отклоняются (CircuitOpenError)
+             без ожидания таймаута; через recovery_timeout секунд breaker переходит в half-open
+ half-open - пропускается один пробный запрос: успех - closed, сбой - снова open
+
+Ошибка quota-reached открывает breaker сразу и надолго (trip): повторять запросы бессмысленно.
+Состояние публикуется в метрике circuit_state (0 - closed, 1 - half-open, 2 - open).
+CircuitOpenError наследует исключения requests и aiohttp, поэтому класс создается при первом обращении
+(circuit_breaker.CircuitOpenError): импорт модуля не загружает эти библиотеки."""
+
+import os
+import time
+import threading
+from urllib.parse import urlsplit
+
+import metrics
+from metrics import log
+from lazy_import import lazy_import
+
+requests = lazy_import('requests')
+aiohttp = lazy_import('aiohttp')
+
+CIRCUIT_FAILURES: int = int(os.getenv("CIRCUIT_FAILURES", "5"))                  # Сбоев подряд до открытия
+CIRCUIT_RECOVERY: float = float(os.getenv("CIRCUIT_RECOVERY", "30"))             # Пауза до пробного запроса, сек
+CIRCUIT_QUOTA_RECOVERY: float = float(os.getenv("CIRCUIT_QUOTA_RECOVERY", "3600"))  # Пауза после quota-reached, сек
+
+CLOSED, HALF_OPEN, OPEN = 'closed', 'half-open', 'open'
+_STATE_VALUES: dict = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+circuit_state = metrics.Gauge('circuit_state', 'Состояние circuit breaker: 0 - closed, 1 - half-open, 2 - open',
+                              ('upstream',))
+circuit_rejected = metrics.Counter('circuit_rejected_total', 'Запросы, отклоненные открытым circuit breaker',
+                                   ('upstream',))
+
+
+_open_error: type | None = None
+_open_error_lock = threading.Lock()
+
+
+def _circuit_open_error() -> type:
+    """Класс CircuitOpenError (создается один раз, при первом обращении)"""
+    global _open_error
+
+    if _open_error is None:
+        with _open_error_lock:
+            if _open_error is None:
+                class CircuitOpenError(requests.exceptions.ConnectionError, aiohttp.ClientConnectionError):
+                    """Запрос отклонен без обращения к сервису: breaker открыт.
+                    Наследует ошибки соединения requests и aiohttp, поэтому существующие обработчики ловят его как
+                    "сервер недоступен" и в синхронных, и в асинхронных функциях"""
+
+                CircuitOpenError.__qualname__ = 'CircuitOpenError'
+                _open_error = CircuitOpenError
+    return _open_error
+
+
+def __getattr__(name: str):
+    """circuit_breaker.CircuitOpenError без загрузки requests и aiohttp при импорте модуля"""
+    if name == 'CircuitOpenError':
+        return _circuit_open_error()
+    raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
+
+
+class CircuitBreaker:
+    """Breaker одного внешнего сервиса. Потокобезопасный"""
+
+    def __init__(self, name: str, failure_threshold: int = CIRCUIT_FAILURES,
+                 recovery_timeout: float = CIRCUIT_RECOVERY) -> None:
+        self.name: str = name
+        self.failure_threshold: int = failure_threshold
+        self.recovery_timeout: float = recovery_timeout
+
+        self.state: str = CLOSED
+        self.failures: int = 0           # Сбоев подряд
+        self._opened_until: float = 0.0  # Когда можно пробовать снова (monotonic)
+        self._probing: bool = False      # Пробный запрос в half-open уже выполняется
+        self._lock = threading.Lock()
+        circuit_state.set(0, upstream=name)
+
+    def _set_state(self, state: str) -> None:
+        """Меняет состояние и метрику. Вызывать под блокировкой"""
+        if state != self.state:
+            log(f"[i] Circuit breaker {self.name}: {self.state} → {state}")
+            self.state = state
+            circuit_state.set(_STATE_VALUES[state], upstream=self.name)
+
+    def allow(self) -> bool:
+        """Можно ли выполнять запрос сейчас. В half-open разрешается только один пробный запрос"""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.monotonic() >= self._opened_until:
+                self._set_state(HALF_OPEN)
+            if self.state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+        circuit_rejected.inc(upstream=self.name)
+        return False
+
+    def check(self) -> None:
+        """allow() или CircuitOpenError"""
+        if not self.allow():
+            raise _circuit_open_error()(f"Сервис {self.name} временно недоступен (circuit breaker открыт)")
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self.state == OPEN:  # Ответ на запрос, начатый до открытия, breaker не закрывает
+                return
+            self.failures = 0
+            self._probing = False
+            self._set_state(CLOSED)
+
+    def record_failure(self) -> None:
+        with self._lock:
+            if self.state == OPEN:
+                return
+            self.failures += 1
+            self._probing = False
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self._open(self.recovery_timeout)
+
+    def release(self) -> None:
+        """Пробный запрос завершился без результата (отменен) - следующий запрос снова может быть пробным"""
+        with self._lock:
+            self._probing = False
+
+    def trip(self, duration: float) -> None:
+        """Открывает breaker сразу на duration секунд (например, при quota-reached)"""
+        with self._lock:
+            self._probing = False
+            self._open(duration)
+
+    def reset(self) -> None:
+        """Закрывает breaker (сервис снова доступен, например квота обновилась)"""
+        with self._lock:
+            self.failures = 0
+            self._probing = False
+            self._set_state(CLOSED)
+
+    def _open(self, duration: float) -> None:
+        """Вызывать под блокировкой"""
+        self._opened_until = time.monotonic() + duration
+        self._set_state(OPEN)
+
+
+class BreakerRegistry:
+    """Breaker на каждый внешний сервис. Сервис определяется по зарегистрированному префиксу URL
+    (EXCHANGE_API_URL, WTTR_URL), а для остальных адресов - по хосту"""
+
+    def __init__(self) -> None:
+        self._prefixes: list = []  # (префикс URL, имя), длинные префиксы первыми
+        self._breakers: dict = {}
+        self._lock = threading.Lock()
+
+    def register(self, prefix: str, name: str, **options) -> CircuitBreaker:
+        """Назначает имя сервису с адресами, начинающимися с prefix"""
+        with self._lock:
+            self._prefixes.append((prefix, name))
+            self._prefixes.sort(key=lambda item: len(item[0]), reverse=True)
+            breaker = self._breakers.get(name)
+            if breaker is None:
+                breaker = self._breakers[name] = CircuitBreaker(name, **options)
+        return breaker
+
+    def name_for(self, url: str) -> str:
+        for prefix, name in self._prefixes:
+            if url.startswith(prefix):
+                return name
+        return urlsplit(url).hostname or ''
+
+    def for_url(self, url: str) -> CircuitBreaker:
+        """Breaker сервиса для URL (создается при первом обращении)"""
+        name: str = self.name_for(url)
+        breaker = self._breakers.get(name)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.get(name)
+                if breaker is None:
+                    breaker = self._breakers[name] = CircuitBreaker(name)
+        return breaker
+
+    def states(self) -> dict:
+        """Состояния всех breaker'ов по именам"""
+        return {name: breaker.state for name, breaker in self._breakers.items()}
+
+
+breakers: BreakerRegistry = BreakerRegistry()
@@ -0,0 +1,205 @@
+"""Демон для CLI weather.py и currency_exchange.py: повторные запуски без холодного старта
+
+Каждый запуск CLI платит за старт интерпретатора, импорт модулей и новое TLS-соединение, а cron
+вызывает их тысячи раз в день. Демон держит модули импортированными, а HTTP-сессии и кэши теплыми;
+CLI передает ему аргументы по Unix-сокету и печатает полученный вывод.
+
+Запуск демона:
+    CLI_DAEMON_SOCKET=/tmp/tg_weather_bot.sock python cli_daemon.py serve
+Вызов через демон (если задан CLI_DAEMON_SOCKET):
+    python cli_daemon.py weather --city Уфа                  # без импорта weather.py в клиенте
+    python weather.py --city Уфа                             # тоже через демон, но после импорта модуля
+Если демон не запущен (нет сокета, соединение отклонено), команда выполняется локально, как раньше.
+
+Протокол: одна строка JSON в каждую сторону.
+    запрос:  {"program": "weather", "argv": [...], "cwd": "...", "stdin": "..."}
+    ответ:   {"code": 0, "stdout": "...", "stderr": "..."}
+Запросы выполняются по одному: на время запроса демон переходит в cwd клиента (относительные пути
+файлов и папки images) и перехватывает stdout/stderr. Используется окружение демона, а не клиента
+(API_KEY, WTTR_URL и др. задаются при запуске демона). stdout и stderr возвращаются целиком после
+завершения команды, поэтому их взаимный порядок не сохраняется."""
+
+import os
+import io
+import sys
+import json
+import time
+import socket
+import argparse
+import importlib
+import traceback
+import socketserver
+from contextlib import redirect_stdout, redirect_stderr
+
+CLI_DAEMON_SOCKET: str = os.getenv("CLI_DAEMON_SOCKET", "")                   # Путь к сокету демона ("" - не использовать)
+CLI_DAEMON_TIMEOUT: float = float(os.getenv("CLI_DAEMON_TIMEOUT", "300"))     # Ожидание ответа демона, сек
+
+# Программы, которые демон может выполнять: модуль с функцией main(argv)
+PROGRAMS: tuple = ('weather', 'currency_exchange')
+
+
+def forward(program: str, argv: list | None = None) -> int | None:
+    """Выполняет программу через демон. Возвращает код завершения или None,
+    если демон недоступен и команду нужно выполнить локально"""
+    if not CLI_DAEMON_SOCKET or not hasattr(socket, 'AF_UNIX'):
+        return None
+
+    argv = sys.argv[1:] if argv is None else list(argv)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(CLI_DAEMON_SOCKET)
+    except OSError:
+        sock.close()
+        return None
+
+    with sock:
+        # stdin читаем только после подключения: при локальном запуске он должен остаться непрочитанным
+        request: dict = {'program': program, 'argv': argv, 'cwd': os.getcwd()}
+        if '-' in argv:
+            request['stdin'] = sys.stdin.read()
+        try:
+            sock.settimeout(CLI_DAEMON_TIMEOUT)
+            sock.sendall(json.dumps(request, ensure_ascii=False).encode() + b'\n')
+            with sock.makefile('rb') as reader:
+                response: dict = json.loads(reader.readline())
+        except (OSError, ValueError) as e:
+            # Команда могла уже выполниться в демоне: повторять ее локально нельзя
+            print(f"[!] Демон CLI не ответил: {e}", file=sys.stderr)
+            return 1
+
+    sys.stdout.write(response.get('stdout', ''))
+    sys.stderr.write(response.get('stderr', ''))
+    return response.get('code', 1)
+
+
+def _exit_code(e: SystemExit) -> int:
+    """Код завершения из SystemExit, как у интерпретатора: sys.exit('текст') печатает текст и дает 1"""
+    if e.code is None:
+        return 0
+    if isinstance(e.code, int):
+        return e.code
+    print(e.code, file=sys.stderr)
+    return 1
+
+
+def execute(request: dict) -> dict:
+    """Выполняет запрос клиента в текущем процессе и возвращает ответ"""
+    program = request.get('program')
+    if program not in PROGRAMS:
+        return {'code': 2, 'stdout': '', 'stderr': f"[!] Неизвестная программа: {program}\n"}
+
+    stdout, stderr = io.StringIO(), io.StringIO()
+    cwd: str = os.getcwd()
+    stdin, argv = sys.stdin, sys.argv
+    code: int = 0
+    with redirect_stdout(stdout), redirect_stderr(stderr):
+        try:
+            os.chdir(request.get('cwd') or cwd)
+            sys.stdin = io.StringIO(request.get('stdin', ''))
+            sys.argv = [f'{program}.py', *request.get('argv', [])]  # Имя программы в сообщениях argparse
+            importlib.import_module(program).main(sys.argv[1:])
+        except SystemExit as e:
+            code = _exit_code(e)
+        except Exception:
+            traceback.print_exc()
+            code = 1
+        finally:
+            sys.stdin, sys.argv = stdin, argv
+            os.chdir(cwd)
+    return {'code': code, 'stdout': stdout.getvalue(), 'stderr': stderr.getvalue()}
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    """Один запрос - одна строка JSON"""
+
+    def handle(self) -> None:
+        started: float = time.perf_counter()
+        line: bytes = self.rfile.readline()
+        if not line:
+            return  # Соединение без запроса (проверка, запущен ли демон)
+        try:
+            request: dict = json.loads(line)
+        except ValueError as e:
+            request = {}
+            response: dict = {'code': 2, 'stdout': '', 'stderr': f"[!] Некорректный запрос: {e}\n"}
+        else:
+            response = execute(request)
+        self.wfile.write(json.dumps(response, ensure_ascii=False).encode() + b'\n')
+        print(f"[i] {request.get('program', '-')} {' '.join(request.get('argv', []))} → код {response['code']} "
+              f"за {(time.perf_counter() - started) * 1000:.1f} мс")
+
+
+def _socket_in_use(path: str) -> bool:
+    """Отвечает ли на сокете другой демон"""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(path)
+        except OSError:
+            return False
+    return True
+
+
+def serve(path: str) -> None:
+    """Запускает демон на Unix-сокете path (до Ctrl+C)"""
+    if os.path.exists(path):
+        if _socket_in_use(path):
+            raise RuntimeError(f"Демон уже запущен на {path}")
+        os.unlink(path)  # Сокет остался от завершившегося демона
+
+    # Модули импортируются один раз, до первого запроса. Пути кэшей и баз в них абсолютные (от каталога демона),
+    # общее хранилище (SHARED_BACKEND=sqlite:<путь>) тоже открываем здесь - до перехода в каталог клиента
+    for program in PROGRAMS:
+        importlib.import_module(program)
+    importlib.import_module('shared_state').get_backend()
+
+    # Сокет доступен только владельцу: демон пишет файлы в каталоги клиентов
+    umask: int = os.umask(0o077)
+    try:
+        server = socketserver.UnixStreamServer(path, _Handler)
+    finally:
+        os.umask(umask)
+
+    print(f"[i] Демон CLI: {path}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(path)
+
+
+def main(argv: list | None = None) -> None:
+    """Точка входа с парсингом аргументов из командной строки."""
+    parser = argparse.ArgumentParser(description="""
+    Демон для CLI weather.py и currency_exchange.py (Unix-сокет CLI_DAEMON_SOCKET)""",
+    epilog="""
+    Примеры использования:
+    python cli_daemon.py serve --socket /tmp/tg_weather_bot.sock
+    python cli_daemon.py weather --city Уфа
+    python cli_daemon.py currency_exchange --base USD --target RUB current""",
+    formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=('serve',) + PROGRAMS,
+                        help='serve - запустить демон, иначе - программа, которую выполнить через демон')
+    parser.add_argument('args', nargs=argparse.REMAINDER, help='Аргументы программы')
+    args = parser.parse_args(argv)
+
+    if args.command == 'serve':
+        serve_parser = argparse.ArgumentParser(prog='cli_daemon.py serve')
+        serve_parser.add_argument('--socket', default=CLI_DAEMON_SOCKET, help='Путь к Unix-сокету')
+        socket_path: str = serve_parser.parse_args(args.args).socket
+        if not socket_path:
+            serve_parser.error('нужен --socket или переменная окружения CLI_DAEMON_SOCKET')
+        serve(socket_path)
+        return
+
+    code: int | None = forward(args.command, args.args)
+    if code is None:
+        # Демон недоступен - выполняем локально
+        importlib.import_module(args.command).main(args.args)
+    else:
+        sys.exit(code)
+
+
+if __name__ == "__main__":
+    main()
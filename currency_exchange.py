@@ -1,11 +1,28 @@
+from __future__ import annotations
+
 import os
-import requests
+import sys
+import asyncio
+import http_client
+import metrics
+from metrics import log
+from single_flight import SingleFlight, AsyncSingleFlight
+from history_store import HistoryStore, get_store
+import circuit_breaker
+from circuit_breaker import CircuitBreaker, CIRCUIT_QUOTA_RECOVERY, breakers
+from shared_state import SharedBackend, get_backend, call_async
 import argparse
-from datetime import datetime
+from datetime import datetime, date
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
+from lazy_import import lazy_import
 #from typing import Optional
 #import json
 
+# requests и aiohttp загружаются при первом обращении: CLI пользуется только одной из библиотек
+requests = lazy_import('requests')
+aiohttp = lazy_import('aiohttp')
+
 valid_currencies: list = ['RUB', 'AED', 'AFN', 'ALL', 'AMD', 'ANG', 'AOA', 'ARS', 'AUD', 'AWG', 'AZN', 'BAM', 'BBD', 'BDT', 'BGN', 'BHD', \
                           'BIF', 'BMD', 'BND', 'BOB', 'BRL', 'BSD', 'BTN', 'BWP', 'BYN', 'BZD', 'CAD', 'CDF', 'CHF', 'CLP', 'CNY', 'COP', \
                           'CRC', 'CUP', 'CVE', 'CZK', 'DJF', 'DKK', 'DOP', 'DZD', 'EGP', 'ERN', 'ETB', 'EUR', 'FJD', 'FKP', 'FOK', 'GBP', \
@@ -29,6 +46,111 @@ error_api: dict = {
     "quota-reached": "Достигнут лимит запросов",
     "plan-upgrade-required": "Уровень подписки не поддерживает этот тип запроса"}
 
+# Адрес API (можно заменить на локальный стенд для тестов и бенчмарков)
+EXCHANGE_API_URL: str = os.getenv("EXCHANGE_API_URL", "https://v6.exchangerate-api.com/v6")
+# Circuit breaker сервиса: открывается при серии сбоев и сразу - при quota-reached
+exchange_breaker: CircuitBreaker = breakers.register(EXCHANGE_API_URL, 'exchangerate-api')
+
+# Выставляется при ошибке quota-reached: массовые запросы (history-range) на этом останавливаются
+quota_reached: bool = False
+
+# Квота общая для всех экземпляров бота: запросы считаются в общем хранилище (shared_state.py).
+# Лимит - квота из ответа /quota, а пока ее нет - API_MONTHLY_QUOTA (0 - без лимита).
+# Счетчик по календарным месяцам, а раз в час (prefetcher) сверяется с остатком из /quota
+API_MONTHLY_QUOTA: int = int(os.getenv("API_MONTHLY_QUOTA", "1500"))  # Квота exchangerate-api в месяц
+QUOTA_REACHED_KEY: str = 'exchange:quota-reached'
+QUOTA_TOTAL_KEY: str = 'exchange:quota-total'
+QUOTA_COUNTER_TTL: int = 32 * 24 * 3600
+
+# Параметры загрузки диапазона исторических курсов (history-range)
+HISTORY_WORKERS: int = int(os.getenv("HISTORY_WORKERS", "4"))             # Параллельных запросов в пачке
+HISTORY_MAX_REQUESTS: int = int(os.getenv("HISTORY_MAX_REQUESTS", "100"))  # Максимум запросов за один вызов
+
+def report_api_error(error_type: str | None) -> None:
+    """Выводит расшифровку ошибки API, считает ошибки по типам и запоминает исчерпание квоты.
+    При исчерпании квоты запросы к сервису всех экземпляров бота блокируются circuit breaker'ом
+    на CIRCUIT_QUOTA_RECOVERY секунд"""
+    metrics.api_errors.inc(error_type=error_type or 'unknown')
+    if error_type == 'quota-reached':
+        mark_quota_reached()
+    log(f"[!] Ошибка API: {error_api.get(error_type, error_type)}")
+
+def mark_quota_reached(shared: bool = True) -> None:
+    """Квота исчерпана: флаг, метрика и breaker на CIRCUIT_QUOTA_RECOVERY секунд.
+    shared=True - флаг и для остальных экземпляров бота"""
+    global quota_reached
+
+    quota_reached = True
+    metrics.api_quota_reached.set(1)
+    exchange_breaker.trip(CIRCUIT_QUOTA_RECOVERY)
+    if shared:
+        get_backend().set(QUOTA_REACHED_KEY, b'1', CIRCUIT_QUOTA_RECOVERY)
+
+def quota_counter_key() -> str:
+    """Ключ общего счетчика запросов за текущий месяц"""
+    return f'exchange:requests:{datetime.now():%Y-%m}'
+
+def reserve_request() -> bool:
+    """Перед запросом: занимает запрос в общем счетчике экземпляров бота. Если квоту исчерпал любой экземпляр
+    или счетчик дошел до лимита - открывает breaker, и запрос сразу завершится CircuitOpenError.
+    True - запрос занят (если его не выполнят - вернуть release_request)"""
+    backend: SharedBackend = get_backend()
+    if backend.get(QUOTA_REACHED_KEY) is not None:
+        if not quota_reached:
+            mark_quota_reached(shared=False)
+        return False
+
+    # incr атомарен, поэтому одновременные экземпляры не превысят лимит
+    used: int = backend.incr(quota_counter_key(), ttl=QUOTA_COUNTER_TTL)
+    limit: int = int(backend.get(QUOTA_TOTAL_KEY) or API_MONTHLY_QUOTA)
+    if limit and used > limit:
+        backend.incr(quota_counter_key(), -1)
+        log(f"[!] Экземпляры бота израсходовали квоту exchangerate-api ({limit} запросов)")
+        mark_quota_reached()
+        return False
+    if limit:
+        metrics.api_quota_remaining.set(limit - used)
+    return True
+
+def release_request() -> None:
+    """Запрос не выполнен (отклонен breaker'ом) - возвращает его в общий счетчик"""
+    get_backend().incr(quota_counter_key(), -1)
+
+def count_retry() -> None:
+    """Повтор запроса (таймаут, 429/5xx) - еще один запрос к сервису: учитывается в общем счетчике.
+    Повтор уже идет, поэтому лимит проверит следующий reserve_request"""
+    used: int = get_backend().incr(quota_counter_key(), ttl=QUOTA_COUNTER_TTL)
+    limit: int = int(get_backend().get(QUOTA_TOTAL_KEY) or API_MONTHLY_QUOTA)
+    if limit:
+        metrics.api_quota_remaining.set(max(0, limit - used))
+
+async def count_retry_async() -> None:
+    await call_async(count_retry)
+
+def exchange_get(url: str) -> requests.Response:
+    """Запрос к exchangerate-api с учетом общей квоты экземпляров (каждая попытка - один запрос квоты)"""
+    reserved: bool = reserve_request()
+    try:
+        return http_client.get(url, on_retry=count_retry)
+    except circuit_breaker.CircuitOpenError:
+        if reserved:
+            release_request()
+        raise
+
+async def exchange_get_async(url: str) -> http_client.AsyncResponse:
+    """Асинхронный вариант exchange_get"""
+    reserved: bool = await call_async(reserve_request)
+    try:
+        return await http_client.get_async(url, on_retry=count_retry_async)
+    except circuit_breaker.CircuitOpenError:
+        if reserved:
+            await call_async(release_request)
+        raise
+
+# Одинаковые одновременные запросы к exchangerate-api (по URL) выполняются один раз - экономим квоту
+rate_flight: SingleFlight = SingleFlight('exchange')
+rate_flight_async: AsyncSingleFlight = AsyncSingleFlight('exchange')
+
 def get_current_exchange_rate(api_key: str, base_code: str='USD', target_code: str='RUB') -> float:
     """Получает текущий курс валют
     1 - Отправляем запрос на сервер. Можем получить ошибки:
@@ -40,23 +162,23 @@ def get_current_exchange_rate(api_key: str, base_code: str='USD', target_code: s
      3.2 - нет ошибки API, проверяем на ошибки HTTP, если статус 4xx/5xx → HTTPError
     4 - если нет ошибки API и нет ошибки HTTP, обрабатываем результат (статус 200-399)"""
 
-    url = f'https://v6.exchangerate-api.com/v6/{api_key}/pair/{base_code}/{target_code}'
+    url = f'{EXCHANGE_API_URL}/{api_key}/pair/{base_code}/{target_code}'
 
     try:
-        print(f'[->] Запрос по адресу {url}')
-        response: requests.Response = requests.get(url, timeout=10)
+        log(f'[->] Запрос по адресу {url}')
+        response: requests.Response = rate_flight.do(url, lambda: exchange_get(url))
 
         # Всегда пытаемся прочитать JSON, даже при ошибках HTTP. При ошибке получим ValueError
         try:
-            data: dict = response.json()
+            with metrics.parse_seconds.time(kind='pair'):
+                data: dict = response.json()
         except ValueError as e:
-            print(f"[!] Ошибка декодирования JSON: {e}")
+            log(f"[!] Ошибка декодирования JSON: {e}")
             return 0.0
 
         # Если получили JSON и там ошибка API, то расшифровываем полученную ошибку
         if data and data.get("result") == "error":
-            error_type = data.get("error-type")
-            print(f"[!] Ошибка API: {error_api[error_type]}")
+            report_api_error(data.get("error-type"))
             return 0.0
 
         # Проверка на ошибки HTTP, если статус 4xx/5xx → HTTPError
@@ -64,28 +186,58 @@ def get_current_exchange_rate(api_key: str, base_code: str='USD', target_code: s
 
         # Если нет ошибки API и нет ошибки HTTP, обрабатываем результат (статус 200-399)
         if data and data.get("result") == "success":
-            print(f"[ok] Курс валюты: 1 {base_code} стоит {data["conversion_rate"]} {target_code}")
             return data["conversion_rate"]
 
     except requests.exceptions.Timeout:
-        print("[!] Таймаут при запросе к серверу")
+        log("[!] Таймаут при запросе к серверу")
         return 0.0
     except requests.exceptions.ConnectionError:
-        print("[!] Ошибка подключения: сервер недоступен")
+        log("[!] Ошибка подключения: сервер недоступен")
         return 0.0
     except requests.exceptions.HTTPError as e:
-        print(f"[!] HTTP ошибка: {e}")
+        log(f"[!] HTTP ошибка: {e}")
         return 0.0
     except requests.RequestException as e:  # Включает в себя Timeout, ConnectionError, HTTPError и др.
-        print(f"[!] Ошибка при запросе: {e}")
+        log(f"[!] Ошибка при запросе: {e}")
         return 0.0
     except KeyError as e:   # Если отсутствует ключ в полученных данных JSON'а
-        print(f"[!] Ошибка при обработке данных: отсутствует ключ {e}")
+        log(f"[!] Ошибка при обработке данных: отсутствует ключ {e}")
         return 0.0
 
 def get_history_exchange_rate(api_key: str, base_code: str='USD', target_code: str='RUB',
                               yyyy: str='2025', mm: str='01', dd: str='01', amount: str=1.0) -> float | None:
-    """Получает исторический курс валют на день запроса
+    """Получает исторический курс валют на день запроса: сколько стоит amount base_code в target_code.
+    Таблица курсов за день берется из локального хранилища, а если ее там нет -
+    запрашивается у сервиса (fetch_history_table) и сохраняется: исторические курсы не меняются"""
+
+    day: date = date(int(yyyy), int(mm), int(dd))
+    store: HistoryStore = get_store()
+
+    rates: dict | None = store.get(base_code, day)
+    if rates is None:
+        if store.has_no_data(base_code, day):
+            return None
+        rates = fetch_history_table(api_key, base_code, day)
+        if not rates:
+            if rates is not None:
+                store.put_no_data(base_code, day)
+            return None
+        store.put(base_code, day, rates)
+
+    return history_amount(rates, base_code, target_code, day, amount)
+
+def history_amount(rates: dict, base_code: str, target_code: str, day: date, amount: str=1.0) -> float | None:
+    """Считает сумму по таблице исторических курсов. None, если целевой валюты нет в таблице"""
+    try:
+        value: float = rates[target_code] * float(amount)
+    except KeyError as e:   # Если отсутствует валюта в таблице курсов
+        log(f"[!] Ошибка при обработке данных: отсутствует ключ {e}")
+        return None
+    return value
+
+def fetch_history_table(api_key: str, base_code: str, day: date) -> dict | None:
+    """Запрашивает у сервиса таблицу курсов {код: курс} для базовой валюты на дату.
+    Пустая таблица - у сервиса нет курсов на дату (no-data-available), None - запрос не удался
     1 - Отправляем запрос на сервер. Можем получить ошибки:
      1.1 - requests.exceptions.Timeout
      1.2 - requests.exceptions.ConnectionError
@@ -95,48 +247,237 @@ def get_history_exchange_rate(api_key: str, base_code: str='USD', target_code: s
      3.2 - нет ошибки API, проверяем на ошибки HTTP, если статус 4xx/5xx → HTTPError
     4 - если нет ошибки API и нет ошибки HTTP, обрабатываем результат (статус 200-399)"""
 
-    url = f'https://v6.exchangerate-api.com/v6/{api_key}/history/{base_code}/{yyyy}/{mm}/{dd}/{amount}'
+    url = f'{EXCHANGE_API_URL}/{api_key}/history/{base_code}/{day.year}/{day.month}/{day.day}'
 
     try:
-        print(f'[->] Запрос по адресу {url}')
-        response: requests.Response = requests.get(url, timeout=10)
+        log(f'[->] Запрос по адресу {url}')
+        response: requests.Response = rate_flight.do(url, lambda: exchange_get(url))
 
         # Всегда пытаемся прочитать JSON, даже при ошибках HTTP. При ошибке получим ValueError
         try:
-            data: dict = response.json()
+            with metrics.parse_seconds.time(kind='history'):
+                data: dict = response.json()
         except ValueError as e:
-            print(f"[!] Ошибка декодирования JSON: {e}")
+            log(f"[!] Ошибка декодирования JSON: {e}")
             return None
 
         # Если получили JSON и там ошибка API, то расшифровываем полученную ошибку
         if data and data.get("result") == "error":
-            error_type = data.get("error-type")
-            print(f"[!] Ошибка API: {error_api[error_type]}")
-            return None
+            report_api_error(data.get("error-type"))
+            # Курсов на дату у сервиса нет - ответ окончательный, в отличие от остальных ошибок
+            return {} if data.get("error-type") == "no-data-available" else None
 
         # Проверка на ошибки HTTP, если статус 4xx/5xx → HTTPError
         response.raise_for_status()
 
         # Если нет ошибки API и нет ошибки HTTP, обрабатываем результат (статус 200-399)
         if data and data.get("result") == "success":
-            print(f"[ok] Курс валюты на {yyyy}.{mm}.{dd}: 1 {base_code} стоит {data["conversion_rate"][target_code]} {target_code}")
-            return data["conversion_rate"][target_code]
+            return data["conversion_rates"]
 
     except requests.exceptions.Timeout:
-        print("[!] Таймаут при запросе к серверу")
-        return None
+        log("[!] Таймаут при запросе к серверу")
     except requests.exceptions.ConnectionError:
-        print("[!] Ошибка подключения: сервер недоступен")
-        return None
+        log("[!] Ошибка подключения: сервер недоступен")
     except requests.exceptions.HTTPError as e:
-        print(f"[!] HTTP ошибка: {e}")
-        return None
+        log(f"[!] HTTP ошибка: {e}")
     except requests.RequestException as e: # Включает в себя Timeout, ConnectionError, HTTPError и др.
-        print(f"[!] Ошибка при запросе: {e}")
-        return None
+        log(f"[!] Ошибка при запросе: {e}")
     except KeyError as e:   # Если отсутствует ключ в полученных данных JSON'а
-        print(f"[!] Ошибка при обработке данных: отсутствует ключ {e}")
-        return None
+        log(f"[!] Ошибка при обработке данных: отсутствует ключ {e}")
+    return None
+
+def get_history_range(api_key: str, base_code: str, target_code: str, start: date, end: date,
+                      workers: int=HISTORY_WORKERS, max_requests: int=HISTORY_MAX_REQUESTS) -> list:
+    """Временной ряд [(дата, курс)] пары за диапазон дат.
+    У сервиса запрашиваются только дни, которых нет в хранилище: пачками по workers параллельных
+    запросов, не больше max_requests запросов и до первой ошибки quota-reached.
+    Дни без курсов у сервиса отмечаются в хранилище и повторно не запрашиваются"""
+
+    store: HistoryStore = get_store()
+    missing: list = store.missing_days(base_code, start, end)
+
+    if len(missing) > max_requests:
+        log(f"[i] Не хватает {len(missing)} дней, будет запрошено только {max_requests} (лимит запросов)")
+        missing = missing[:max_requests]
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for i in range(0, len(missing), workers):
+            if quota_reached:
+                log("[!] Квота запросов исчерпана, остальные дни не запрашиваются")
+                break
+            batch: list = missing[i:i + workers]
+            for day, rates in zip(batch, pool.map(lambda day: fetch_history_table(api_key, base_code, day), batch)):
+                if rates:
+                    store.put(base_code, day, rates)
+                elif rates is not None:
+                    store.put_no_data(base_code, day)
+
+    return store.series(base_code, target_code, start, end)
+
+async def get_current_exchange_rate_async(api_key: str,
+                                         base_code: str='USD', target_code: str='RUB') -> float:
+    """Асинхронная версия get_current_exchange_rate для бота (не блокирует event loop).
+    Порядок обработки ошибок тот же, исключения aiohttp вместо requests"""
+
+    url = f'{EXCHANGE_API_URL}/{api_key}/pair/{base_code}/{target_code}'
+
+    try:
+        log(f'[->] Запрос по адресу {url}')
+        response: http_client.AsyncResponse = await rate_flight_async.do(url, lambda: exchange_get_async(url))
+
+        # Всегда пытаемся прочитать JSON, даже при ошибках HTTP. При ошибке получим ValueError
+        try:
+            with metrics.parse_seconds.time(kind='pair'):
+                data: dict = response.json()
+        except ValueError as e:
+            log(f"[!] Ошибка декодирования JSON: {e}")
+            return 0.0
+
+        # Если получили JSON и там ошибка API, то расшифровываем полученную ошибку
+        if data and data.get("result") == "error":
+            report_api_error(data.get("error-type"))
+            return 0.0
+
+        # Проверка на ошибки HTTP, если статус 4xx/5xx → ClientResponseError
+        response.raise_for_status()
+
+        # Если нет ошибки API и нет ошибки HTTP, обрабатываем результат (статус 200-399)
+        if data and data.get("result") == "success":
+            log(f"[ok] Курс валюты: 1 {base_code} стоит {data["conversion_rate"]} {target_code}")
+            return data["conversion_rate"]
+
+    except asyncio.TimeoutError:
+        log("[!] Таймаут при запросе к серверу")
+        return 0.0
+    except aiohttp.ClientResponseError as e:
+        log(f"[!] HTTP ошибка: {e}")
+        return 0.0
+    except aiohttp.ClientConnectionError:
+        log("[!] Ошибка подключения: сервер недоступен")
+        return 0.0
+    except aiohttp.ClientError as e:  # Базовый класс для всех ошибок aiohttp
+        log(f"[!] Ошибка при запросе: {e}")
+        return 0.0
+    except KeyError as e:   # Если отсутствует ключ в полученных данных JSON'а
+        log(f"[!] Ошибка при обработке данных: отсутствует ключ {e}")
+        return 0.0
+    return 0.0
+
+async def get_history_exchange_rate_async(api_key: str,
+                                          base_code: str='USD', target_code: str='RUB',
+                                          yyyy: str='2025', mm: str='01', dd: str='01',
+                                          amount: str=1.0) -> float | None:
+    """Асинхронная версия get_history_exchange_rate для бота (не блокирует event loop).
+    Обращение к локальному хранилищу - быстрый поиск по первичному ключу SQLite, его делаем прямо в loop"""
+
+    day: date = date(int(yyyy), int(mm), int(dd))
+    store: HistoryStore = get_store()
+
+    rates: dict | None = store.get(base_code, day)
+    if rates is None:
+        if store.has_no_data(base_code, day):
+            return None
+        rates = await fetch_history_table_async(api_key, base_code, day)
+        if not rates:
+            if rates is not None:
+                store.put_no_data(base_code, day)
+            return None
+        store.put(base_code, day, rates)
+
+    return history_amount(rates, base_code, target_code, day, amount)
+
+async def fetch_history_table_async(api_key: str, base_code: str, day: date) -> dict | None:
+    """Асинхронная версия fetch_history_table. Порядок обработки ошибок тот же, исключения aiohttp вместо requests"""
+
+    url = f'{EXCHANGE_API_URL}/{api_key}/history/{base_code}/{day.year}/{day.month}/{day.day}'
+
+    try:
+        log(f'[->] Запрос по адресу {url}')
+        response: http_client.AsyncResponse = await rate_flight_async.do(url, lambda: exchange_get_async(url))
+
+        # Всегда пытаемся прочитать JSON, даже при ошибках HTTP. При ошибке получим ValueError
+        try:
+            with metrics.parse_seconds.time(kind='history'):
+                data: dict = response.json()
+        except ValueError as e:
+            log(f"[!] Ошибка декодирования JSON: {e}")
+            return None
+
+        # Если получили JSON и там ошибка API, то расшифровываем полученную ошибку
+        if data and data.get("result") == "error":
+            report_api_error(data.get("error-type"))
+            # Курсов на дату у сервиса нет - ответ окончательный, в отличие от остальных ошибок
+            return {} if data.get("error-type") == "no-data-available" else None
+
+        # Проверка на ошибки HTTP, если статус 4xx/5xx → ClientResponseError
+        response.raise_for_status()
+
+        # Если нет ошибки API и нет ошибки HTTP, обрабатываем результат (статус 200-399)
+        if data and data.get("result") == "success":
+            return data["conversion_rates"]
+
+    except asyncio.TimeoutError:
+        log("[!] Таймаут при запросе к серверу")
+    except aiohttp.ClientResponseError as e:
+        log(f"[!] HTTP ошибка: {e}")
+    except aiohttp.ClientConnectionError:
+        log("[!] Ошибка подключения: сервер недоступен")
+    except aiohttp.ClientError as e:  # Базовый класс для всех ошибок aiohttp
+        log(f"[!] Ошибка при запросе: {e}")
+    except KeyError as e:   # Если отсутствует ключ в полученных данных JSON'а
+        log(f"[!] Ошибка при обработке данных: отсутствует ключ {e}")
+    return None
+
+def sync_quota(total: int, remaining: int) -> None:
+    """Записывает в общее хранилище квоту и израсходованные запросы по данным сервиса"""
+    backend: SharedBackend = get_backend()
+    backend.set(QUOTA_TOTAL_KEY, str(total).encode(), QUOTA_COUNTER_TTL)
+    backend.set(quota_counter_key(), str(total - remaining).encode(), QUOTA_COUNTER_TTL)
+    if remaining > 0:
+        backend.delete(QUOTA_REACHED_KEY)
+
+async def fetch_quota_async(api_key: str) -> dict | None:
+    """Запрашивает остаток месячной квоты (/quota, сам запрос квоту не расходует) и обновляет метрики.
+    Выполняется и при открытом circuit breaker. Сверяет общий счетчик запросов экземпляров с остатком квоты.
+    Если запросы снова доступны (начался новый месяц) - снимает флаг quota_reached (и общий) и закрывает breaker.
+    None при ошибке"""
+    global quota_reached
+
+    url: str = f'{EXCHANGE_API_URL}/{api_key}/quota'
+
+    try:
+        log(f'[->] Запрос по адресу {url}')
+        response: http_client.AsyncResponse = await http_client.get_async(url, use_breaker=False)
+        with metrics.parse_seconds.time(kind='quota'):
+            data: dict = response.json()
+
+        if data and data.get("result") == "error":
+            report_api_error(data.get("error-type"))
+            return None
+        response.raise_for_status()
+
+        metrics.api_quota_total.set(data["requests_quota"])
+        metrics.api_quota_remaining.set(data["requests_remaining"])
+        await call_async(sync_quota, data["requests_quota"], data["requests_remaining"])
+        if data["requests_remaining"] > 0 and quota_reached:
+            quota_reached = False
+            metrics.api_quota_reached.set(0)
+            exchange_breaker.reset()
+        return data
+
+    except ValueError as e:
+        log(f"[!] Ошибка декодирования JSON: {e}")
+    except asyncio.TimeoutError:
+        log("[!] Таймаут при запросе к серверу")
+    except aiohttp.ClientResponseError as e:
+        log(f"[!] HTTP ошибка: {e}")
+    except aiohttp.ClientConnectionError:
+        log("[!] Ошибка подключения: сервер недоступен")
+    except aiohttp.ClientError as e:
+        log(f"[!] Ошибка при запросе: {e}")
+    except KeyError as e:
+        log(f"[!] Ошибка при обработке данных: отсутствует ключ {e}")
+    return None
 
 def get_time_now() -> str:
     """Возвращает текущее время в формате ГГГГ.ММ.ДД_ЧЧ:ММ"""
@@ -168,8 +509,21 @@ def validate_date(yyyy: str, mm: str, dd: str) -> bool:
         print(f"[!] Некорректная дата: {e}")
         return False
 
-def main() -> None:
-    """Точка входа с парсингом аргументов из командной строки."""
+def validate_date_arg(value: str) -> date:
+    """Проверяет дату в формате ГГГГ-ММ-ДД для аргументов командной строки"""
+    try:
+        day: date = date.fromisoformat(value.strip())
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"[!] Некорректная дата (нужно ГГГГ-ММ-ДД): '{value}'")
+
+    # Дополнительная проверка - дата не должна быть в будущем
+    if day > date.today():
+        raise argparse.ArgumentTypeError(f"[!] Дата не может быть в будущем: '{value}'")
+
+    return day
+
+def main(argv: list | None = None) -> None:
+    """Точка входа с парсингом аргументов из командной строки (argv - вместо sys.argv[1:], для cli_daemon.py)"""
 
     load_dotenv()  # Загружаем переменные окружения из файла .env
 
@@ -186,7 +540,9 @@ def main() -> None:
     python currency_exchange.py current
     python currency_exchange.py --base CAD --target RUB current
     python currency_exchange.py --base CAD --target RUB convert 123.45
-    python currency_exchange.py --base CAD --target EUR history -y 2023 -m 10 -d 05 -a 100""",
+    python currency_exchange.py --base CAD --target RUB convert 10 100 1000
+    python currency_exchange.py --base CAD --target EUR history -y 2023 -m 10 -d 05 -a 100
+    python currency_exchange.py --base USD --target RUB history-range -s 2024-01-01 -e 2024-01-31""",
     formatter_class=argparse.RawDescriptionHelpFormatter)
 
     # Добавляем аргументы
@@ -210,24 +566,56 @@ def main() -> None:
     history_subparser.add_argument('-d', '--dd', required=True, help='День')
     history_subparser.add_argument('-a', '--amount', type=float, default=1.0, help='Сумма для конвертации') # Не обязательно, по умолчанию 1.0
 
+    range_subparser = subparser.add_parser('history-range', help='Исторический курс валюты за диапазон дат')
+    range_subparser.add_argument('-s', '--start', type=validate_date_arg, required=True, help='Начальная дата ГГГГ-ММ-ДД')
+    range_subparser.add_argument('-e', '--end', type=validate_date_arg, required=True, help='Конечная дата ГГГГ-ММ-ДД')
+    range_subparser.add_argument('-w', '--workers', type=int, default=HISTORY_WORKERS, help='Параллельных запросов')
+    range_subparser.add_argument('--max-requests', type=int, default=HISTORY_MAX_REQUESTS,
+                                 help='Максимум запросов к сервису (экономия квоты)')
+
     convert_subparser = subparser.add_parser('convert', help='Конвертация валюты по текущему курсу')
-    convert_subparser.add_argument('amount', type=float, help='Сумма для конвертации')
+    convert_subparser.add_argument('amount', type=float, nargs='+', help='Сумма (или несколько сумм) для конвертации')
 
     # Парсим аргументы
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     # Получаем текущее время
     print(f"[t] Текущее время: {get_time_now()}")
 
+    # Результат печатается всегда, диагностика функций - только при LOG_ENABLED
     if args.command == 'current':
-        get_current_exchange_rate(API_KEY, args.base, args.target)
+        rate: float = get_current_exchange_rate(API_KEY, args.base, args.target)
+        if rate:
+            print(f"[ok] Курс валюты: 1 {args.base} стоит {rate} {args.target}")
     elif args.command == 'history':
         if validate_date(args.yyyy, args.mm, args.dd):  # Проверяем валидность даты
-            get_history_exchange_rate(API_KEY, args.base, args.target, args.yyyy, args.mm, args.dd, args.amount)
+            value: float | None = get_history_exchange_rate(API_KEY, args.base, args.target,
+                                                            args.yyyy, args.mm, args.dd, args.amount)
+            if value is not None:
+                day: date = date(int(args.yyyy), int(args.mm), int(args.dd))
+                print(f"[ok] Курс валюты на {day:%Y.%m.%d}: {args.amount} {args.base} стоит {value} {args.target}")
+    elif args.command == 'history-range':
+        if args.start > args.end:
+            print("[!] Начальная дата позже конечной")
+            return
+        series: list = get_history_range(API_KEY, args.base, args.target, args.start, args.end,
+                                         args.workers, args.max_requests)
+        for day, rate in series:
+            print(f"[ok] {day:%Y.%m.%d}: 1 {args.base} стоит {rate} {args.target}")
+        print(f"[i] Получено дней: {len(series)} из {(args.end - args.start).days + 1}")
     elif args.command == 'convert':
-        rate = get_current_exchange_rate(API_KEY, args.base, args.target)
-        if rate != 0.0:
-            print(f"[ok] {args.amount} {args.base} стоит {args.amount * rate:.2f} {args.target}")
+        # Конвертация по таблице курсов: один запрос /latest на все пары (импорт здесь - rate_engine сам импортирует этот модуль)
+        from rate_engine import RateEngine
+        table = RateEngine(API_KEY).table()
+        if table is not None:
+            for amount, converted in zip(args.amount, table.convert_many(args.amount, args.base, args.target)):
+                print(f"[ok] {amount} {args.base} стоит {converted:.2f} {args.target}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    # Если запущен демон CLI (cli_daemon.py, CLI_DAEMON_SOCKET) - команда выполняется в нем
+    import cli_daemon
+    code = cli_daemon.forward('currency_exchange')
+    if code is None:
+        main()
+    else:
+        sys.exit(code)
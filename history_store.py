@@ -0,0 +1,178 @@
+"""Локальное хранилище исторических курсов валют (SQLite)
+
+Исторические курсы не меняются, поэтому таблица курсов за день запрашивается у сервиса один раз,
+а дальше берется с диска. Ключ - (базовая валюта, дата), значение - все курсы за этот день
+одним BLOB'ом (array('d')) в порядке списка кодов из таблицы layouts.
+Дни, на которые у сервиса нет курсов (no-data-available), отмечаются в таблице no_data и тоже не
+запрашиваются повторно: давние - навсегда, последние HISTORY_NO_DATA_RECENT дней - на HISTORY_NO_DATA_TTL
+(курсы за них могут еще появиться)."""
+
+import os
+import time
+import sqlite3
+import threading
+from array import array
+from datetime import date, timedelta
+
+HISTORY_DB: str = os.path.abspath(os.getenv("HISTORY_DB", "history.sqlite3"))  # Путь к файлу базы (абсолютный)
+HISTORY_NO_DATA_TTL: float = float(os.getenv("HISTORY_NO_DATA_TTL", "86400"))  # Отметка "нет данных" недавнего дня, сек
+HISTORY_NO_DATA_RECENT: int = int(os.getenv("HISTORY_NO_DATA_RECENT", "3"))     # Сколько последних дней считать недавними
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS layouts (
+    id    INTEGER PRIMARY KEY,
+    codes TEXT NOT NULL UNIQUE               -- коды валют через запятую в порядке массива курсов
+);
+CREATE TABLE IF NOT EXISTS history (
+    base   TEXT NOT NULL,
+    day    TEXT NOT NULL,                    -- ГГГГ-ММ-ДД
+    layout INTEGER NOT NULL REFERENCES layouts(id),
+    rates  BLOB NOT NULL,                    -- array('d').tobytes()
+    PRIMARY KEY (base, day)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS no_data (
+    base    TEXT NOT NULL,
+    day     TEXT NOT NULL,                   -- ГГГГ-ММ-ДД
+    expires REAL,                            -- time.time() окончания отметки, NULL - навсегда
+    PRIMARY KEY (base, day)
+) WITHOUT ROWID;
+"""
+
+
+class HistoryStore:
+    """Хранилище таблиц исторических курсов. Потокобезопасное (одно соединение под блокировкой)"""
+
+    def __init__(self, path: str = HISTORY_DB) -> None:
+        self.path: str = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._layouts: dict = {}   # id -> кортеж кодов
+        self._layout_ids: dict = {}  # кортеж кодов -> id
+        self._load_layouts()
+
+    def _remember_layout(self, layout_id: int, codes: tuple) -> None:
+        self._layouts[layout_id] = codes
+        self._layout_ids[codes] = layout_id
+
+    def _load_layouts(self) -> None:
+        """Перечитывает раскладки из базы (их могли добавить другие процессы)"""
+        for layout_id, codes in self._conn.execute("SELECT id, codes FROM layouts"):
+            self._remember_layout(layout_id, tuple(codes.split(',')))
+
+    def _codes(self, layout_id: int) -> tuple:
+        """Коды раскладки по id. Вызывать под блокировкой"""
+        codes = self._layouts.get(layout_id)
+        if codes is None:
+            self._load_layouts()  # Строку записал другой процесс с новой раскладкой
+            codes = self._layouts[layout_id]
+        return codes
+
+    def _layout_id(self, codes: tuple) -> int:
+        """id раскладки кодов (создается при первом использовании). Вызывать под блокировкой"""
+        layout_id = self._layout_ids.get(codes)
+        if layout_id is None:
+            # Ту же раскладку мог уже добавить другой процесс: вставка без ошибки, id - из базы
+            joined: str = ','.join(codes)
+            self._conn.execute("INSERT OR IGNORE INTO layouts (codes) VALUES (?)", (joined,))
+            layout_id = self._conn.execute("SELECT id FROM layouts WHERE codes = ?", (joined,)).fetchone()[0]
+            self._remember_layout(layout_id, codes)
+        return layout_id
+
+    def get(self, base_code: str, day: date) -> dict | None:
+        """Таблица курсов {код: курс} для базовой валюты на дату. None - такой даты нет в хранилище"""
+        with self._lock:
+            row = self._conn.execute("SELECT layout, rates FROM history WHERE base = ? AND day = ?",
+                                     (base_code, day.isoformat())).fetchone()
+            if row is None:
+                return None
+            codes: tuple = self._codes(row[0])
+        rates = array('d')
+        rates.frombytes(row[1])
+        return dict(zip(codes, rates))
+
+    def put(self, base_code: str, day: date, rates: dict) -> None:
+        """Сохраняет таблицу курсов {код: курс} для базовой валюты на дату"""
+        codes: tuple = tuple(rates)
+        blob: bytes = array('d', rates.values()).tobytes()
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO history (base, day, layout, rates) VALUES (?, ?, ?, ?)",
+                               (base_code, day.isoformat(), self._layout_id(codes), blob))
+            self._conn.execute("DELETE FROM no_data WHERE base = ? AND day = ?", (base_code, day.isoformat()))
+
+    def put_no_data(self, base_code: str, day: date) -> None:
+        """Отмечает, что у сервиса нет курсов для базовой валюты на дату"""
+        recent: bool = day >= date.today() - timedelta(days=HISTORY_NO_DATA_RECENT)
+        expires: float | None = time.time() + HISTORY_NO_DATA_TTL if recent else None
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO no_data (base, day, expires) VALUES (?, ?, ?)",
+                               (base_code, day.isoformat(), expires))
+
+    def no_data_days(self, base_code: str, start: date, end: date) -> set:
+        """Даты из диапазона [start, end], для которых действует отметка "нет данных" сервиса"""
+        with self._lock:
+            rows = self._conn.execute("SELECT day FROM no_data WHERE base = ? AND day BETWEEN ? AND ? "
+                                      "AND (expires IS NULL OR expires > ?)",
+                                      (base_code, start.isoformat(), end.isoformat(), time.time())).fetchall()
+        return {date.fromisoformat(row[0]) for row in rows}
+
+    def has_no_data(self, base_code: str, day: date) -> bool:
+        """Есть ли действующая отметка "нет данных" для базовой валюты на дату"""
+        return bool(self.no_data_days(base_code, day, day))
+
+    def days(self, base_code: str, start: date, end: date) -> set:
+        """Даты из диапазона [start, end], которые уже есть в хранилище"""
+        with self._lock:
+            rows = self._conn.execute("SELECT day FROM history WHERE base = ? AND day BETWEEN ? AND ?",
+                                      (base_code, start.isoformat(), end.isoformat())).fetchall()
+        return {date.fromisoformat(row[0]) for row in rows}
+
+    def missing_days(self, base_code: str, start: date, end: date) -> list:
+        """Даты из диапазона [start, end], которых нет в хранилище и для которых нет отметки "нет данных"
+        (по возрастанию)"""
+        present: set = self.days(base_code, start, end) | self.no_data_days(base_code, start, end)
+        return [day for day in date_range(start, end) if day not in present]
+
+    def series(self, base_code: str, target_code: str, start: date, end: date) -> list:
+        """Временной ряд [(дата, курс)] пары за диапазон - только по сохраненным дням"""
+        with self._lock:
+            rows = self._conn.execute("SELECT day, layout, rates FROM history "
+                                      "WHERE base = ? AND day BETWEEN ? AND ? ORDER BY day",
+                                      (base_code, start.isoformat(), end.isoformat())).fetchall()
+            layouts: dict = {layout_id: self._codes(layout_id) for layout_id in {row[1] for row in rows}}
+        series: list = []
+        for day, layout_id, blob in rows:
+            codes: tuple = layouts[layout_id]
+            if target_code not in codes:
+                continue
+            rates = array('d')
+            rates.frombytes(blob)
+            series.append((date.fromisoformat(day), rates[codes.index(target_code)]))
+        return series
+
+    def close(self) -> None:
+        """Закрывает соединение с базой"""
+        with self._lock:
+            self._conn.close()
+
+
+def date_range(start: date, end: date) -> list:
+    """Все даты от start до end включительно"""
+    return [start + timedelta(days=offset) for offset in range((end - start).days + 1)]
+
+
+_store: HistoryStore | None = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> HistoryStore:
+    """Общее хранилище процесса (файл HISTORY_DB открывается при первом обращении)"""
+    global _store
+
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = HistoryStore()
+    return _store
@@ -0,0 +1,288 @@
+"""Общий HTTP-клиент для wttr.in и exchangerate-api.com
+
+Одна сессия на процесс вместо requests.get на каждый вызов:
+ - пул соединений на каждый хост и keep-alive (TLS рукопожатие один раз, а не на каждый запрос)
+ - настраиваемые таймауты (переменные окружения HTTP_*)
+ - повтор запросов при таймаутах, ошибках соединения и статусах 429/5xx с jitter-паузой;
+   on_retry - вызов перед каждым повтором (учет повторов в квоте сервиса)
+ - счетчики запросов и новых соединений (рукопожатий) по хостам: stats()
+ - время запросов по хостам и статусам в метрике upstream_request_seconds (metrics.py)
+ - адаптивное ограничение частоты запросов к каждому хосту (rate_limit.py): при 429/503 скорость снижается
+ - circuit breaker на каждый сервис (circuit_breaker.py): при серии таймаутов и 5xx запросы
+   сразу завершаются CircuitOpenError (это ошибка соединения и для requests, и для aiohttp)
+
+Синхронный фасад: get() - возвращает requests.Response, исключения requests как раньше.
+Асинхронный фасад: await get_async() - возвращает AsyncResponse, исключения aiohttp.
+
+HTTP/2 ни requests, ни aiohttp не поддерживают, поэтому соединения HTTP/1.1 с keep-alive.
+requests и aiohttp импортируются отложенно (lazy_import.py): CLI загружает только ту библиотеку, которой пользуется."""
+
+from __future__ import annotations
+
+import os
+import json
+import time
+import random
+import asyncio
+import threading
+from dataclasses import dataclass
+from typing import Awaitable, Callable
+from urllib.parse import urlsplit
+from dotenv import load_dotenv
+from rate_limit import HostRateLimiter
+from circuit_breaker import CircuitBreaker, breakers
+from lazy_import import lazy_import
+import metrics
+
+requests = lazy_import('requests')
+aiohttp = lazy_import('aiohttp')
+
+# Загружаем переменные из файла .env, чтобы настройки HTTP_* работали и для CLI
+load_dotenv()
+
+HTTP_TIMEOUT: float = float(os.getenv("HTTP_TIMEOUT", "10"))                  # Общий таймаут запроса, сек
+HTTP_CONNECT_TIMEOUT: float = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))   # Таймаут подключения, сек
+HTTP_RETRIES: int = int(os.getenv("HTTP_RETRIES", "2"))                       # Количество повторов
+HTTP_BACKOFF: float = float(os.getenv("HTTP_BACKOFF", "0.3"))                 # Базовая пауза между повторами, сек
+HTTP_POOL_SIZE: int = int(os.getenv("HTTP_POOL_SIZE", "50"))                  # Соединений на один хост
+HTTP_KEEPALIVE: float = float(os.getenv("HTTP_KEEPALIVE", "60"))              # Время жизни простаивающего соединения, сек
+HTTP_RATE_LIMIT: float = float(os.getenv("HTTP_RATE_LIMIT", "10"))            # Запросов в секунду к хосту (0 - без ограничения)
+HTTP_RATE_LIMIT_MIN: float = float(os.getenv("HTTP_RATE_LIMIT_MIN", "0.5"))   # Нижняя граница при перегрузке сервиса
+
+# Статусы, при которых имеет смысл повторить запрос
+RETRY_STATUSES: tuple = (429, 500, 502, 503, 504)
+# Статусы "сервис перегружен": ограничитель частоты снижает скорость
+THROTTLE_STATUSES: tuple = (429, 503)
+
+# Ограничитель частоты запросов по хостам (None - без ограничения). Пакетный режим weather.py ставит свой
+rate_limiter: HostRateLimiter | None = (HostRateLimiter(HTTP_RATE_LIMIT, min_rate=HTTP_RATE_LIMIT_MIN)
+                                        if HTTP_RATE_LIMIT > 0 else None)
+
+_sync_session: requests.Session | None = None
+_sync_lock = threading.Lock()
+_sync_request = threading.local()  # on_retry запроса, который выполняет этот поток (повторы делает urllib3)
+_async_session: aiohttp.ClientSession | None = None
+
+# Счетчики асинхронного фасада по хостам: requests - запросы, connections - новые соединения
+_async_stats: dict = {}
+
+
+def backoff_delay(attempt: int) -> float:
+    """Пауза перед повтором номер attempt (с 0): экспонента с полным jitter,
+    чтобы повторы разных клиентов не приходили на сервер одновременно"""
+    return random.uniform(0, HTTP_BACKOFF * (2 ** attempt))
+
+
+def get_session() -> requests.Session:
+    """Возвращает общую requests.Session (создается при первом обращении)"""
+    global _sync_session
+
+    if _sync_session is None:
+        with _sync_lock:
+            if _sync_session is None:
+                from requests.adapters import HTTPAdapter
+                from urllib3.util.retry import Retry
+
+                class HookedRetry(Retry):
+                    """Retry, который сообщает о каждом повторе в on_retry текущего запроса"""
+
+                    def increment(self, *args, **kwargs) -> Retry:
+                        retry: Retry = super().increment(*args, **kwargs)  # Повторы кончились - MaxRetryError
+                        on_retry = getattr(_sync_request, 'on_retry', None)
+                        if on_retry is not None:
+                            on_retry()
+                        return retry
+
+                retry = HookedRetry(total=HTTP_RETRIES,
+                              backoff_factor=HTTP_BACKOFF,
+                              backoff_jitter=HTTP_BACKOFF,
+                              status_forcelist=RETRY_STATUSES,
+                              allowed_methods=frozenset({'GET'}),
+                              raise_on_status=False)  # После повторов возвращаем ответ как есть
+                adapter = HTTPAdapter(pool_connections=16, pool_maxsize=HTTP_POOL_SIZE, max_retries=retry)
+                session = requests.Session()
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _sync_session = session
+    return _sync_session
+
+
+def _record_status(url: str, breaker: CircuitBreaker | None, status: int) -> None:
+    """Учитывает статус ответа в ограничителе частоты и circuit breaker (5xx - сбой сервиса)"""
+    if rate_limiter is not None:
+        rate_limiter.feedback(url, throttled=status in THROTTLE_STATUSES)
+    if breaker is not None:
+        if status >= 500:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+
+
+def get(url: str, timeout: float | tuple | None = None, use_breaker: bool = True,
+        on_retry: Callable[[], None] | None = None) -> requests.Response:
+    """GET-запрос через общую сессию. Исключения те же, что у requests.get.
+    use_breaker=False - запрос выполняется даже при открытом circuit breaker (служебные запросы).
+    on_retry() вызывается перед каждым повтором запроса"""
+    timeout = timeout if timeout is not None else (HTTP_CONNECT_TIMEOUT, HTTP_TIMEOUT)
+    breaker: CircuitBreaker | None = breakers.for_url(url) if use_breaker else None
+    if breaker is not None:
+        breaker.check()
+    if rate_limiter is not None:
+        rate_limiter.acquire(url)
+
+    started: float = time.perf_counter()
+    _sync_request.on_retry = on_retry
+    try:
+        response: requests.Response = get_session().get(url, timeout=timeout)
+    except requests.RequestException as e:
+        metrics.upstream_seconds.observe(time.perf_counter() - started, host=urlsplit(url).hostname,
+                                         status=type(e).__name__)
+        if breaker is not None:
+            breaker.record_failure()
+        raise
+    finally:
+        _sync_request.on_retry = None
+    metrics.upstream_seconds.observe(time.perf_counter() - started, host=urlsplit(url).hostname,
+                                     status=response.status_code)
+    _record_status(url, breaker, response.status_code)
+    return response
+
+
+@dataclass(slots=True)
+class AsyncResponse:
+    """Прочитанный ответ асинхронного фасада. Соединение уже возвращено в пул"""
+    url: str
+    status: int
+    reason: str
+    content: bytes
+    request_info: aiohttp.RequestInfo
+    history: tuple
+
+    def json(self):
+        """Разбирает тело как JSON. При ошибке декодирования получим ValueError"""
+        return json.loads(self.content)
+
+    def raise_for_status(self) -> None:
+        """Статус 4xx/5xx → aiohttp.ClientResponseError"""
+        if self.status >= 400:
+            raise aiohttp.ClientResponseError(self.request_info, self.history,
+                                              status=self.status, message=self.reason)
+
+
+def _trace_config() -> aiohttp.TraceConfig:
+    """Трассировка aiohttp для подсчета запросов и новых соединений по хостам"""
+
+    async def on_request_start(session, context, params) -> None:
+        context.host = params.url.host
+        _async_stats.setdefault(context.host, {'requests': 0, 'connections': 0})['requests'] += 1
+
+    async def on_connection_create_end(session, context, params) -> None:
+        _async_stats[context.host]['connections'] += 1
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_request_start.append(on_request_start)
+    trace_config.on_connection_create_end.append(on_connection_create_end)
+    return trace_config
+
+
+def get_async_session() -> aiohttp.ClientSession:
+    """Возвращает общую aiohttp.ClientSession (создается при первом обращении внутри event loop)"""
+    global _async_session
+
+    if _async_session is None or _async_session.closed:
+        connector = aiohttp.TCPConnector(limit_per_host=HTTP_POOL_SIZE,
+                                         keepalive_timeout=HTTP_KEEPALIVE,
+                                         ttl_dns_cache=300)
+        _async_session = aiohttp.ClientSession(connector=connector, trace_configs=[_trace_config()],
+                                               timeout=aiohttp.ClientTimeout(total=HTTP_TIMEOUT,
+                                                                             connect=HTTP_CONNECT_TIMEOUT))
+    return _async_session
+
+
+async def close_async_session() -> None:
+    """Закрывает общую aiohttp-сессию (при остановке бота)"""
+    global _async_session
+
+    if _async_session is not None and not _async_session.closed:
+        await _async_session.close()
+    _async_session = None
+
+
+class _RetryableStatus(Exception):
+    """Внутренний сигнал: ответ со статусом из RETRY_STATUSES, нужен повтор"""
+
+
+async def get_async(url: str, timeout: float | None = None, use_breaker: bool = True,
+                    on_retry: Callable[[], Awaitable] | None = None) -> AsyncResponse:
+    """Асинхронный GET-запрос через общую сессию с повторами. await on_retry() - перед каждым повтором.
+    Исключения: asyncio.TimeoutError, aiohttp.ClientConnectionError (в том числе CircuitOpenError), aiohttp.ClientError"""
+
+    breaker: CircuitBreaker | None = breakers.for_url(url) if use_breaker else None
+    if breaker is not None:
+        breaker.check()
+
+    session = get_async_session()
+    # timeout=None у aiohttp означает "без таймаута", поэтому передаем его только если задан
+    kwargs: dict = {'timeout': aiohttp.ClientTimeout(total=timeout)} if timeout is not None else {}
+
+    host: str = urlsplit(url).hostname
+    started: float = time.perf_counter()
+    attempt = 0
+    try:
+        while True:
+            if rate_limiter is not None:
+                await rate_limiter.acquire_async(url)
+            try:
+                async with session.get(url, **kwargs) as response:
+                    if response.status in RETRY_STATUSES and attempt < HTTP_RETRIES:
+                        if rate_limiter is not None:
+                            rate_limiter.feedback(url, throttled=response.status in THROTTLE_STATUSES)
+                        raise _RetryableStatus()
+                    result = AsyncResponse(url=url, status=response.status, reason=response.reason or '',
+                                           content=await response.read(), request_info=response.request_info,
+                                           history=response.history)
+                    metrics.upstream_seconds.observe(time.perf_counter() - started, host=host, status=result.status)
+                    _record_status(url, breaker, result.status)
+                    return result
+            except (asyncio.TimeoutError, aiohttp.ClientConnectionError, _RetryableStatus) as e:
+                if attempt >= HTTP_RETRIES:
+                    metrics.upstream_seconds.observe(time.perf_counter() - started, host=host, status=type(e).__name__)
+                    raise
+            except aiohttp.ClientError as e:
+                metrics.upstream_seconds.observe(time.perf_counter() - started, host=host, status=type(e).__name__)
+                raise
+            await asyncio.sleep(backoff_delay(attempt))
+            attempt += 1
+            if on_retry is not None:
+                await on_retry()
+    except (asyncio.TimeoutError, aiohttp.ClientError):
+        if breaker is not None:
+            breaker.record_failure()
+        raise
+    except asyncio.CancelledError:
+        if breaker is not None:
+            breaker.release()  # Отмененный пробный запрос не должен навсегда занять half-open
+        raise
+
+
+def stats() -> dict:
+    """Счетчики по хостам: запросы, новые соединения (TLS рукопожатия) и переиспользованные соединения"""
+    result: dict = {}
+
+    if _sync_session is not None:
+        for adapter in set(_sync_session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools[key]
+                host = result.setdefault(pool.host, {'requests': 0, 'connections': 0})
+                host['requests'] += pool.num_requests
+                host['connections'] += pool.num_connections
+
+    for name, counters in _async_stats.items():
+        host = result.setdefault(name, {'requests': 0, 'connections': 0})
+        host['requests'] += counters['requests']
+        host['connections'] += counters['connections']
+
+    for host in result.values():
+        host['reused'] = max(host['requests'] - host['connections'], 0)
+    return result
@@ -0,0 +1,183 @@
+"""Кэш картинок погоды wttr.in (PNG)
+
+Ключ - нормализованное место + интервал свежести (bucket): в пределах IMAGE_CACHE_BUCKET секунд
+картинка для места запрашивается у wttr.in один раз.
+Файлы адресуются по содержимому (sha256): одинаковые картинки хранятся один раз.
+Размер и возраст кэша ограничены (IMAGE_CACHE_MAX_BYTES, IMAGE_CACHE_MAX_AGE): при превышении
+удаляются давно не использованные файлы.
+Для каждого файла можно запомнить file_id Telegram, чтобы повторно отправлять картинку без чтения с диска."""
+
+import os
+import time
+import hashlib
+import sqlite3
+import threading
+from dataclasses import dataclass
+
+import metrics
+
+# Абсолютный путь: демон CLI (cli_daemon.py) выполняет команды в каталогах клиентов
+IMAGE_CACHE_DIR: str = os.path.abspath(os.getenv("IMAGE_CACHE_DIR", os.path.join('images', 'cache')))
+IMAGE_CACHE_BUCKET: int = int(os.getenv("IMAGE_CACHE_BUCKET", "600"))                     # Свежесть картинки, сек
+IMAGE_CACHE_MAX_BYTES: int = int(os.getenv("IMAGE_CACHE_MAX_BYTES", str(50 * 1024 * 1024)))  # Размер кэша, байт
+IMAGE_CACHE_MAX_AGE: int = int(os.getenv("IMAGE_CACHE_MAX_AGE", "86400"))                  # Возраст файла, сек
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    sha       TEXT PRIMARY KEY,
+    size      INTEGER NOT NULL,
+    last_used REAL NOT NULL,
+    file_id   TEXT                           -- file_id Telegram после первой отправки
+);
+CREATE TABLE IF NOT EXISTS entries (
+    location TEXT NOT NULL,
+    bucket   INTEGER NOT NULL,
+    sha      TEXT NOT NULL REFERENCES blobs(sha),
+    PRIMARY KEY (location, bucket)
+) WITHOUT ROWID;
+"""
+
+
+@dataclass(slots=True)
+class CachedImage:
+    """Картинка в кэше: путь к файлу, хеш содержимого и file_id Telegram (если уже отправлялась)"""
+    path: str
+    sha: str
+    file_id: str | None = None
+
+
+class ImageCache:
+    """Кэш PNG на диске с индексом в SQLite. Потокобезопасный"""
+
+    def __init__(self, folder: str = IMAGE_CACHE_DIR, bucket_seconds: int = IMAGE_CACHE_BUCKET,
+                 max_bytes: int = IMAGE_CACHE_MAX_BYTES, max_age: int = IMAGE_CACHE_MAX_AGE) -> None:
+        self.folder: str = os.path.abspath(folder)  # Не зависит от смены текущего каталога
+        self.bucket_seconds: int = bucket_seconds
+        self.max_bytes: int = max_bytes
+        self.max_age: int = max_age
+
+        os.makedirs(self.folder, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(self.folder, 'index.sqlite3'), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+
+    def _path(self, sha: str) -> str:
+        return os.path.join(self.folder, f'{sha}.png')
+
+    def bucket(self, now: float | None = None) -> int:
+        """Номер интервала свежести для момента времени"""
+        return int((now if now is not None else time.time()) // self.bucket_seconds)
+
+    def get(self, location: str) -> CachedImage | None:
+        """Свежая картинка для места или None"""
+        started: float = time.perf_counter()
+        with self._lock:
+            row = self._conn.execute("SELECT b.sha, b.file_id FROM entries e JOIN blobs b ON b.sha = e.sha "
+                                     "WHERE e.location = ? AND e.bucket = ?",
+                                     (location, self.bucket())).fetchone()
+            if row is None or not os.path.exists(self._path(row[0])):
+                self.misses += 1
+                metrics.cache_lookup_seconds.observe(time.perf_counter() - started, cache='image', result='miss')
+                return None
+            with self._conn:
+                self._conn.execute("UPDATE blobs SET last_used = ? WHERE sha = ?", (time.time(), row[0]))
+            self.hits += 1
+        metrics.cache_lookup_seconds.observe(time.perf_counter() - started, cache='image', result='hit')
+        return CachedImage(self._path(row[0]), row[0], row[1])
+
+    def latest(self, location: str) -> CachedImage | None:
+        """Последняя сохраненная картинка для места из любого интервала (когда свежую получить не удалось)"""
+        with self._lock:
+            row = self._conn.execute("SELECT b.sha, b.file_id FROM entries e JOIN blobs b ON b.sha = e.sha "
+                                     "WHERE e.location = ? ORDER BY e.bucket DESC LIMIT 1", (location,)).fetchone()
+        if row is None or not os.path.exists(self._path(row[0])):
+            return None
+        return CachedImage(self._path(row[0]), row[0], row[1])
+
+    def put(self, location: str, content: bytes) -> CachedImage:
+        """Сохраняет картинку для места в текущем интервале свежести"""
+        sha: str = hashlib.sha256(content).hexdigest()
+        path: str = self._path(sha)
+
+        with self._lock:
+            # Одинаковое содержимое уже лежит на диске - второй раз не пишем
+            if not os.path.exists(path):
+                temp_path: str = f'{path}.{threading.get_ident()}.tmp'
+                with open(temp_path, 'wb') as file:
+                    file.write(content)
+                os.replace(temp_path, path)  # Атомарно: читатели не увидят недописанный файл
+
+            with self._conn:
+                self._conn.execute("INSERT INTO blobs (sha, size, last_used) VALUES (?, ?, ?) "
+                                   "ON CONFLICT(sha) DO UPDATE SET last_used = excluded.last_used",
+                                   (sha, len(content), time.time()))
+                self._conn.execute("INSERT OR REPLACE INTO entries (location, bucket, sha) VALUES (?, ?, ?)",
+                                   (location, self.bucket(), sha))
+                file_id = self._conn.execute("SELECT file_id FROM blobs WHERE sha = ?", (sha,)).fetchone()[0]
+            self._evict(keep=sha)
+
+        return CachedImage(path, sha, file_id)
+
+    def set_file_id(self, sha: str, file_id: str) -> None:
+        """Запоминает file_id Telegram для картинки"""
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE blobs SET file_id = ? WHERE sha = ?", (file_id, sha))
+
+    def _evict(self, keep: str) -> None:
+        """Удаляет устаревшие записи и файлы сверх лимитов возраста и размера,
+        кроме только что сохраненного файла keep. Вызывать под блокировкой"""
+        now: float = time.time()
+        with self._conn:
+            # Записи прошлых интервалов свежести больше не используются
+            self._conn.execute("DELETE FROM entries WHERE bucket < ?", (self.bucket(now) - 1,))
+
+            expired: list = [row[0] for row in self._conn.execute(
+                "SELECT sha FROM blobs WHERE last_used < ?", (now - self.max_age,))]
+
+            total: int = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+            if total > self.max_bytes:
+                for sha, size in self._conn.execute("SELECT sha, size FROM blobs ORDER BY last_used"):
+                    if total <= self.max_bytes:
+                        break
+                    if sha == keep:
+                        continue
+                    if sha not in expired:
+                        expired.append(sha)
+                    total -= size
+
+            for sha in expired:
+                self._conn.execute("DELETE FROM entries WHERE sha = ?", (sha,))
+                self._conn.execute("DELETE FROM blobs WHERE sha = ?", (sha,))
+                try:
+                    os.remove(self._path(sha))
+                except FileNotFoundError:
+                    pass
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        """Счетчики попаданий, промахов и удалений, количество и общий размер файлов"""
+        with self._lock:
+            count, total = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs").fetchone()
+        return {'files': count, 'bytes': total, 'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions}
+
+
+_image_cache: ImageCache | None = None
+_image_cache_lock = threading.Lock()
+
+
+def get_image_cache() -> ImageCache:
+    """Общий кэш картинок процесса (создается при первом обращении)"""
+    global _image_cache
+
+    if _image_cache is None:
+        with _image_cache_lock:
+            if _image_cache is None:
+                _image_cache = ImageCache()
+    return _image_cache
@@ -0,0 +1,270 @@
+"""Карточки погоды для Telegram: обработка картинок wttr.in в пуле процессов
+
+Карточка - картинка из кэша картинок (image_cache.py), уменьшенная до IMAGE_CARD_WIDTH и сжатая
+(палитра IMAGE_CARD_COLORS цветов: файл в 3-4 раза меньше). Несколько городов собираются в одну карточку
+сеткой по IMAGE_TILE_COLUMNS столбцов.
+
+Работа с пикселями нагружает CPU, и в event loop бота она останавливала бы все чаты. Поэтому картинки
+обрабатываются в ProcessPoolExecutor (IMAGE_WORKERS процессов, GIL не мешает), а в loop остается только await.
+Очередь ограничена: одновременно в работе и в ожидании не больше IMAGE_QUEUE_SIZE задач. Новая задача
+ждет свободного места до IMAGE_QUEUE_TIMEOUT секунд, затем получает PipelineBusy, и бот отправляет
+исходную картинку.
+
+Готовые карточки лежат в IMAGE_CACHE_DIR/derived/<ключ>.png. Ключ - sha256 от хешей исходных картинок
+и параметров обработки, поэтому одна и та же карточка собирается один раз, а одинаковые одновременные
+запросы объединяются (single-flight). Размер папки ограничен IMAGE_DERIVED_MAX_BYTES.
+
+Pillow импортируется только там, где картинки обрабатываются (процессы пула, CLI), а не при импорте модуля."""
+
+import os
+import math
+import time
+import asyncio
+import hashlib
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import metrics
+from metrics import log
+from cache import TTLCache
+from single_flight import AsyncSingleFlight
+from image_cache import CachedImage, IMAGE_CACHE_DIR, IMAGE_CACHE_MAX_AGE
+
+IMAGE_WORKERS: int = int(os.getenv("IMAGE_WORKERS", str(min(4, os.cpu_count() or 1))))  # Процессов в пуле
+IMAGE_QUEUE_SIZE: int = int(os.getenv("IMAGE_QUEUE_SIZE", "32"))              # Задач в работе и в ожидании
+IMAGE_QUEUE_TIMEOUT: float = float(os.getenv("IMAGE_QUEUE_TIMEOUT", "5"))     # Ожидание места в очереди, сек
+IMAGE_CARD_WIDTH: int = int(os.getenv("IMAGE_CARD_WIDTH", "800"))             # Ширина карточки, px (0 - не уменьшать)
+IMAGE_CARD_COLORS: int = int(os.getenv("IMAGE_CARD_COLORS", "256"))           # Цветов в палитре (0 - без палитры)
+IMAGE_TILE_COLUMNS: int = int(os.getenv("IMAGE_TILE_COLUMNS", "2"))           # Столбцов в карточке нескольких городов
+IMAGE_TILE_MAX: int = int(os.getenv("IMAGE_TILE_MAX", "4"))                   # Максимум городов в одной карточке
+IMAGE_DERIVED_MAX_BYTES: int = int(os.getenv("IMAGE_DERIVED_MAX_BYTES", str(20 * 1024 * 1024)))  # Размер папки карточек
+
+render_seconds = metrics.Histogram('image_render_seconds', 'Время обработки карточки в пуле (с ожиданием очереди)',
+                                   ('kind',))
+queue_depth = metrics.Gauge('image_queue_depth', 'Карточек в работе и в ожидании')
+queue_rejected = metrics.Counter('image_queue_rejected_total', 'Карточки, не поставленные в переполненную очередь')
+
+
+class PipelineBusy(Exception):
+    """Очередь обработки переполнена: место не освободилось за IMAGE_QUEUE_TIMEOUT секунд"""
+
+
+def card_key(shas: list, width: int, columns: int, colors: int) -> str:
+    """Ключ карточки: хеши исходных картинок (в порядке городов) и параметры обработки"""
+    params: str = f"{','.join(shas)}|width={width}|columns={columns}|colors={colors}"
+    return hashlib.sha256(params.encode()).hexdigest()
+
+
+def render_card(sources: tuple, output: str, width: int, columns: int, colors: int) -> int:
+    """Собирает карточку из картинок sources и атомарно сохраняет в output. Возвращает размер файла.
+    Выполняется в процессе пула (или прямо в CLI), поэтому Pillow импортируется здесь"""
+    from PIL import Image
+
+    images: list = []
+    for path in sources:
+        with Image.open(path) as image:
+            images.append(image.convert('RGB'))
+
+    if len(images) == 1:
+        card = images[0]
+    else:
+        # Сетка: ячейка по размеру самой большой картинки, фон черный, как у картинок wttr.in
+        columns = max(1, min(columns, len(images)))
+        cell_width: int = max(image.width for image in images)
+        cell_height: int = max(image.height for image in images)
+        card = Image.new('RGB', (cell_width * columns, cell_height * math.ceil(len(images) / columns)))
+        for i, image in enumerate(images):
+            card.paste(image, ((i % columns) * cell_width, (i // columns) * cell_height))
+
+    if width and card.width > width:
+        card = card.resize((width, max(1, round(card.height * width / card.width))), Image.Resampling.LANCZOS)
+    if colors:
+        # FASTOCTREE в десятки раз быстрее MEDIANCUT, а картинки wttr.in и так почти без градиентов
+        card = card.quantize(colors=colors, method=Image.Quantize.FASTOCTREE, dither=Image.Dither.NONE)
+
+    temp_path: str = f'{output}.{os.getpid()}.tmp'
+    card.save(temp_path, 'PNG')  # optimize=True почти не уменьшает палитровый PNG, но вдвое медленнее
+    os.replace(temp_path, output)  # Атомарно: читатели не увидят недописанный файл
+    return os.path.getsize(output)
+
+
+def _worker_ready() -> int:
+    """Пустая задача для прогрева пула: процесс запущен и модуль импортирован"""
+    return os.getpid()
+
+
+class ImagePipeline:
+    """Обработка карточек в пуле процессов с ограниченной очередью и кэшем результатов на диске"""
+
+    def __init__(self, workers: int = IMAGE_WORKERS, queue_size: int = IMAGE_QUEUE_SIZE,
+                 queue_timeout: float = IMAGE_QUEUE_TIMEOUT, folder: str = os.path.join(IMAGE_CACHE_DIR, 'derived'),
+                 max_bytes: int = IMAGE_DERIVED_MAX_BYTES) -> None:
+        self.workers: int = workers
+        self.queue_size: int = queue_size
+        self.queue_timeout: float = queue_timeout
+        self.folder: str = os.path.abspath(folder)  # Не зависит от смены текущего каталога
+        self.max_bytes: int = max_bytes
+        os.makedirs(self.folder, exist_ok=True)
+
+        self._executor: ProcessPoolExecutor | None = None
+        self._executor_lock = threading.Lock()
+        self._slots: asyncio.Semaphore | None = None   # Места в очереди (создаются в event loop)
+        self._slots_loop: asyncio.AbstractEventLoop | None = None
+        self._flight: AsyncSingleFlight = AsyncSingleFlight('image')
+        self._evict_lock = threading.Lock()
+        # file_id Telegram для отправленных карточек (в базе кэша картинок их нет)
+        self._file_ids: TTLCache = TTLCache(ttl=IMAGE_CACHE_MAX_AGE, maxsize=4096)
+
+        self.pending: int = 0     # Задач в работе и в ожидании
+        self.rendered: int = 0
+        self.hits: int = 0
+        self.rejected: int = 0
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        """Пул процессов (создается при первом обращении). Процессы запускаются через spawn:
+        fork процесса с потоками (asyncio.to_thread, SQLite) может зависнуть"""
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                         mp_context=multiprocessing.get_context('spawn'))
+        return self._executor
+
+    def _get_slots(self) -> asyncio.Semaphore:
+        """Семафор очереди для текущего event loop"""
+        loop = asyncio.get_running_loop()
+        if self._slots is None or self._slots_loop is not loop:
+            self._slots = asyncio.Semaphore(self.queue_size)
+            self._slots_loop = loop
+        return self._slots
+
+    async def start(self) -> None:
+        """Запускает процессы пула заранее, чтобы первая карточка не ждала старта интерпретатора"""
+        loop = asyncio.get_running_loop()
+        executor: ProcessPoolExecutor = self._get_executor()
+        await asyncio.gather(*(loop.run_in_executor(executor, _worker_ready) for _ in range(self.workers)))
+        log(f"[i] Пул обработки картинок: {self.workers} процессов, очередь {self.queue_size}")
+
+    def shutdown(self) -> None:
+        """Останавливает пул, задачи в ожидании отменяются"""
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.folder, f'{key}.png')
+
+    def _cached(self, key: str) -> CachedImage | None:
+        """Готовая карточка с диска или None"""
+        started: float = time.perf_counter()
+        path: str = self._path(key)
+        try:
+            os.utime(path)  # Время изменения - время последнего использования для вытеснения
+        except FileNotFoundError:
+            metrics.cache_lookup_seconds.observe(time.perf_counter() - started, cache='card', result='miss')
+            return None
+        self.hits += 1
+        metrics.cache_lookup_seconds.observe(time.perf_counter() - started, cache='card', result='hit')
+        return CachedImage(path, key, self._file_ids.get(key))
+
+    def render_sync(self, images: list, width: int = IMAGE_CARD_WIDTH, columns: int = IMAGE_TILE_COLUMNS,
+                    colors: int = IMAGE_CARD_COLORS) -> CachedImage:
+        """Карточка прямо в текущем процессе (CLI: один запрос, запуск пула обошелся бы дороже)"""
+        key: str = card_key([image.sha for image in images], width, columns, colors)
+        card: CachedImage | None = self._cached(key)
+        if card is not None:
+            return card
+
+        with render_seconds.time(kind='tile' if len(images) > 1 else 'card'):
+            render_card(tuple(image.path for image in images), self._path(key), width, columns, colors)
+        self.rendered += 1
+        self._evict(keep=key)
+        return CachedImage(self._path(key), key)
+
+    async def render(self, images: list, width: int = IMAGE_CARD_WIDTH, columns: int = IMAGE_TILE_COLUMNS,
+                     colors: int = IMAGE_CARD_COLORS) -> CachedImage:
+        """Карточка из картинок images (CachedImage, одна или несколько). Готовая карточка берется с диска,
+        новая собирается в пуле процессов. Исключения: PipelineBusy, ошибки обработки и пула"""
+        key: str = card_key([image.sha for image in images], width, columns, colors)
+        card: CachedImage | None = self._cached(key)
+        if card is not None:
+            return card
+
+        sources: tuple = tuple(image.path for image in images)
+        kind: str = 'tile' if len(images) > 1 else 'card'
+        await self._flight.do(key, lambda: self._submit(kind, sources, key, width, columns, colors))
+        return CachedImage(self._path(key), key)
+
+    async def _submit(self, kind: str, sources: tuple, key: str, width: int, columns: int, colors: int) -> None:
+        """Ставит задачу в пул, если в очереди есть место (backpressure), и ждет результата"""
+        slots: asyncio.Semaphore = self._get_slots()
+        try:
+            await asyncio.wait_for(slots.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            queue_rejected.inc()
+            raise PipelineBusy(f"Очередь обработки картинок переполнена ({self.queue_size})") from None
+
+        self.pending += 1
+        queue_depth.set(self.pending)
+        try:
+            loop = asyncio.get_running_loop()
+            with render_seconds.time(kind=kind):
+                await loop.run_in_executor(self._get_executor(), render_card,
+                                           sources, self._path(key), width, columns, colors)
+            self.rendered += 1
+        finally:
+            self.pending -= 1
+            queue_depth.set(self.pending)
+            slots.release()
+        await asyncio.to_thread(self._evict, key)
+
+    def set_file_id(self, key: str, file_id: str) -> None:
+        """Запоминает file_id Telegram для карточки"""
+        self._file_ids.set(key, file_id)
+
+    def _evict(self, keep: str) -> None:
+        """Удаляет давно не использованные карточки сверх IMAGE_DERIVED_MAX_BYTES, кроме только что собранной"""
+        with self._evict_lock:
+            files: list = []
+            total: int = 0
+            with os.scandir(self.folder) as entries:
+                for entry in entries:
+                    if entry.name.endswith('.png') and entry.is_file():
+                        stat = entry.stat()
+                        files.append((stat.st_mtime, stat.st_size, entry.path))
+                        total += stat.st_size
+            if total <= self.max_bytes:
+                return
+
+            for _, size, path in sorted(files):
+                if total <= self.max_bytes:
+                    break
+                if path == self._path(keep):
+                    continue
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+    def stats(self) -> dict:
+        """Счетчики: собрано карточек, взято с диска, отклонено переполненной очередью, в работе сейчас"""
+        return {'rendered': self.rendered, 'hits': self.hits, 'rejected': self.rejected, 'pending': self.pending}
+
+
+_pipeline: ImagePipeline | None = None
+_pipeline_lock = threading.Lock()
+
+
+def get_pipeline() -> ImagePipeline:
+    """Общий конвейер карточек процесса (создается при первом обращении)"""
+    global _pipeline
+
+    if _pipeline is None:
+        with _pipeline_lock:
+            if _pipeline is None:
+                _pipeline = ImagePipeline()
+    return _pipeline
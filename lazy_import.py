@@ -0,0 +1,30 @@
+"""Отложенный импорт тяжелых библиотек (requests, aiohttp)
+
+lazy_import('aiohttp') сразу возвращает объект модуля, но сам модуль выполняется только при первом
+обращении к его атрибуту (importlib.util.LazyLoader). Поэтому CLI, которому aiohttp не нужен
+(синхронный запрос одного города), не тратит на его импорт ~150 мс при каждом запуске.
+
+Аннотации с такими модулями (-> requests.Response) не должны вычисляться при импорте:
+в модулях с lazy_import используется from __future__ import annotations."""
+
+import sys
+import importlib.util
+from types import ModuleType
+
+
+def lazy_import(name: str) -> ModuleType:
+    """Модуль верхнего уровня name, который загрузится при первом обращении к атрибуту.
+    Если модуль уже импортирован - возвращается он"""
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError(f"No module named '{name}'", name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
@@ -0,0 +1,237 @@
+"""Индекс городов: названия по-русски и латиницей, синонимы и опечатки → координаты
+
+Данные - data/cities.tsv (поставляется с ботом). Индекс загружается при первом обращении (get_index)
+и хранится компактно: все варианты написания - один отсортированный список строк, номера городов -
+array('H'), координаты - array('d'). Точное совпадение - бинарный поиск (bisect). Опечатки - метод
+symmetric delete: для каждого варианта заранее построены строки без одной буквы, кандидаты для запроса
+находятся поиском его строк без одной буквы в словаре, а затем проверяются расстоянием
+Дамерау-Левенштейна. Так одна опечатка (замена, пропуск, лишняя буква, перестановка) находится
+за несколько обращений к словарю, без перебора всех городов. Результаты поиска кэшируются.
+
+Опечатка принимается, только если исправление однозначно: в коротких названиях (до 5 букв) опечатки
+не допускаются (Орск - не Омск, Пинск - не Минск), а при нескольких одинаково близких городах
+результата нет. Ненайденное место запрашивается у wttr.in по названию.
+
+Ключ места для wttr.in и кэшей - координаты 'широта,долгота' (как раньше для Уфы):
+'Москва', 'москва ', 'Moscow', 'Мсква' и 'мск' дают один и тот же запрос и одну запись в кэше.
+
+Проверка из командной строки:  python locations.py Мсква Moskow питер"""
+
+import os
+import bisect
+import argparse
+import threading
+from array import array
+from dataclasses import dataclass
+from functools import lru_cache
+
+LOCATIONS_FILE: str = os.getenv("LOCATIONS_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                                'data', 'cities.tsv'))
+
+# Транслитерация для автоматических латинских вариантов ('Челябинск' → 'chelyabinsk')
+_TRANSLIT: dict = str.maketrans({
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'e', 'ж': 'zh', 'з': 'z', 'и': 'i',
+    'й': 'y', 'к': 'k', 'л': 'l', 'м': 'm', 'н': 'n', 'о': 'o', 'п': 'p', 'р': 'r', 'с': 's', 'т': 't',
+    'у': 'u', 'ф': 'f', 'х': 'kh', 'ц': 'ts', 'ч': 'ch', 'ш': 'sh', 'щ': 'shch', 'ъ': '', 'ы': 'y', 'ь': '',
+    'э': 'e', 'ю': 'yu', 'я': 'ya'})
+
+
+def normalize_name(name: str) -> str:
+    """Единый вид названия для поиска: нижний регистр, ё → е, дефисы и '+' как пробелы, без лишних пробелов"""
+    name = name.lower().replace('ё', 'е')
+    for separator in '-_+':
+        name = name.replace(separator, ' ')
+    return ' '.join(name.split())
+
+
+def transliterate(name: str) -> str:
+    return name.translate(_TRANSLIT)
+
+
+def deletes(word: str) -> set:
+    """Слово и все варианты без одной буквы"""
+    return {word, *(word[:i] + word[i + 1:] for i in range(len(word)))}
+
+
+def max_typos(length: int) -> int:
+    """Сколько опечаток допускается в названии такой длины"""
+    return 0 if length <= 5 else 1 if length <= 8 else 2
+
+
+def distance(a: str, b: str, limit: int) -> int:
+    """Расстояние Дамерау-Левенштейна (вставка, удаление, замена, перестановка соседних букв).
+    Считается только полоса |i - j| <= limit; если расстояние больше limit - возвращает limit + 1"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+
+    over: int = limit + 1
+    previous2: list = []
+    previous: list = [j if j <= limit else over for j in range(len(b) + 1)]
+    for i in range(1, len(a) + 1):
+        current: list = [i if i <= limit else over] + [over] * len(b)
+        for j in range(max(1, i - limit), min(len(b), i + limit) + 1):
+            value: int = previous[j - 1] if a[i - 1] == b[j - 1] else previous[j - 1] + 1
+            if previous[j] + 1 < value:
+                value = previous[j] + 1
+            if current[j - 1] + 1 < value:
+                value = current[j - 1] + 1
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1] and previous2[j - 2] + 1 < value:
+                value = previous2[j - 2] + 1
+            current[j] = value
+        if min(current) > limit:
+            return over
+        previous2, previous = previous, current
+    return min(previous[-1], over)
+
+
+@dataclass(slots=True, frozen=True)
+class Location:
+    """Город из индекса"""
+    name: str           # Название по-русски
+    name_en: str
+    latitude: float
+    longitude: float
+
+    @property
+    def key(self) -> str:
+        """Ключ места для wttr.in и кэшей: координаты с точностью ~100 м"""
+        return f'{self.latitude:.3f},{self.longitude:.3f}'
+
+
+class LocationIndex:
+    """Поиск городов по названию, синонимам и с опечатками. После загрузки только читается"""
+
+    def __init__(self, rows: list) -> None:
+        """rows - (название, название латиницей, широта, долгота, список синонимов)"""
+        self.names: tuple = tuple(row[0] for row in rows)
+        self.names_en: tuple = tuple(row[1] for row in rows)
+        self.coordinates: array = array('d', (value for row in rows for value in (row[2], row[3])))
+
+        variants: dict = {}  # Вариант написания → номер города (первый город в файле важнее)
+        for city_id, (name, name_en, _, _, aliases) in enumerate(rows):
+            for variant in (name, name_en, *aliases):
+                variant = normalize_name(variant)
+                variants.setdefault(variant, city_id)
+                variants.setdefault(transliterate(variant), city_id)
+
+        self.keys: list = sorted(variants)
+        self.ids: array = array('H', (variants[key] for key in self.keys))
+        self._by_key: dict = {self.location(city_id).key: city_id for city_id in range(len(rows))}
+
+        # Строка без одной буквы → номера вариантов написания, из которых она получается
+        deleted: dict = {}
+        for index, key in enumerate(self.keys):
+            if max_typos(len(key)):
+                for variant in deletes(key):
+                    deleted.setdefault(variant, []).append(index)
+        self._deletes: dict = {variant: tuple(indexes) for variant, indexes in deleted.items()}
+
+    @classmethod
+    def load(cls, path: str = LOCATIONS_FILE) -> 'LocationIndex':
+        """Читает TSV: строки с '#' - комментарии, первая строка без '#' - заголовок"""
+        rows: list = []
+        with open(path, encoding='utf-8') as file:
+            lines = (line.rstrip('\n') for line in file if line.strip() and not line.startswith('#'))
+            next(lines)  # Заголовок
+            for line in lines:
+                name, name_en, latitude, longitude, *rest = line.split('\t')
+                aliases: list = [alias for alias in (rest[0].split('|') if rest else []) if alias]
+                rows.append((name, name_en, float(latitude), float(longitude), aliases))
+        return cls(rows)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def location(self, city_id: int) -> Location:
+        return Location(self.names[city_id], self.names_en[city_id],
+                        self.coordinates[2 * city_id], self.coordinates[2 * city_id + 1])
+
+    def _exact(self, query: str) -> int | None:
+        index: int = bisect.bisect_left(self.keys, query)
+        if index < len(self.keys) and self.keys[index] == query:
+            return self.ids[index]
+        return None
+
+    def _fuzzy(self, query: str) -> int | None:
+        """Ближайший вариант написания с допустимым для его длины числом опечаток. None - если
+        ближайших городов несколько: угадывать между ними нельзя"""
+        candidates: set = set()
+        for variant in deletes(query):
+            candidates.update(self._deletes.get(variant, ()))
+
+        best: int | None = None  # Наименьшее расстояние
+        cities: set = set()      # Города с этим расстоянием
+        for index in candidates:
+            limit: int = max_typos(len(self.keys[index]))
+            value: int = distance(query, self.keys[index], limit)
+            if value > limit or (best is not None and value > best):
+                continue
+            if best is None or value < best:
+                best, cities = value, set()
+            cities.add(self.ids[index])
+        return cities.pop() if len(cities) == 1 else None
+
+    def resolve(self, query: str) -> int | None:
+        """Номер города для названия или None"""
+        query = normalize_name(query)
+        if not query:
+            return None
+        city_id = self._exact(query)
+        if city_id is None:
+            city_id = self._exact(transliterate(query))  # 'Moskva' уже есть, 'Челябинск' латиницей тоже
+        if city_id is None:
+            city_id = self._fuzzy(query)
+        return city_id
+
+    def lookup(self, query: str) -> Location | None:
+        """Город для названия (с синонимами и опечатками) или None"""
+        city_id = self.resolve(query)
+        return self.location(city_id) if city_id is not None else None
+
+    def name_for_key(self, key: str) -> str | None:
+        """Название города по ключу-координатам (для вывода вместо названия, которое вернул wttr.in)"""
+        city_id = self._by_key.get(key)
+        return self.names[city_id] if city_id is not None else None
+
+
+_index: LocationIndex | None = None
+_index_lock = threading.Lock()
+
+
+def get_index() -> LocationIndex:
+    """Общий индекс на процесс (загружается при первом обращении)"""
+    global _index
+
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = LocationIndex.load()
+    return _index
+
+
+@lru_cache(maxsize=4096)
+def lookup(query: str) -> Location | None:
+    """Город для названия через общий индекс. Повторные запросы - из кэша (микросекунды)"""
+    return get_index().lookup(query)
+
+
+def name_for_key(key: str) -> str | None:
+    return get_index().name_for_key(key)
+
+
+def main() -> None:
+    """Поиск городов из командной строки"""
+    parser = argparse.ArgumentParser(description='Поиск города в индексе: название, синоним или с опечаткой')
+    parser.add_argument('names', nargs='+', help='Названия городов')
+    args = parser.parse_args()
+
+    for name in args.names:
+        location: Location | None = lookup(name)
+        if location is None:
+            print(f"[!] {name}: город не найден")
+        else:
+            print(f"[ok] {name} → {location.name} ({location.name_en}), координаты {location.key}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+"""Метрики процесса в формате Prometheus и переключаемый вывод диагностических сообщений
+
+Counter - только растет, Gauge - текущее значение, Histogram - распределение времени (сек) по корзинам.
+У каждой метрики могут быть метки: значения передаются именованными аргументами (host='wttr.in').
+Все метрики регистрируются в REGISTRY, render() отдает их в текстовом формате Prometheus,
+start_server() поднимает локальный HTTP-эндпоинт /metrics (его запускает бот, порт METRICS_PORT).
+
+log() заменяет print() для сообщений в горячем пути ([->] Запрос по адресу ..., [!] HTTP ошибка ...):
+при LOG_ENABLED=0 сообщения не форматируются в stdout, и синхронный вывод не тормозит обработку запросов."""
+
+from __future__ import annotations
+
+import os
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+
+LOG_ENABLED: bool = os.getenv("LOG_ENABLED", "1") == "1"                  # Диагностические сообщения в stdout
+METRICS_HOST: str = os.getenv("METRICS_HOST", "127.0.0.1")                # Адрес эндпоинта /metrics
+METRICS_PORT: int = int(os.getenv("METRICS_PORT", "9101"))                # Порт эндпоинта /metrics (0 - выключен)
+
+# Корзины гистограмм времени, сек: от попадания в кэш до медленного ответа сервиса
+DEFAULT_BUCKETS: tuple = (0.00001, 0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                          0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+REGISTRY: list = []
+
+
+def log(message: str) -> None:
+    """Диагностическое сообщение: print(), если вывод не выключен LOG_ENABLED=0"""
+    if LOG_ENABLED:
+        print(message)
+
+
+def _escape(value) -> str:
+    """Экранирование значения метки по формату Prometheus"""
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _format_labels(labelnames: tuple, key: tuple, extra: str = '') -> str:
+    """{host="wttr.in",status="200"} из имен и значений меток"""
+    pairs: list = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, key)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class _Metric:
+    """Общая часть метрик: имя, описание, метки и значения по наборам меток. Потокобезопасный"""
+    kind: str = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()) -> None:
+        self.name: str = name
+        self.documentation: str = documentation
+        self.labelnames: tuple = tuple(labelnames)
+        self._values: dict = {}  # Значения меток (кортеж) -> значение метрики
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        """Значения меток в порядке labelnames. KeyError - метка не передана"""
+        return tuple(labels[name] for name in self.labelnames)
+
+    def value(self, **labels) -> float:
+        """Текущее значение для набора меток (для проверок и отладки)"""
+        return self._values.get(self._key(labels), 0.0)
+
+    def samples(self) -> list:
+        """Строки текстового формата Prometheus"""
+        with self._lock:
+            items: list = list(self._values.items())
+        return [f'{self.name}{_format_labels(self.labelnames, key)} {value}' for key, value in items]
+
+    def render(self) -> str:
+        return '\n'.join([f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}',
+                          *self.samples()])
+
+
+class Counter(_Metric):
+    """Счетчик, который только растет"""
+    kind = 'counter'
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key: tuple = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Gauge(_Metric):
+    """Текущее значение (может уменьшаться)"""
+    kind = 'gauge'
+
+    def set(self, value: float, **labels) -> None:
+        key: tuple = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key: tuple = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels) -> None:
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    """Распределение значений по корзинам. Хранятся некумулятивные счетчики корзин,
+    накопительные суммы (как требует формат) считаются только при выводе"""
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (),
+                 buckets: tuple = DEFAULT_BUCKETS) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets: tuple = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels) -> None:
+        key: tuple = self._key(labels)
+        index: int = bisect.bisect_left(self.buckets, value)  # len(buckets) - корзина +Inf
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]  # корзины, сумма, количество
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Замер времени блока with (сек), в том числе при исключении"""
+        started: float = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def value(self, **labels) -> float:
+        """Количество наблюдений для набора меток"""
+        state = self._values.get(self._key(labels))
+        return state[2] if state is not None else 0
+
+    def samples(self) -> list:
+        with self._lock:
+            items: list = [(key, (list(state[0]), state[1], state[2])) for key, state in self._values.items()]
+
+        lines: list = []
+        for key, (counts, total, count) in items:
+            cumulative: int = 0
+            for bound, bucket_count in zip((*self.buckets, '+Inf'), counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, key, f'le="{bound}"')} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labelnames, key)} {total}')
+            lines.append(f'{self.name}_count{_format_labels(self.labelnames, key)} {count}')
+        return lines
+
+
+def render() -> str:
+    """Все зарегистрированные метрики в текстовом формате Prometheus"""
+    return '\n'.join(metric.render() for metric in REGISTRY) + '\n'
+
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    from aiohttp import web
+
+    return web.Response(text=render(), content_type='text/plain', charset='utf-8',
+                        headers={'X-Content-Format': 'prometheus-0.0.4'})
+
+
+async def start_server(host: str = METRICS_HOST, port: int = METRICS_PORT) -> web.AppRunner:
+    """Запускает эндпоинт /metrics в текущем event loop. Остановка: await runner.cleanup()"""
+    from aiohttp import web  # Не нужен CLI: импортируется только при запуске эндпоинта
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    log(f"[i] Метрики: http://{host}:{port}/metrics")
+    return runner
+
+
+# Метрики горячего пути
+upstream_seconds = Histogram('upstream_request_seconds', 'Время запроса к внешнему сервису (с повторами)',
+                             ('host', 'status'))
+parse_seconds = Histogram('parse_seconds', 'Время разбора ответа сервиса', ('kind',))
+cache_lookup_seconds = Histogram('cache_lookup_seconds', 'Время поиска в кэше', ('cache', 'result'))
+telegram_send_seconds = Histogram('telegram_send_seconds', 'Время запроса к Bot API Telegram', ('method', 'status'))
+
+# Ошибки и квота exchangerate-api
+api_errors = Counter('exchange_api_errors_total', 'Ошибки API exchangerate-api по типам (error_api)', ('error_type',))
+api_quota_reached = Gauge('exchange_api_quota_reached', '1 - получена ошибка quota-reached')
+api_quota_remaining = Gauge('exchange_api_quota_remaining', 'Осталось запросов в текущем месяце (по /quota)')
+api_quota_total = Gauge('exchange_api_quota_total', 'Квота запросов в месяц (по /quota)')
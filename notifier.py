@@ -0,0 +1,139 @@
+"""Пакетная отправка уведомлений в Telegram с соблюдением лимитов Bot API
+
+Планировщик подписок (scheduler.py) ставит уведомления в очередь (notify), рассылку делает одна задача:
+ - берет из очереди до NOTIFY_BATCH сообщений и объединяет сообщения одному чату в одно
+   (не длиннее MESSAGE_LIMIT): несколько подписок чата в одну минуту - один запрос к Bot API
+ - отправляет пакет параллельно, но не быстрее TELEGRAM_SEND_RATE сообщений в секунду (token bucket)
+ - на TelegramRetryAfter ждет указанное время и повторяет, TelegramForbiddenError (бот заблокирован) -
+   вызывает on_blocked(chat_id), чтобы удалить подписки чата"""
+
+import os
+import asyncio
+from aiogram.exceptions import TelegramRetryAfter, TelegramForbiddenError
+
+import metrics
+from metrics import log
+from rate_limit import TokenBucket
+
+TELEGRAM_SEND_RATE: float = float(os.getenv("TELEGRAM_SEND_RATE", "25"))   # Сообщений в секунду (лимит Telegram ~30)
+NOTIFY_BATCH: int = int(os.getenv("NOTIFY_BATCH", "100"))                  # Сообщений из очереди за один пакет
+NOTIFY_QUEUE_SIZE: int = int(os.getenv("NOTIFY_QUEUE_SIZE", "100000"))     # Максимум сообщений в очереди
+NOTIFY_RETRIES: int = int(os.getenv("NOTIFY_RETRIES", "3"))                # Попыток отправки при TelegramRetryAfter
+
+# Максимальная длина сообщения Telegram
+MESSAGE_LIMIT: int = 4096
+
+notifications_total = metrics.Counter('notifications_total', 'Уведомления по подпискам по результату отправки',
+                                      ('status',))
+notify_queue_depth = metrics.Gauge('notify_queue_depth', 'Уведомлений в очереди на отправку')
+
+
+def merge_messages(batch: list) -> list:
+    """[(chat_id, текст)] → [(chat_id, текст)]: сообщения одному чату склеиваются по порядку,
+    пока помещаются в MESSAGE_LIMIT. Слишком длинный текст режется на части"""
+    chats: dict = {}
+    for chat_id, text in batch:
+        chats.setdefault(chat_id, []).append(text)
+
+    merged: list = []
+    for chat_id, texts in chats.items():
+        current: str = ''
+        for text in texts:
+            if current and len(current) + 2 + len(text) <= MESSAGE_LIMIT:
+                current += '\n\n' + text
+                continue
+            if current:
+                merged.append((chat_id, current))
+            while len(text) > MESSAGE_LIMIT:
+                merged.append((chat_id, text[:MESSAGE_LIMIT]))
+                text = text[MESSAGE_LIMIT:]
+            current = text
+        if current:
+            merged.append((chat_id, current))
+    return merged
+
+
+class Notifier:
+    """Очередь уведомлений и задача рассылки. Работает в одном event loop"""
+
+    def __init__(self, rate: float = TELEGRAM_SEND_RATE, batch: int = NOTIFY_BATCH,
+                 queue_size: int = NOTIFY_QUEUE_SIZE) -> None:
+        self.bucket: TokenBucket = TokenBucket(rate)
+        self.batch: int = batch
+        self.queue_size: int = queue_size
+        self.send = None        # async send(chat_id, text), например Bot.send_message
+        self.on_blocked = None  # on_blocked(chat_id): пользователь заблокировал бота
+        self._queue: asyncio.Queue | None = None
+        self._task: asyncio.Task | None = None
+
+    def start(self, send, on_blocked=None) -> None:
+        """Запускает рассылку в текущем event loop"""
+        self.send = send
+        self.on_blocked = on_blocked
+        self._queue = asyncio.Queue(self.queue_size)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Останавливает рассылку (неотправленные сообщения теряются)"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def notify(self, chat_id: int, text: str) -> bool:
+        """Ставит сообщение в очередь. False - рассылка не запущена или очередь переполнена"""
+        if self._queue is None:
+            return False
+        try:
+            self._queue.put_nowait((chat_id, text))
+        except asyncio.QueueFull:
+            notifications_total.inc(status='dropped')
+            return False
+        notify_queue_depth.set(self._queue.qsize())
+        return True
+
+    async def join(self) -> None:
+        """Ждет, пока очередь будет отправлена"""
+        if self._queue is not None:
+            await self._queue.join()
+
+    async def _run(self) -> None:
+        """Бесконечный цикл: пакет из очереди → объединение по чатам → параллельная отправка"""
+        while True:
+            batch: list = [await self._queue.get()]
+            while len(batch) < self.batch and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            notify_queue_depth.set(self._queue.qsize())
+            try:
+                await asyncio.gather(*(self._deliver(chat_id, text) for chat_id, text in merge_messages(batch)))
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _deliver(self, chat_id: int, text: str) -> None:
+        """Отправляет одно сообщение с учетом лимита и повторов"""
+        for _ in range(NOTIFY_RETRIES):
+            await self.bucket.acquire_async()
+            try:
+                await self.send(chat_id, text)
+            except TelegramRetryAfter as e:
+                # Telegram сообщил, сколько ждать: повторяем после паузы
+                notifications_total.inc(status='retry')
+                await asyncio.sleep(e.retry_after)
+                continue
+            except TelegramForbiddenError:
+                notifications_total.inc(status='blocked')
+                if self.on_blocked is not None:
+                    self.on_blocked(chat_id)
+                return
+            except Exception as e:  # Ошибка одного чата не должна останавливать рассылку
+                notifications_total.inc(status='error')
+                log(f"[!] Не удалось отправить уведомление в чат {chat_id}: {e}")
+                return
+            notifications_total.inc(status='sent')
+            return
+        notifications_total.inc(status='error')
+        log(f"[!] Уведомление в чат {chat_id} не отправлено: превышен лимит Telegram")
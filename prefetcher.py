@@ -0,0 +1,159 @@
+"""Фоновый прогрев кэшей погоды и курсов валют внутри процесса бота
+
+Какие места и валютные пары "горячие", определяется по частоте запросов пользователей (HotSet):
+у каждого ключа счетчик, который затухает вдвое за PREFETCH_HALF_LIFE секунд.
+Prefetcher периодически обновляет погоду (JSON и картинку) для самых горячих мест так,
+чтобы записи в кэше не успевали устаревать, а в часы пик (PREFETCH_PEAK_HOURS) - чаще.
+Таблица курсов обновляется не чаще, чем позволяет доля месячной квоты exchangerate-api,
+отведенная на прогрев (API_MONTHLY_QUOTA * PREFETCH_QUOTA_SHARE).
+Раз в QUOTA_CHECK_INTERVAL секунд запрашивается остаток квоты (/quota) для метрик."""
+
+import os
+import time
+import asyncio
+import threading
+from datetime import datetime
+
+import weather
+import currency_exchange
+from rate_engine import RateEngine
+from currency_exchange import API_MONTHLY_QUOTA
+from metrics import log
+
+PREFETCH_TOP: int = int(os.getenv("PREFETCH_TOP", "20"))                          # Сколько мест прогревать
+PREFETCH_HALF_LIFE: float = float(os.getenv("PREFETCH_HALF_LIFE", "21600"))       # Затухание популярности, сек
+PREFETCH_CONCURRENCY: int = int(os.getenv("PREFETCH_CONCURRENCY", "5"))           # Параллельных запросов
+PREFETCH_IMAGES: bool = os.getenv("PREFETCH_IMAGES", "1") == "1"                  # Прогревать и картинки
+PREFETCH_PEAK_HOURS: str = os.getenv("PREFETCH_PEAK_HOURS", "7-9")                # Часы пик: 'с-по' включительно
+PREFETCH_QUOTA_SHARE: float = float(os.getenv("PREFETCH_QUOTA_SHARE", "0.5"))     # Доля квоты на прогрев
+QUOTA_CHECK_INTERVAL: float = float(os.getenv("QUOTA_CHECK_INTERVAL", "3600"))    # Проверка остатка квоты, сек
+
+MONTH_SECONDS: int = 30 * 24 * 3600
+
+
+class HotSet:
+    """Популярность ключей с экспоненциальным затуханием. Потокобезопасный"""
+
+    def __init__(self, half_life: float = PREFETCH_HALF_LIFE, max_keys: int = 1000) -> None:
+        self.half_life: float = half_life
+        self.max_keys: int = max_keys
+        self._scores: dict = {}  # key -> (счет, время последнего обновления)
+        self._lock = threading.Lock()
+
+    def _decayed(self, score: float, updated: float, now: float) -> float:
+        return score * 0.5 ** ((now - updated) / self.half_life)
+
+    def record(self, key) -> None:
+        """Учитывает один запрос ключа"""
+        now: float = time.time()
+        with self._lock:
+            score, updated = self._scores.get(key, (0.0, now))
+            self._scores[key] = (self._decayed(score, updated, now) + 1.0, now)
+            if len(self._scores) > self.max_keys:
+                self._prune(now)
+
+    def _prune(self, now: float) -> None:
+        """Оставляет половину самых популярных ключей. Вызывать под блокировкой"""
+        ranked: list = sorted(self._scores.items(), key=lambda item: self._decayed(*item[1], now), reverse=True)
+        self._scores = dict(ranked[:self.max_keys // 2])
+
+    def top(self, count: int) -> list:
+        """count самых популярных ключей (по убыванию популярности)"""
+        now: float = time.time()
+        with self._lock:
+            ranked: list = sorted(self._scores.items(), key=lambda item: self._decayed(*item[1], now), reverse=True)
+        return [key for key, _ in ranked[:count]]
+
+    def __len__(self) -> int:
+        return len(self._scores)
+
+
+def parse_hours(hours: str) -> range:
+    """'7-9' → часы 7, 8, 9"""
+    start, _, end = hours.partition('-')
+    return range(int(start), int(end or start) + 1)
+
+
+class Prefetcher:
+    """Периодический прогрев кэшей для горячих мест и валютных пар"""
+
+    def __init__(self, rate_engine: RateEngine | None = None, top: int = PREFETCH_TOP,
+                 peak_hours: str = PREFETCH_PEAK_HOURS) -> None:
+        self.rate_engine: RateEngine | None = rate_engine
+        self.top: int = top
+        self.peak_hours: range = parse_hours(peak_hours)
+        self.locations: HotSet = HotSet()
+        self.currency_pairs: HotSet = HotSet()
+
+        # Прогрев чуть раньше истечения TTL, чтобы пользователи не попадали на пустой кэш
+        self.weather_interval: float = weather.WEATHER_CACHE_TTL * 0.8
+        # Минимальный интервал запросов /latest, чтобы прогрев не съел больше своей доли квоты
+        self.rates_interval: float = MONTH_SECONDS / max(API_MONTHLY_QUOTA * PREFETCH_QUOTA_SHARE, 1)
+
+        self._last_rates_refresh: float = 0.0
+        self._last_quota_check: float = 0.0
+        self.weather_refreshes: int = 0
+        self.rates_refreshes: int = 0
+
+    def record_location(self, location: str) -> None:
+        """Учитывает запрос погоды (ключ - нормализованное место, как в кэше)"""
+        self.locations.record(weather.normalize_location(location))
+
+    def record_currency_pair(self, base_code: str, target_code: str) -> None:
+        """Учитывает запрос курса валютной пары"""
+        self.currency_pairs.record((base_code, target_code))
+
+    def is_peak(self, now: datetime | None = None) -> bool:
+        """Часы пик или час перед ними (прогрев заранее)"""
+        hour: int = (now or datetime.now()).hour
+        return hour in self.peak_hours or (hour + 1) % 24 in self.peak_hours
+
+    def next_delay(self) -> float:
+        """Пауза до следующего прогрева погоды: в часы пик - в пределах TTL кэша, вне пика - вдвое реже"""
+        return self.weather_interval if self.is_peak() else self.weather_interval * 2
+
+    async def refresh_weather(self) -> None:
+        """Обновляет кэш погоды (и картинок) для самых популярных мест"""
+        semaphore = asyncio.Semaphore(PREFETCH_CONCURRENCY)
+
+        async def refresh(location: str) -> None:
+            async with semaphore:
+                # Запись обновляется заранее, а не после устаревания - и в общем кэше экземпляров. Значение,
+                # которое другой экземпляр обновил в этом же цикле, повторно не запрашивается
+                await weather.weather_cache.refresh_async(location,
+                                                          lambda: weather.fetch_weather_data_async(location),
+                                                          max_age=weather.WEATHER_CACHE_TTL - self.weather_interval)
+                if PREFETCH_IMAGES:
+                    await weather.get_weather_png_async(location)  # Запрос только если картинки нет в текущем интервале
+                self.weather_refreshes += 1
+
+        await asyncio.gather(*(refresh(location) for location in self.locations.top(self.top)),
+                             return_exceptions=True)
+
+    async def refresh_rates(self) -> None:
+        """Обновляет таблицу курсов, если ее кто-то запрашивает и позволяет бюджет квоты"""
+        if self.rate_engine is None or not len(self.currency_pairs) or currency_exchange.quota_reached:
+            return
+        if time.time() - self._last_rates_refresh < self.rates_interval:
+            return
+
+        # Все пары считаются из одной таблицы RATES_BASE, поэтому горячие пары прогреваются одним запросом
+        self._last_rates_refresh = time.time()
+        if await self.rate_engine.refresh_async():
+            self.rates_refreshes += 1
+
+    async def refresh_quota(self) -> None:
+        """Обновляет метрики остатка квоты exchangerate-api (не чаще QUOTA_CHECK_INTERVAL)"""
+        if self.rate_engine is None or time.time() - self._last_quota_check < QUOTA_CHECK_INTERVAL:
+            return
+        self._last_quota_check = time.time()
+        await currency_exchange.fetch_quota_async(self.rate_engine.api_key)
+
+    async def run(self) -> None:
+        """Бесконечный цикл прогрева (запускается задачей при старте бота)"""
+        while True:
+            try:
+                await asyncio.gather(self.refresh_weather(), self.refresh_rates(), self.refresh_quota())
+            except Exception as e:  # Ошибка прогрева не должна останавливать цикл
+                log(f"[!] Ошибка прогрева кэша: {e}")
+            await asyncio.sleep(self.next_delay())
@@ -0,0 +1,246 @@
+"""Таблица курсов валют: один запрос /latest/{base} вместо запроса /pair на каждую пару
+
+Таблица хранится в компактном массиве array('d'), индекс - позиция кода в valid_currencies.
+Кросс-курс A→B считается локально за O(1): rates[B] / rates[A] (обе величины относительно базы).
+Таблица перезапрашивается не чаще, чем раз в RATES_REFRESH_INTERVAL секунд. Полученная таблица попадает
+в общее хранилище (shared_state.py): остальные экземпляры бота берут ее оттуда, а не запрашивают сами."""
+
+import os
+import json
+import time
+import math
+import asyncio
+from array import array
+from typing import Iterable
+
+import http_client
+import metrics
+from metrics import log
+from shared_state import SharedCache
+from lazy_import import lazy_import
+from currency_exchange import (EXCHANGE_API_URL, valid_currencies, report_api_error, rate_flight, rate_flight_async,
+                               exchange_get, exchange_get_async)
+
+RATES_BASE: str = os.getenv("RATES_BASE", "USD")                                    # База таблицы курсов
+RATES_REFRESH_INTERVAL: float = float(os.getenv("RATES_REFRESH_INTERVAL", "3600"))  # Обновление таблицы, сек
+
+requests = lazy_import('requests')
+aiohttp = lazy_import('aiohttp')
+
+# Позиция кода валюты в массиве курсов
+CURRENCY_INDEX: dict = {code: index for index, code in enumerate(valid_currencies)}
+
+
+class RateTable:
+    """Курсы всех валют относительно базовой на момент запроса"""
+    __slots__ = ('base_code', 'rates', 'fetched_at', 'next_update')
+
+    def __init__(self, base_code: str, rates: array, next_update: float = math.inf) -> None:
+        self.base_code: str = base_code
+        self.rates: array = rates             # rates[i] - сколько valid_currencies[i] стоит 1 base_code
+        self.fetched_at: float = time.time()
+        self.next_update: float = next_update  # Когда сервис обновит курсы (time_next_update_unix)
+
+    @classmethod
+    def from_json(cls, data: dict) -> 'RateTable':
+        """Создает таблицу из ответа /latest. При отсутствии нужного ключа получим KeyError"""
+        rates: array = array('d', [math.nan]) * len(valid_currencies)
+        for code, rate in data['conversion_rates'].items():
+            index = CURRENCY_INDEX.get(code)
+            if index is not None:
+                rates[index] = rate
+        return cls(data['base_code'], rates, data.get('time_next_update_unix', math.inf))
+
+    def to_json(self) -> dict:
+        """Таблица в виде ответа /latest (для общего хранилища)"""
+        return {'base_code': self.base_code, 'time_next_update_unix': self.next_update,
+                'conversion_rates': {code: rate for code, rate in zip(valid_currencies, self.rates)
+                                     if not math.isnan(rate)}}
+
+    def rate(self, base_code: str, target_code: str) -> float:
+        """Кросс-курс: сколько target_code стоит 1 base_code. NaN, если валюты нет в таблице"""
+        return self.rates[CURRENCY_INDEX[target_code]] / self.rates[CURRENCY_INDEX[base_code]]
+
+    def convert_many(self, amounts: Iterable[float], base_code: str, target_code: str) -> array:
+        """Конвертирует много сумм по одной паре: курс считается один раз"""
+        return array('d', map(self.rate(base_code, target_code).__mul__, amounts))
+
+    def convert_pairs(self, amounts: Iterable[float], base_codes: Iterable[str],
+                      target_codes: Iterable[str]) -> array:
+        """Конвертирует суммы по разным парам: amounts[i] из base_codes[i] в target_codes[i]"""
+        rates = self.rates
+        index = CURRENCY_INDEX
+        return array('d', (amount * rates[index[target]] / rates[index[base]]
+                           for amount, base, target in zip(amounts, base_codes, target_codes)))
+
+
+# Общая таблица экземпляров бота живет, пока ее не пора обновлять: RATES_REFRESH_INTERVAL или до time_next_update_unix
+rates_shared: SharedCache = SharedCache('rates', ttl=lambda table: min(RATES_REFRESH_INTERVAL,
+                                                                       table.next_update - time.time()),
+                                        dumps=lambda table: json.dumps(table.to_json()).encode(),
+                                        loads=lambda data: RateTable.from_json(json.loads(data)))
+
+
+def _with_age(fetched: tuple) -> RateTable | None:
+    """Таблица из общего хранилища с временем получения, а не загрузки в этот процесс"""
+    table, age = fetched
+    if table is not None:
+        table.fetched_at = time.time() - age
+    return table
+
+
+class RateEngine:
+    """Хранит таблицу курсов и обновляет ее по мере устаревания"""
+
+    def __init__(self, api_key: str, base_code: str = RATES_BASE,
+                 refresh_interval: float = RATES_REFRESH_INTERVAL) -> None:
+        self.api_key: str = api_key
+        self.base_code: str = base_code
+        self.refresh_interval: float = refresh_interval
+        self._table: RateTable | None = None
+
+    def is_fresh(self) -> bool:
+        """True - таблица есть и еще не устарела"""
+        table = self._table
+        if table is None:
+            return False
+        now = time.time()
+        return now - table.fetched_at < self.refresh_interval and now < table.next_update
+
+    def _fetch(self) -> RateTable | None:
+        """Таблица из общего хранилища или от сервиса. None при ошибке"""
+        return _with_age(rates_shared.fetch(self.base_code, lambda: fetch_rate_table(self.api_key, self.base_code)))
+
+    async def _fetch_async(self) -> RateTable | None:
+        return _with_age(await rates_shared.fetch_async(
+            self.base_code, lambda: fetch_rate_table_async(self.api_key, self.base_code)))
+
+    def table(self) -> RateTable | None:
+        """Актуальная таблица курсов (при необходимости запрашивается). None при ошибке и пустом кэше"""
+        if not self.is_fresh():
+            self._table = self._fetch() or self._table
+        return self._table
+
+    async def table_async(self) -> RateTable | None:
+        """Асинхронный вариант table()"""
+        if not self.is_fresh():
+            self._table = await self._fetch_async() or self._table
+        return self._table
+
+    def refresh(self) -> bool:
+        """Обновляет таблицу, даже если она еще свежая (прогрев). Если другой экземпляр бота только что
+        получил таблицу - берется она. True - таблица обновлена"""
+        table: RateTable | None = self._fetch()
+        if table is not None:
+            self._table = table
+        return table is not None
+
+    async def refresh_async(self) -> bool:
+        """Асинхронный вариант refresh()"""
+        table: RateTable | None = await self._fetch_async()
+        if table is not None:
+            self._table = table
+        return table is not None
+
+    def rate(self, base_code: str = 'USD', target_code: str = 'RUB') -> float:
+        """Текущий курс пары из таблицы. 0.0 при ошибке, как у get_current_exchange_rate"""
+        return _checked_rate(self.table(), base_code, target_code)
+
+    async def rate_async(self, base_code: str = 'USD', target_code: str = 'RUB') -> float:
+        """Асинхронный вариант rate()"""
+        return _checked_rate(await self.table_async(), base_code, target_code)
+
+
+def _checked_rate(table: RateTable | None, base_code: str, target_code: str) -> float:
+    """Курс пары из таблицы или 0.0, если таблицы нет или валюты в ней нет"""
+    if table is None:
+        return 0.0
+    rate: float = table.rate(base_code, target_code)
+    if math.isnan(rate):
+        log(f"[!] Нет курса для пары {base_code}/{target_code} в таблице курсов")
+        return 0.0
+    return rate
+
+
+def fetch_rate_table(api_key: str, base_code: str = 'USD') -> RateTable | None:
+    """Запрашивает полную таблицу курсов /latest/{base_code}. None при ошибке"""
+
+    url = f'{EXCHANGE_API_URL}/{api_key}/latest/{base_code}'
+
+    try:
+        log(f'[->] Запрос по адресу {url}')
+        response: requests.Response = rate_flight.do(url, lambda: exchange_get(url))
+
+        # Всегда пытаемся прочитать JSON, даже при ошибках HTTP. При ошибке получим ValueError
+        try:
+            with metrics.parse_seconds.time(kind='latest'):
+                data: dict = response.json()
+        except ValueError as e:
+            log(f"[!] Ошибка декодирования JSON: {e}")
+            return None
+
+        # Если получили JSON и там ошибка API, то расшифровываем полученную ошибку
+        if data and data.get("result") == "error":
+            report_api_error(data.get("error-type"))
+            return None
+
+        # Проверка на ошибки HTTP, если статус 4xx/5xx → HTTPError
+        response.raise_for_status()
+
+        if data and data.get("result") == "success":
+            log(f"[ok] Получена таблица курсов относительно {base_code}")
+            return RateTable.from_json(data)
+
+    except requests.exceptions.Timeout:
+        log("[!] Таймаут при запросе к серверу")
+    except requests.exceptions.ConnectionError:
+        log("[!] Ошибка подключения: сервер недоступен")
+    except requests.exceptions.HTTPError as e:
+        log(f"[!] HTTP ошибка: {e}")
+    except requests.RequestException as e:  # Включает в себя Timeout, ConnectionError, HTTPError и др.
+        log(f"[!] Ошибка при запросе: {e}")
+    except KeyError as e:   # Если отсутствует ключ в полученных данных JSON'а
+        log(f"[!] Ошибка при обработке данных: отсутствует ключ {e}")
+    return None
+
+
+async def fetch_rate_table_async(api_key: str, base_code: str = 'USD') -> RateTable | None:
+    """Асинхронная версия fetch_rate_table"""
+
+    url = f'{EXCHANGE_API_URL}/{api_key}/latest/{base_code}'
+
+    try:
+        log(f'[->] Запрос по адресу {url}')
+        response: http_client.AsyncResponse = await rate_flight_async.do(url, lambda: exchange_get_async(url))
+
+        # Всегда пытаемся прочитать JSON, даже при ошибках HTTP. При ошибке получим ValueError
+        try:
+            with metrics.parse_seconds.time(kind='latest'):
+                data: dict = response.json()
+        except ValueError as e:
+            log(f"[!] Ошибка декодирования JSON: {e}")
+            return None
+
+        # Если получили JSON и там ошибка API, то расшифровываем полученную ошибку
+        if data and data.get("result") == "error":
+            report_api_error(data.get("error-type"))
+            return None
+
+        # Проверка на ошибки HTTP, если статус 4xx/5xx → ClientResponseError
+        response.raise_for_status()
+
+        if data and data.get("result") == "success":
+            log(f"[ok] Получена таблица курсов относительно {base_code}")
+            return RateTable.from_json(data)
+
+    except asyncio.TimeoutError:
+        log("[!] Таймаут при запросе к серверу")
+    except aiohttp.ClientResponseError as e:
+        log(f"[!] HTTP ошибка: {e}")
+    except aiohttp.ClientConnectionError:
+        log("[!] Ошибка подключения: сервер недоступен")
+    except aiohttp.ClientError as e:  # Базовый класс для всех ошибок aiohttp
+        log(f"[!] Ошибка при запросе: {e}")
+    except KeyError as e:   # Если отсутствует ключ в полученных данных JSON'а
+        log(f"[!] Ошибка при обработке данных: отсутствует ключ {e}")
+    return None
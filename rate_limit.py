@@ -0,0 +1,119 @@
+"""Ограничение частоты запросов к внешним сервисам (token bucket)
+
+В корзине до capacity токенов, пополнение - rate токенов в секунду. Каждый запрос забирает токен,
+если токенов нет - ждет. HostRateLimiter держит отдельную корзину на каждый хост.
+
+AdaptiveTokenBucket подстраивает скорость под ответы сервиса (AIMD): после ответа 429/503 скорость
+снижается вдвое (но не ниже min_rate), после каждого успешного ответа - плавно растет до исходной."""
+
+import time
+import asyncio
+import threading
+from urllib.parse import urlsplit
+
+import metrics
+
+rate_limit_rps = metrics.Gauge('rate_limit_rps', 'Текущая скорость адаптивного ограничителя, запросов/сек', ('host',))
+
+
+class TokenBucket:
+    """Token bucket для потоков и asyncio"""
+
+    def __init__(self, rate: float, capacity: float | None = None) -> None:
+        self.rate: float = rate                                         # Токенов в секунду
+        self.capacity: float = capacity if capacity is not None else max(rate, 1.0)
+        self._tokens: float = self.capacity
+        self._updated: float = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self) -> float:
+        """Забирает токен (возможно, в долг) и возвращает, сколько секунд нужно подождать"""
+        with self._lock:
+            now: float = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            return -self._tokens / self.rate if self._tokens < 0 else 0.0
+
+    def acquire(self) -> None:
+        """Ждет токен (блокирует поток)"""
+        delay: float = self._reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+    async def acquire_async(self) -> None:
+        """Ждет токен, не блокируя event loop"""
+        delay: float = self._reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class AdaptiveTokenBucket(TokenBucket):
+    """Token bucket, скорость которого снижается при перегрузке сервиса и восстанавливается при успехах"""
+
+    def __init__(self, rate: float, capacity: float | None = None, min_rate: float | None = None,
+                 name: str = '') -> None:
+        super().__init__(rate, capacity)
+        self.max_rate: float = rate
+        self.min_rate: float = min_rate if min_rate is not None else rate / 20
+        self.name: str = name
+        rate_limit_rps.set(rate, host=name)
+
+    def _set_rate(self, rate: float) -> None:
+        """Меняет скорость, сначала начислив токены по старой"""
+        with self._lock:
+            now: float = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self.rate = rate
+        rate_limit_rps.set(rate, host=self.name)
+
+    def on_success(self) -> None:
+        """Аддитивный рост: +max_rate/20 за успешный ответ"""
+        if self.rate < self.max_rate:
+            self._set_rate(min(self.max_rate, self.rate + self.max_rate / 20))
+
+    def on_throttle(self) -> None:
+        """Мультипликативное снижение: скорость вдвое меньше"""
+        self._set_rate(max(self.min_rate, self.rate / 2))
+
+
+class HostRateLimiter:
+    """Отдельный token bucket на каждый хост. С min_rate - адаптивные корзины (AdaptiveTokenBucket)"""
+
+    def __init__(self, rate: float, capacity: float | None = None, min_rate: float | None = None) -> None:
+        self.rate: float = rate
+        self.capacity: float | None = capacity
+        self.min_rate: float | None = min_rate
+        self._buckets: dict = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, url: str) -> TokenBucket:
+        """Корзина хоста из URL (создается при первом обращении)"""
+        host: str = urlsplit(url).hostname or ''
+        bucket = self._buckets.get(host)
+        if bucket is None:
+            with self._lock:
+                bucket = self._buckets.get(host)
+                if bucket is None:
+                    bucket = self._buckets[host] = (
+                        AdaptiveTokenBucket(self.rate, self.capacity, self.min_rate, host)
+                        if self.min_rate is not None else TokenBucket(self.rate, self.capacity))
+        return bucket
+
+    def feedback(self, url: str, throttled: bool) -> None:
+        """Результат запроса для адаптивной корзины: throttled - сервис ответил 429/503"""
+        bucket = self.bucket(url)
+        if isinstance(bucket, AdaptiveTokenBucket):
+            if throttled:
+                bucket.on_throttle()
+            else:
+                bucket.on_success()
+
+    def acquire(self, url: str) -> None:
+        """Ждет разрешения на запрос к хосту из URL"""
+        self.bucket(url).acquire()
+
+    async def acquire_async(self, url: str) -> None:
+        """Асинхронный вариант acquire"""
+        await self.bucket(url).acquire_async()
@@ -1,8 +1,9 @@
 import requests
+import http_client
 
 def get_json_from_url(url):
     try:
-        response = requests.get(url)
+        response = http_client.get(url)  # Общая сессия с пулом соединений и таймаутами
         response.raise_for_status()  # Проверка на ошибки HTTP
 
         # Парсим JSON
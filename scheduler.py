@@ -0,0 +1,258 @@
+"""Планировщик уведомлений по подпискам (subscriptions.py) внутри процесса бота
+
+Куча (heapq) задач по времени запуска. Задачи не по одной на подписчика, а по одной на слот:
+ ('weather', минута, поколение) - все подписки на погоду в эту минуту суток (не больше 1440 задач).
+                     Поколение отличает текущую задачу минуты от старой, оставшейся в куче после того,
+                     как минуту убрали и добавили снова: старая пропускается, и слот не запускается дважды
+ ('weather_retry', минута, день, попытка) - повтор слота для подписок, которым погоду не удалось получить
+                     или поставить в очередь (через SCHEDULER_RETRY_DELAY секунд, до SCHEDULER_RETRIES раз)
+ ('rates',)          - проверка всех правил курса раз в RATE_ALERT_INTERVAL секунд
+ ('reload',)         - раз в SCHEDULER_RELOAD_INTERVAL секунд минуты из хранилища (подписки других экземпляров)
+Поэтому размер кучи и число внешних запросов не зависят от числа подписчиков:
+ - слот погоды группирует подписки по нормализованному месту, погода каждого места запрашивается один раз
+   (get_weather_async: кэш погоды и single-flight, как у команды /weather)
+ - правила курса всех пар считаются из одной таблицы курсов (RateEngine), сравнение с порогами - один
+   UPDATE на пару в хранилище
+Уведомления отправляет Notifier (notifier.py). Время подписок - в поясе SUBSCRIPTIONS_TZ."""
+
+import os
+import time
+import heapq
+import asyncio
+import itertools
+from datetime import datetime, timedelta, tzinfo
+from zoneinfo import ZoneInfo
+
+import metrics
+import weather
+import subscriptions
+from metrics import log
+from notifier import Notifier
+from rate_engine import RateEngine
+from subscriptions import Subscription, SubscriptionStore, WEATHER
+
+SUBSCRIPTIONS_TZ: str = os.getenv("SUBSCRIPTIONS_TZ", "")                                   # Пояс времени подписок ("" - пояс сервера)
+RATE_ALERT_INTERVAL: float = float(os.getenv("RATE_ALERT_INTERVAL", "300"))                 # Проверка правил курса, сек
+SCHEDULER_RELOAD_INTERVAL: float = float(os.getenv("SCHEDULER_RELOAD_INTERVAL", "60"))      # Перечитывание минут, сек
+SCHEDULER_FETCH_CONCURRENCY: int = int(os.getenv("SCHEDULER_FETCH_CONCURRENCY", "10"))      # Параллельных запросов погоды
+SCHEDULER_RETRY_DELAY: float = float(os.getenv("SCHEDULER_RETRY_DELAY", "300"))             # Повтор неудачного слота, сек
+SCHEDULER_RETRIES: int = int(os.getenv("SCHEDULER_RETRIES", "3"))                           # Повторов слота погоды
+
+subscription_job_seconds = metrics.Histogram('subscription_job_seconds', 'Время задачи планировщика подписок',
+                                             ('job',))
+subscription_alerts = metrics.Counter('subscription_alerts_total', 'Уведомления, поставленные в очередь', ('kind',))
+subscription_fetches = metrics.Counter('subscription_fetches_total', 'Запросы данных для уведомлений', ('kind',))
+subscriptions_active = metrics.Gauge('subscriptions_active', 'Подписки в хранилище (обновляется при перечитывании)',
+                                     ('kind',))
+
+
+def subscription_tz() -> tzinfo | None:
+    """Пояс SUBSCRIPTIONS_TZ (None - пояс сервера)"""
+    return ZoneInfo(SUBSCRIPTIONS_TZ) if SUBSCRIPTIONS_TZ else None
+
+
+class SubscriptionScheduler:
+    """Куча задач по слотам подписок и их выполнение. Работает в одном event loop"""
+
+    def __init__(self, rate_engine: RateEngine, notifier: Notifier, store: SubscriptionStore | None = None,
+                 tz: tzinfo | None = None) -> None:
+        self.rate_engine: RateEngine = rate_engine
+        self.notifier: Notifier = notifier
+        self.tz: tzinfo | None = tz if tz is not None else subscription_tz()
+        self._store: SubscriptionStore | None = store  # None - общее хранилище (открывается при первом обращении)
+        self._heap: list = []                 # (время запуска (time.time()), порядковый номер, задача)
+        self._order = itertools.count()       # Порядок задач с одинаковым временем
+        self._minutes: dict = {}              # Минуты, для которых в куче есть задача: {минута: поколение}
+        self._generations = itertools.count()  # Поколения задач минут
+        self._wakeup: asyncio.Event | None = None
+        self._jobs: set = set()               # Выполняющиеся задачи (ссылки, чтобы их не собрал GC)
+
+    @property
+    def store(self) -> SubscriptionStore:
+        if self._store is None:
+            self._store = subscriptions.get_store()
+        return self._store
+
+    def now(self) -> datetime:
+        return datetime.now(self.tz)
+
+    def next_run(self, minute: int, now: datetime | None = None) -> float:
+        """Ближайшее время (time.time()) минуты суток minute"""
+        now = now or self.now()
+        run: datetime = now.replace(hour=minute // 60, minute=minute % 60, second=0, microsecond=0)
+        if run <= now:
+            run += timedelta(days=1)
+        return run.timestamp()
+
+    def _push(self, when: float, job: tuple) -> None:
+        heapq.heappush(self._heap, (when, next(self._order), job))
+        if self._wakeup is not None:
+            self._wakeup.set()  # Новая задача может быть раньше той, которую ждет run()
+
+    def schedule_minute(self, minute: int) -> None:
+        """Добавляет в кучу слот погоды, если его там еще нет"""
+        if minute not in self._minutes:
+            generation: int = next(self._generations)
+            self._minutes[minute] = generation
+            self._push(self.next_run(minute), (WEATHER, minute, generation))
+
+    def subscribe(self, subscription: Subscription) -> Subscription:
+        """Сохраняет подписку и планирует ее слот"""
+        subscription = self.store.add(subscription)
+        if subscription.kind == WEATHER:
+            self.schedule_minute(subscription.minute)
+        return subscription
+
+    def unsubscribe(self, chat_id: int, subscription_id: int) -> bool:
+        """Удаляет подписку чата. Пустой слот уберется из кучи при следующем запуске"""
+        return self.store.remove(chat_id, subscription_id)
+
+    def remove_chat(self, chat_id: int) -> None:
+        """Удаляет все подписки чата (бот заблокирован пользователем)"""
+        removed: int = self.store.remove_chat(chat_id)
+        log(f"[i] Чат {chat_id} недоступен: удалено подписок {removed}")
+
+    async def reload(self) -> None:
+        """Планирует минуты всех подписок из хранилища и обновляет метрики"""
+        minutes: set = await asyncio.to_thread(self.store.minutes)
+        for minute in minutes - self._minutes.keys():
+            self.schedule_minute(minute)
+        stats: dict = await asyncio.to_thread(self.store.stats)
+        for kind in (subscriptions.WEATHER, subscriptions.RATE):
+            subscriptions_active.set(stats.get(kind, 0), kind=kind)
+
+    async def run_weather(self, minute: int, day: str | None = None, attempt: int = 0) -> int:
+        """Слот погоды: одна загрузка на место, уведомление каждому подписчику. Возвращает число уведомлений.
+        Подписки, которым погоду не удалось получить или поставить в очередь, освобождаются для повтора"""
+        day = day or self.now().date().isoformat()
+        claimed: list = await asyncio.to_thread(self.store.claim_weather, minute, day)
+
+        groups: dict = {}
+        for subscription in claimed:
+            groups.setdefault(subscription.location_key, []).append(subscription)
+
+        semaphore = asyncio.Semaphore(SCHEDULER_FETCH_CONCURRENCY)
+
+        async def fetch(location: str) -> str | None:
+            async with semaphore:
+                subscription_fetches.inc(kind=WEATHER)
+                return await weather.get_weather_async(location)
+
+        texts: list = await asyncio.gather(*(fetch(group[0].location) for group in groups.values()))
+        messages: list = []
+        failed: list = []  # id подписок, которым уведомление не ушло в очередь
+        for group, text in zip(groups.values(), texts):
+            if text is None:
+                log(f"[!] Не удалось получить погоду для подписки: {group[0].location}")
+                failed += [subscription.id for subscription in group]
+                continue
+            messages += [(subscription.chat_id, text, subscription.id) for subscription in group]
+        rejected: list = self._enqueue(messages)
+        failed += [message[2] for message in rejected]
+        sent: int = len(messages) - len(rejected)
+        subscription_alerts.inc(sent, kind=WEATHER)
+
+        if failed:
+            # Без этого неудачные подписки считались бы отправленными до завтра
+            await asyncio.to_thread(self.store.release_weather, failed, day)
+            if attempt < SCHEDULER_RETRIES:
+                self._push(time.time() + SCHEDULER_RETRY_DELAY, ('weather_retry', minute, day, attempt + 1))
+                log(f"[i] Слот {subscriptions.format_minute(minute)}: {len(failed)} уведомлений будут повторены")
+            else:
+                log(f"[!] Слот {subscriptions.format_minute(minute)}: {len(failed)} уведомлений не отправлены")
+
+        if not await asyncio.to_thread(self.store.has_minute, minute):
+            self._minutes.pop(minute, None)  # Подписок не осталось: следующий запуск слота будет пропущен
+        return sent
+
+    async def run_rates(self) -> int:
+        """Проверка правил курса всех пар по одной таблице курсов. Возвращает число уведомлений"""
+        pairs: list = await asyncio.to_thread(self.store.rate_pairs)
+        if not pairs:
+            return 0
+        subscription_fetches.inc(kind=subscriptions.RATE)
+        table = await self.rate_engine.table_async()
+        if table is None:
+            log("[!] Не удалось получить таблицу курсов для подписок")
+            return 0
+
+        rates: dict = {}
+        for base, target in pairs:
+            rate: float = table.rate(base, target)
+            if rate == rate:  # NaN - валюты нет в таблице
+                rates[(base, target)] = rate
+        fired: list = await asyncio.to_thread(self.store.evaluate_rates, rates)
+
+        messages: list = []
+        for subscription in fired:
+            rate = rates[(subscription.base, subscription.target)]
+            messages.append((subscription.chat_id, f"[i] 1 {subscription.base} стоит {rate:.4f} {subscription.target} "
+                                                   f"({subscription.describe()})", subscription.id))
+        rejected: list = self._enqueue(messages)
+        if rejected:
+            # Иначе правило считалось бы сработавшим, и уведомление не пришло бы, пока условие не сбросится
+            await asyncio.to_thread(self.store.release_rates, [message[2] for message in rejected])
+            log(f"[i] Правила курса: {len(rejected)} уведомлений будут повторены при следующей проверке")
+        sent: int = len(messages) - len(rejected)
+        subscription_alerts.inc(sent, kind=subscriptions.RATE)
+        return sent
+
+    def _enqueue(self, messages: list) -> list:
+        """Ставит [(chat_id, текст, ...)] в очередь рассылки подряд по чатам: Notifier объединит сообщения
+        одному чату в пакете. Возвращает сообщения, которые очередь не приняла"""
+        messages.sort(key=lambda message: message[0])
+        return [message for message in messages if not self.notifier.notify(message[0], message[1])]
+
+    async def _execute(self, job: tuple) -> None:
+        """Выполняет задачу кучи. Ошибка задачи не должна останавливать планировщик"""
+        name: str = job[0]
+        try:
+            with subscription_job_seconds.time(job=name):
+                if name == WEATHER:
+                    await self.run_weather(job[1])
+                elif name == 'weather_retry':
+                    await self.run_weather(*job[1:])
+                elif name == 'rates':
+                    await self.run_rates()
+                else:
+                    await self.reload()
+        except Exception as e:
+            log(f"[!] Ошибка задачи подписок {name}: {e}")
+
+    def _start_job(self, job: tuple) -> None:
+        task = asyncio.create_task(self._execute(job))
+        self._jobs.add(task)
+        task.add_done_callback(self._jobs.discard)
+
+    def _pop_due(self, now: float) -> None:
+        """Запускает задачи, время которых наступило, и планирует их следующий запуск"""
+        while self._heap and self._heap[0][0] <= now:
+            _, _, job = heapq.heappop(self._heap)
+            if job[0] == WEATHER:
+                if self._minutes.get(job[1]) != job[2]:
+                    continue  # Подписок на эту минуту больше нет или минута снова запланирована другой задачей
+                heapq.heappush(self._heap, (self.next_run(job[1]), next(self._order), job))
+            elif job[0] == 'rates':
+                heapq.heappush(self._heap, (now + RATE_ALERT_INTERVAL, next(self._order), job))
+            elif job[0] == 'reload':
+                heapq.heappush(self._heap, (now + SCHEDULER_RELOAD_INTERVAL, next(self._order), job))
+            # Повтор слота погоды (weather_retry) - однократная задача
+            self._start_job(job)
+
+    async def run(self) -> None:
+        """Бесконечный цикл планировщика (запускается задачей при старте бота)"""
+        self._wakeup = asyncio.Event()
+        await self.reload()
+        now: float = time.time()
+        self._push(now + SCHEDULER_RELOAD_INTERVAL, ('reload',))
+        self._push(now, ('rates',))
+        log(f"[i] Планировщик подписок: слотов погоды {len(self._minutes)}")
+
+        while True:
+            self._wakeup.clear()
+            self._pop_due(time.time())
+            timeout: float | None = max(0.0, self._heap[0][0] - time.time()) if self._heap else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
@@ -0,0 +1,396 @@
+"""Общее состояние нескольких экземпляров бота: кэш ответов, блокировки single-flight и счетчик квоты
+
+Каждый экземпляр бота держит свои кэши и свой single-flight, поэтому без общего хранилища
+N экземпляров делают N одинаковых запросов к wttr.in и exchangerate-api и вместе расходуют квоту.
+Хранилище выбирается переменной SHARED_BACKEND:
+ local             - словарь в памяти процесса (по умолчанию, один экземпляр бота - как раньше)
+ sqlite:<путь>     - файл SQLite: общее состояние процессов на одном сервере
+ redis://host:port - Redis (нужен пакет redis), общее состояние экземпляров на разных серверах
+
+Интерфейс хранилища (SharedBackend) - значения bytes со сроком жизни, add (запись, если ключа нет -
+для блокировок), delete_if (удаление, если значение совпадает - снятие своей блокировки) и incr
+(атомарный счетчик). Другое хранилище подключается наследником SharedBackend и set_backend().
+
+SharedCache - второй уровень кэша поверх TTLCache: значение, полученное одним экземпляром, берут остальные.
+Одинаковые запросы внутри процесса сначала объединяются single-flight (ждут общий результат без опроса
+хранилища). Между экземплярами запрос к сервису выполняет только экземпляр, взявший блокировку ключа;
+остальные ждут, пока значение появится в хранилище (до SHARED_LOCK_WAIT секунд, затем запрашивают сами).
+С хранилищем local других экземпляров нет: значения в нем не хранятся (кэш процесса - TTLCache
+с ограниченным размером), блокировка не берется, остается только single-flight."""
+
+import os
+import time
+import uuid
+import struct
+import sqlite3
+import asyncio
+import threading
+from abc import ABC, abstractmethod
+from typing import Any, Awaitable, Callable
+
+import metrics
+from metrics import log
+from single_flight import SingleFlight, AsyncSingleFlight
+
+SHARED_BACKEND: str = os.getenv("SHARED_BACKEND", "local")                 # local, sqlite:<путь> или redis://...
+SHARED_LOCK_TTL: float = float(os.getenv("SHARED_LOCK_TTL", "30"))         # Блокировка на случай падения владельца, сек
+SHARED_LOCK_WAIT: float = float(os.getenv("SHARED_LOCK_WAIT", "10"))       # Ожидание чужого запроса, сек
+SHARED_POLL_INTERVAL: float = float(os.getenv("SHARED_POLL_INTERVAL", "0.05"))  # Проверка результата чужого запроса, сек
+
+shared_lookups = metrics.Counter('shared_cache_lookups_total', 'Обращения к общему кэшу по результатам',
+                                 ('cache', 'result'))
+
+SQLITE_PURGE_EVERY: int = 1000
+
+_STORED_AT = struct.Struct('<d')  # Время записи (time.time) перед значением: возраст виден всем экземплярам
+
+
+class SharedBackend(ABC):
+    """Хранилище общего состояния. Ключи - str, значения - bytes, ttl - секунды (None - без срока)"""
+    blocking: bool = False  # True - вызовы могут ждать (сеть, блокировка файла), в event loop - через asyncio.to_thread
+    local: bool = False     # True - состояние только в памяти процесса: SharedCache его не использует
+
+    @abstractmethod
+    def get(self, key: str) -> bytes | None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def set(self, key: str, value: bytes, ttl: float | None = None) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def add(self, key: str, value: bytes, ttl: float | None = None) -> bool:
+        """Записывает значение, только если ключа нет (или срок истек). True - записано"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete_if(self, key: str, value: bytes) -> bool:
+        """Удаляет ключ, только если в нем value (своя блокировка). True - удален"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def incr(self, key: str, amount: int = 1, ttl: float | None = None) -> int:
+        """Атомарно увеличивает счетчик и возвращает новое значение. ttl задается при создании счетчика"""
+        raise NotImplementedError
+
+
+class LocalBackend(SharedBackend):
+    """Словарь в памяти процесса. Потокобезопасный"""
+    local = True
+
+    def __init__(self) -> None:
+        self._data: dict = {}  # key -> (значение, когда истекает или None)
+        self._lock = threading.Lock()
+
+    def _alive(self, key: str) -> tuple | None:
+        """Запись ключа, если срок не истек. Вызывать под блокировкой"""
+        entry = self._data.get(key)
+        if entry is not None and entry[1] is not None and entry[1] <= time.monotonic():
+            del self._data[key]
+            return None
+        return entry
+
+    @staticmethod
+    def _expires(ttl: float | None) -> float | None:
+        return time.monotonic() + ttl if ttl is not None else None
+
+    def get(self, key: str) -> bytes | None:
+        with self._lock:
+            entry = self._alive(key)
+        return entry[0] if entry is not None else None
+
+    def set(self, key: str, value: bytes, ttl: float | None = None) -> None:
+        with self._lock:
+            self._data[key] = (value, self._expires(ttl))
+
+    def add(self, key: str, value: bytes, ttl: float | None = None) -> bool:
+        with self._lock:
+            if self._alive(key) is not None:
+                return False
+            self._data[key] = (value, self._expires(ttl))
+            return True
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def delete_if(self, key: str, value: bytes) -> bool:
+        with self._lock:
+            entry = self._alive(key)
+            if entry is None or entry[0] != value:
+                return False
+            del self._data[key]
+            return True
+
+    def incr(self, key: str, amount: int = 1, ttl: float | None = None) -> int:
+        with self._lock:
+            entry = self._alive(key)
+            value: int = (int(entry[0]) if entry is not None else 0) + amount
+            self._data[key] = (str(value).encode(), entry[1] if entry is not None else self._expires(ttl))
+            return value
+
+
+class SQLiteBackend(SharedBackend):
+    """Файл SQLite, общий для процессов на одном сервере. Сроки - по time.time (одни часы у всех процессов).
+    Запись ждет блокировку файла, которую держит другой процесс (до timeout соединения), поэтому из event loop
+    вызовы идут через asyncio.to_thread"""
+    blocking = True
+
+    def __init__(self, path: str) -> None:
+        self.path: str = os.path.abspath(path)  # Не зависит от смены текущего каталога (cli_daemon.py)
+        self._lock = threading.Lock()
+        self._writes: int = 0  # Истекшие записи удаляются раз в SQLITE_PURGE_EVERY записей
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=5.0, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS shared (key TEXT PRIMARY KEY, value BLOB NOT NULL, "
+                           "expires REAL) WITHOUT ROWID")
+
+    @staticmethod
+    def _expires(ttl: float | None) -> float | None:
+        return time.time() + ttl if ttl is not None else None
+
+    def get(self, key: str) -> bytes | None:
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM shared WHERE key = ? AND (expires IS NULL OR expires > ?)",
+                                     (key, time.time())).fetchone()
+        return row[0] if row is not None else None
+
+    def set(self, key: str, value: bytes, ttl: float | None = None) -> None:
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO shared (key, value, expires) VALUES (?, ?, ?)",
+                               (key, value, self._expires(ttl)))
+            self._writes += 1
+            if self._writes % SQLITE_PURGE_EVERY == 0:
+                self._conn.execute("DELETE FROM shared WHERE expires <= ?", (time.time(),))
+
+    def add(self, key: str, value: bytes, ttl: float | None = None) -> bool:
+        # Одна команда: проверка и запись атомарны и между процессами
+        with self._lock:
+            cursor = self._conn.execute("INSERT INTO shared (key, value, expires) VALUES (?, ?, ?) "
+                                        "ON CONFLICT(key) DO UPDATE SET value = excluded.value, expires = excluded.expires "
+                                        "WHERE shared.expires IS NOT NULL AND shared.expires <= ?",
+                                        (key, value, self._expires(ttl), time.time()))
+            return cursor.rowcount == 1
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM shared WHERE key = ?", (key,))
+
+    def delete_if(self, key: str, value: bytes) -> bool:
+        with self._lock:
+            return self._conn.execute("DELETE FROM shared WHERE key = ? AND value = ?", (key, value)).rowcount == 1
+
+    def incr(self, key: str, amount: int = 1, ttl: float | None = None) -> int:
+        with self._lock:
+            # BEGIN IMMEDIATE сразу берет блокировку записи: чтение и запись счетчика атомарны между процессами
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute("SELECT value, expires FROM shared WHERE key = ?", (key,)).fetchone()
+                if row is None or (row[1] is not None and row[1] <= time.time()):
+                    value, expires = amount, self._expires(ttl)  # Нового или истекшего счетчика нет
+                else:
+                    value, expires = int(row[0]) + amount, row[1]
+                self._conn.execute("INSERT OR REPLACE INTO shared (key, value, expires) VALUES (?, ?, ?)",
+                                   (key, str(value).encode(), expires))
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            return value
+
+
+class RedisBackend(SharedBackend):
+    """Redis или совместимый сервис. client - объект с методами redis-py: get, set(px=, nx=), delete, incrby, pexpire"""
+    blocking = True
+
+    def __init__(self, client) -> None:
+        self.client = client
+
+    @staticmethod
+    def _px(ttl: float | None) -> int | None:
+        return max(1, int(ttl * 1000)) if ttl is not None else None
+
+    def get(self, key: str) -> bytes | None:
+        return self.client.get(key)
+
+    def set(self, key: str, value: bytes, ttl: float | None = None) -> None:
+        self.client.set(key, value, px=self._px(ttl))
+
+    def add(self, key: str, value: bytes, ttl: float | None = None) -> bool:
+        return bool(self.client.set(key, value, px=self._px(ttl), nx=True))
+
+    def delete(self, key: str) -> None:
+        self.client.delete(key)
+
+    def delete_if(self, key: str, value: bytes) -> bool:
+        # Без Lua-скрипта проверка и удаление - две команды. Блокировку могли перехватить между ними
+        # только если ее срок (SHARED_LOCK_TTL) истек, а запрос к сервису столько не длится
+        if self.client.get(key) != value:
+            return False
+        self.client.delete(key)
+        return True
+
+    def incr(self, key: str, amount: int = 1, ttl: float | None = None) -> int:
+        value: int = self.client.incrby(key, amount)
+        if value == amount and ttl is not None:  # Счетчик только что создан
+            self.client.pexpire(key, self._px(ttl))
+        return value
+
+
+def create_backend(spec: str = SHARED_BACKEND) -> SharedBackend:
+    """Хранилище по строке настройки SHARED_BACKEND"""
+    if spec == 'local':
+        return LocalBackend()
+    if spec.startswith('sqlite:'):
+        return SQLiteBackend(spec.removeprefix('sqlite:'))
+    if spec.startswith(('redis://', 'rediss://', 'unix://')):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("Для SHARED_BACKEND=redis://... нужен пакет redis (pip install redis)") from None
+        return RedisBackend(redis.Redis.from_url(spec))
+    raise ValueError(f"Неизвестное хранилище SHARED_BACKEND: {spec}")
+
+
+_backend: SharedBackend | None = None
+_backend_lock = threading.Lock()
+
+
+def get_backend() -> SharedBackend:
+    """Общее хранилище процесса (создается при первом обращении)"""
+    global _backend
+
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = create_backend()
+                log(f"[i] Общее хранилище состояния: {type(_backend).__name__}")
+    return _backend
+
+
+def set_backend(backend: SharedBackend) -> None:
+    """Подключает другое хранилище (например, свой клиент Redis)"""
+    global _backend
+
+    with _backend_lock:
+        _backend = backend
+
+
+async def call_async(fn: Callable, *args) -> Any:
+    """Вызов метода хранилища из event loop: хранилище с blocking (Redis, SQLite) - в потоке, local - сразу"""
+    if get_backend().blocking:
+        return await asyncio.to_thread(fn, *args)
+    return fn(*args)
+
+
+class SharedCache:
+    """Общий для экземпляров бота кэш значений с блокировкой запроса (single-flight между процессами).
+    dumps/loads - преобразование значения в bytes и обратно. ttl - срок жизни, число или функция от значения"""
+
+    def __init__(self, name: str, ttl: float | Callable[[Any], float], dumps: Callable[[Any], bytes],
+                 loads: Callable[[bytes], Any], lock_ttl: float = SHARED_LOCK_TTL,
+                 lock_wait: float = SHARED_LOCK_WAIT, poll_interval: float = SHARED_POLL_INTERVAL) -> None:
+        self.name: str = name
+        self.ttl = ttl
+        self.dumps = dumps
+        self.loads = loads
+        self.lock_ttl: float = lock_ttl
+        self.lock_wait: float = lock_wait
+        self.poll_interval: float = poll_interval
+        self.flight: SingleFlight = SingleFlight(f'shared_{name}')                  # Одинаковые запросы потоков процесса
+        self.flight_async: AsyncSingleFlight = AsyncSingleFlight(f'shared_{name}')  # Одинаковые запросы задач event loop
+
+    def _key(self, key: Any) -> str:
+        return f'{self.name}:{key}'
+
+    def _decode(self, data: bytes | None, max_age: float | None = None) -> tuple:
+        """(значение, возраст в секундах) или (None, 0.0), если значения нет или оно старше max_age"""
+        if data is None:
+            return None, 0.0
+        age: float = max(0.0, time.time() - _STORED_AT.unpack_from(data)[0])
+        if max_age is not None and age > max_age:
+            return None, 0.0
+        return self.loads(data[_STORED_AT.size:]), age
+
+    def _store(self, backend: SharedBackend, key: Any, value: Any) -> None:
+        ttl: float = self.ttl(value) if callable(self.ttl) else self.ttl
+        if value is not None and ttl > 0:
+            backend.set(self._key(key), _STORED_AT.pack(time.time()) + self.dumps(value), ttl)
+
+    def fetch(self, key: Any, fetch: Callable[[], Any], max_age: float | None = None) -> tuple:
+        """Значение из хранилища или результат fetch() (его получат и остальные экземпляры).
+        max_age - значения старше стольких секунд считаются отсутствующими (обновление заранее).
+        Возвращает (значение, возраст в секундах); значение None - fetch не удался"""
+        return self.flight.do((key, max_age), lambda: self._fetch(key, fetch, max_age))
+
+    def _fetch(self, key: Any, fetch: Callable[[], Any], max_age: float | None) -> tuple:
+        backend: SharedBackend = get_backend()
+        if backend.local:
+            # Других экземпляров нет: одинаковые запросы процесса уже объединил single-flight. Копия значения
+            # в хранилище не нужна - она обходила бы ограничение размера кэша процесса
+            return fetch(), 0.0
+
+        value, age = self._decode(backend.get(self._key(key)), max_age)
+        if value is not None:
+            shared_lookups.inc(cache=self.name, result='hit')
+            return value, age
+
+        token: bytes = uuid.uuid4().bytes
+        deadline: float = time.monotonic() + self.lock_wait
+        while not backend.add(self._key(key) + ':lock', token, self.lock_ttl):
+            # Запрос выполняет другой экземпляр - ждем его результат
+            if time.monotonic() >= deadline:
+                shared_lookups.inc(cache=self.name, result='timeout')
+                return fetch(), 0.0
+            time.sleep(self.poll_interval)
+            value, age = self._decode(backend.get(self._key(key)), max_age)
+            if value is not None:
+                shared_lookups.inc(cache=self.name, result='waited')
+                return value, age
+
+        shared_lookups.inc(cache=self.name, result='miss')
+        try:
+            value = fetch()
+            self._store(backend, key, value)
+            return value, 0.0
+        finally:
+            backend.delete_if(self._key(key) + ':lock', token)
+
+    async def fetch_async(self, key: Any, fetch: Callable[[], Awaitable[Any]], max_age: float | None = None) -> tuple:
+        """Асинхронный вариант fetch"""
+        return await self.flight_async.do((key, max_age), lambda: self._fetch_async(key, fetch, max_age))
+
+    async def _fetch_async(self, key: Any, fetch: Callable[[], Awaitable[Any]], max_age: float | None) -> tuple:
+        backend: SharedBackend = get_backend()
+        if backend.local:
+            return await fetch(), 0.0
+
+        value, age = self._decode(await call_async(backend.get, self._key(key)), max_age)
+        if value is not None:
+            shared_lookups.inc(cache=self.name, result='hit')
+            return value, age
+
+        token: bytes = uuid.uuid4().bytes
+        deadline: float = time.monotonic() + self.lock_wait
+        while not await call_async(backend.add, self._key(key) + ':lock', token, self.lock_ttl):
+            if time.monotonic() >= deadline:
+                shared_lookups.inc(cache=self.name, result='timeout')
+                return await fetch(), 0.0
+            await asyncio.sleep(self.poll_interval)
+            value, age = self._decode(await call_async(backend.get, self._key(key)), max_age)
+            if value is not None:
+                shared_lookups.inc(cache=self.name, result='waited')
+                return value, age
+
+        shared_lookups.inc(cache=self.name, result='miss')
+        try:
+            value = await fetch()
+            await call_async(self._store, backend, key, value)
+            return value, 0.0
+        finally:
+            await call_async(backend.delete_if, self._key(key) + ':lock', token)
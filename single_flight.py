@@ -0,0 +1,99 @@
+"""Объединение одинаковых одновременных запросов (single-flight)
+
+Пока запрос с ключом key выполняется, остальные вызовы с тем же ключом не идут на сервер,
+а ждут и получают тот же результат (или то же исключение).
+SingleFlight - для потоков, AsyncSingleFlight - для asyncio.
+Сэкономленные запросы экземпляров с именем (name) считает метрика single_flight_saved_total{name=...}."""
+
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable
+
+import metrics
+
+single_flight_saved = metrics.Counter('single_flight_saved_total',
+                                      'Вызовы, получившие результат уже идущего запроса (запрос не выполнялся)',
+                                      ('name',))
+
+
+class _Call:
+    """Выполняющийся запрос: ожидающие потоки ждут event"""
+    __slots__ = ('event', 'result', 'error')
+
+    def __init__(self) -> None:
+        self.event = threading.Event()
+        self.result: Any = None
+        self.error: BaseException | None = None
+
+
+class SingleFlight:
+    """Single-flight для синхронного кода (потоки). name - метка метрики сэкономленных запросов ('' - без метрики)"""
+
+    def __init__(self, name: str = '') -> None:
+        self.name: str = name
+        self._calls: dict = {}
+        self._lock = threading.Lock()
+        self.calls: int = 0      # Всего вызовов do()
+        self.upstream: int = 0   # Сколько раз fn реально выполнялась
+
+    def do(self, key: Any, fn: Callable[[], Any]) -> Any:
+        """Выполняет fn() или ждет уже идущий вызов с тем же ключом"""
+        with self._lock:
+            self.calls += 1
+            call = self._calls.get(key)
+            leader: bool = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.upstream += 1
+
+        if not leader:
+            if self.name:
+                single_flight_saved.inc(name=self.name)
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+    def stats(self) -> dict:
+        """Вызовы, реальные запросы и сэкономленные запросы"""
+        return {'calls': self.calls, 'upstream': self.upstream, 'saved': self.calls - self.upstream}
+
+
+class AsyncSingleFlight:
+    """Single-flight для asyncio. name - как у SingleFlight"""
+
+    def __init__(self, name: str = '') -> None:
+        self.name: str = name
+        self._tasks: dict = {}
+        self.calls: int = 0
+        self.upstream: int = 0
+
+    async def do(self, key: Any, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Выполняет await fn() или ждет уже идущий вызов с тем же ключом"""
+        self.calls += 1
+        task = self._tasks.get(key)
+        if task is None:
+            # Запрос идет отдельной задачей: отмена одного ожидающего (например, чат ушел)
+            # не отменяет запрос для остальных
+            task = asyncio.ensure_future(fn())
+            self._tasks[key] = task
+            self.upstream += 1
+            task.add_done_callback(lambda _: self._tasks.pop(key, None))
+        elif self.name:
+            single_flight_saved.inc(name=self.name)
+        return await asyncio.shield(task)
+
+    def stats(self) -> dict:
+        """Вызовы, реальные запросы и сэкономленные запросы"""
+        return {'calls': self.calls, 'upstream': self.upstream, 'saved': self.calls - self.upstream}
@@ -0,0 +1,242 @@
+"""Подписки пользователей на уведомления (SQLite)
+
+Два вида подписок:
+ weather - погода в месте каждый день в заданное время ("Уфа в 07:00")
+ rate    - порог курса валютной пары ("USD/RUB выше 100"): уведомление, когда условие начинает выполняться;
+           следующее - только после того, как курс вернется за порог (флаг triggered)
+
+Выборка на отправку делается одним UPDATE ... RETURNING: подписки слота погоды помечаются датой отправки,
+правила пары - флагом triggered. Поэтому несколько экземпляров бота с общим файлом SUBSCRIPTIONS_DB
+не отправляют одно уведомление дважды, а правила пары проверяются одним запросом по индексу порога."""
+
+import os
+import re
+import sqlite3
+import threading
+from dataclasses import dataclass
+
+from currency_exchange import valid_currencies
+
+SUBSCRIPTIONS_DB: str = os.getenv("SUBSCRIPTIONS_DB", "subscriptions.sqlite3")   # Путь к файлу базы
+SUBSCRIPTIONS_PER_CHAT: int = int(os.getenv("SUBSCRIPTIONS_PER_CHAT", "20"))     # Максимум подписок в одном чате
+
+WEATHER, RATE = 'weather', 'rate'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS subscriptions (
+    id           INTEGER PRIMARY KEY,
+    chat_id      INTEGER NOT NULL,
+    kind         TEXT NOT NULL,                 -- 'weather' или 'rate'
+    location     TEXT,                          -- weather: место, как его ввел пользователь
+    location_key TEXT,                          -- weather: нормализованное место (ключ кэша погоды)
+    minute       INTEGER,                       -- weather: время отправки, минут от полуночи
+    last_sent    TEXT,                          -- weather: дата последней отправки ГГГГ-ММ-ДД
+    base         TEXT,                          -- rate: базовая валюта
+    target       TEXT,                          -- rate: целевая валюта
+    op           TEXT,                          -- rate: '>' - курс выше порога, '<' - ниже
+    threshold    REAL,                          -- rate: порог
+    triggered    INTEGER NOT NULL DEFAULT 0     -- rate: условие выполняется, уведомление отправлено
+);
+CREATE INDEX IF NOT EXISTS subscriptions_chat ON subscriptions (chat_id);
+CREATE INDEX IF NOT EXISTS subscriptions_minute ON subscriptions (minute) WHERE kind = 'weather';
+CREATE INDEX IF NOT EXISTS subscriptions_rule ON subscriptions (base, target, op, threshold) WHERE kind = 'rate';
+"""
+
+_COLUMNS: str = 'id, chat_id, kind, location, location_key, minute, base, target, op, threshold'
+
+# Условие правила курса для UPDATE: параметры - курс, курс
+_RULE_MET: str = "((op = '>' AND threshold < ?) OR (op = '<' AND threshold > ?))"
+
+# "USD/RUB > 100", "usd rub выше 99,5"
+_RULE_PATTERN = re.compile(r'^([A-Za-z]{3})\s*[/ ]\s*([A-Za-z]{3})\s*(>|<|выше|ниже|above|below)\s*(\d+(?:[.,]\d+)?)$',
+                           re.IGNORECASE)
+_OPERATORS: dict = {'>': '>', 'выше': '>', 'above': '>', '<': '<', 'ниже': '<', 'below': '<'}
+
+
+@dataclass(slots=True)
+class Subscription:
+    """Подписка одного чата"""
+    chat_id: int
+    kind: str
+    location: str | None = None
+    location_key: str | None = None
+    minute: int | None = None
+    base: str | None = None
+    target: str | None = None
+    op: str | None = None
+    threshold: float | None = None
+    id: int | None = None
+
+    def describe(self) -> str:
+        """Подписка в виде строки для пользователя"""
+        if self.kind == WEATHER:
+            return f"погода {self.location} в {format_minute(self.minute)}"
+        return f"{self.base}/{self.target} {'выше' if self.op == '>' else 'ниже'} {self.threshold:g}"
+
+    def is_met(self, rate: float) -> bool:
+        """Выполняется ли условие правила курса при курсе rate"""
+        return rate > self.threshold if self.op == '>' else rate < self.threshold
+
+
+def _subscription(row: tuple) -> Subscription:
+    """Подписка из строки с колонками _COLUMNS"""
+    (sub_id, chat_id, kind, location, location_key, minute, base, target, op, threshold) = row
+    return Subscription(chat_id, kind, location, location_key, minute, base, target, op, threshold, sub_id)
+
+
+def parse_minute(value: str) -> int:
+    """'07:00' → минут от полуночи. ValueError - некорректное время"""
+    hours, _, minutes = value.strip().partition(':')
+    hour, minute = int(hours), int(minutes or 0)
+    if not (0 <= hour < 24 and 0 <= minute < 60):
+        raise ValueError(f"Некорректное время: '{value}'")
+    return hour * 60 + minute
+
+
+def format_minute(minute: int) -> str:
+    """Минут от полуночи → 'ЧЧ:ММ'"""
+    return f"{minute // 60:02}:{minute % 60:02}"
+
+
+def parse_rule(value: str) -> tuple:
+    """'USD/RUB > 100' → ('USD', 'RUB', '>', 100.0). ValueError - некорректное правило или код валюты"""
+    match = _RULE_PATTERN.match(value.strip())
+    if match is None:
+        raise ValueError(f"Некорректное правило: '{value}'")
+    base, target = match.group(1).upper(), match.group(2).upper()
+    for code in (base, target):
+        if code not in valid_currencies:
+            raise ValueError(f"Название валюты не существует: '{code}'")
+    return base, target, _OPERATORS[match.group(3).lower()], float(match.group(4).replace(',', '.'))
+
+
+class SubscriptionStore:
+    """Хранилище подписок. Потокобезопасное (одно соединение под блокировкой)"""
+
+    def __init__(self, path: str = SUBSCRIPTIONS_DB) -> None:
+        self.path: str = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")  # Файл могут использовать другие экземпляры бота
+        self._conn.executescript(_SCHEMA)
+
+    def add(self, subscription: Subscription) -> Subscription:
+        """Сохраняет подписку и возвращает ее с id"""
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "INSERT INTO subscriptions (chat_id, kind, location, location_key, minute, base, target, op, threshold) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (subscription.chat_id, subscription.kind, subscription.location, subscription.location_key,
+                 subscription.minute, subscription.base, subscription.target, subscription.op, subscription.threshold))
+        subscription.id = cursor.lastrowid
+        return subscription
+
+    def remove(self, chat_id: int, subscription_id: int) -> bool:
+        """Удаляет подписку чата. False - такой подписки у чата нет"""
+        with self._lock, self._conn:
+            cursor = self._conn.execute("DELETE FROM subscriptions WHERE id = ? AND chat_id = ?",
+                                        (subscription_id, chat_id))
+        return cursor.rowcount > 0
+
+    def remove_chat(self, chat_id: int) -> int:
+        """Удаляет все подписки чата (пользователь отписался или заблокировал бота). Возвращает их число"""
+        with self._lock, self._conn:
+            cursor = self._conn.execute("DELETE FROM subscriptions WHERE chat_id = ?", (chat_id,))
+        return cursor.rowcount
+
+    def for_chat(self, chat_id: int) -> list:
+        """Подписки чата по порядку создания"""
+        with self._lock:
+            rows = self._conn.execute(f"SELECT {_COLUMNS} FROM subscriptions WHERE chat_id = ? ORDER BY id",
+                                      (chat_id,)).fetchall()
+        return [_subscription(row) for row in rows]
+
+    def count(self, chat_id: int) -> int:
+        """Число подписок чата"""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM subscriptions WHERE chat_id = ?", (chat_id,)).fetchone()[0]
+
+    def minutes(self) -> set:
+        """Минуты от полуночи, на которые есть подписки на погоду"""
+        with self._lock:
+            rows = self._conn.execute("SELECT DISTINCT minute FROM subscriptions WHERE kind = 'weather'").fetchall()
+        return {row[0] for row in rows}
+
+    def has_minute(self, minute: int) -> bool:
+        """Есть ли подписки на погоду в эту минуту"""
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM subscriptions WHERE kind = 'weather' AND minute = ? LIMIT 1",
+                                      (minute,)).fetchone() is not None
+
+    def claim_weather(self, minute: int, day: str) -> list:
+        """Подписки на погоду в минуту minute, которые сегодня (day, ГГГГ-ММ-ДД) еще не отправлялись.
+        Они сразу помечаются отправленными: другой экземпляр бота их уже не получит"""
+        with self._lock, self._conn:
+            rows = self._conn.execute(
+                f"UPDATE subscriptions SET last_sent = ? "
+                f"WHERE kind = 'weather' AND minute = ? AND (last_sent IS NULL OR last_sent <> ?) "
+                f"RETURNING {_COLUMNS}", (day, minute, day)).fetchall()
+        return [_subscription(row) for row in rows]
+
+    def release_weather(self, ids: list, day: str) -> None:
+        """Снимает с подписок ids отметку отправки за day (погоду не удалось получить или поставить в очередь):
+        их снова выберет повторный запуск слота"""
+        with self._lock, self._conn:
+            self._conn.executemany("UPDATE subscriptions SET last_sent = NULL WHERE id = ? AND last_sent = ?",
+                                   [(subscription_id, day) for subscription_id in ids])
+
+    def rate_pairs(self) -> list:
+        """Валютные пары, на которые есть правила"""
+        with self._lock:
+            return self._conn.execute("SELECT DISTINCT base, target FROM subscriptions WHERE kind = 'rate'").fetchall()
+
+    def evaluate_rates(self, rates: dict) -> list:
+        """Проверяет правила всех пар по курсам {(база, цель): курс} одной транзакцией.
+        Правила, условие которых начало выполняться, помечаются triggered и возвращаются;
+        у правил, условие которых перестало выполняться, флаг сбрасывается"""
+        fired: list = []
+        with self._lock, self._conn:
+            for (base, target), rate in rates.items():
+                fired += self._conn.execute(
+                    f"UPDATE subscriptions SET triggered = 1 "
+                    f"WHERE kind = 'rate' AND base = ? AND target = ? AND triggered = 0 AND {_RULE_MET} "
+                    f"RETURNING {_COLUMNS}", (base, target, rate, rate)).fetchall()
+                self._conn.execute(
+                    f"UPDATE subscriptions SET triggered = 0 "
+                    f"WHERE kind = 'rate' AND base = ? AND target = ? AND triggered = 1 AND NOT {_RULE_MET}",
+                    (base, target, rate, rate))
+        return [_subscription(row) for row in fired]
+
+    def release_rates(self, ids: list) -> None:
+        """Снимает с правил ids флаг triggered (уведомление не удалось поставить в очередь):
+        следующая проверка курса снова их выберет, если условие еще выполняется"""
+        with self._lock, self._conn:
+            self._conn.executemany("UPDATE subscriptions SET triggered = 0 WHERE id = ? AND triggered = 1",
+                                   [(subscription_id,) for subscription_id in ids])
+
+    def stats(self) -> dict:
+        """Число подписок по видам"""
+        with self._lock:
+            return dict(self._conn.execute("SELECT kind, COUNT(*) FROM subscriptions GROUP BY kind").fetchall())
+
+    def close(self) -> None:
+        """Закрывает соединение с базой"""
+        with self._lock:
+            self._conn.close()
+
+
+_store: SubscriptionStore | None = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> SubscriptionStore:
+    """Общее хранилище процесса (файл SUBSCRIPTIONS_DB открывается при первом обращении)"""
+    global _store
+
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = SubscriptionStore()
+    return _store
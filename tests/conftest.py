@@ -0,0 +1,8 @@
+"""Общие настройки тестов: модули проекта лежат в корне репозитория"""
+
+import os
+import sys
+
+ROOT: str = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault('LOG_ENABLED', '0')  # Диагностика модулей не нужна в выводе pytest
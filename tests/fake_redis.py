@@ -0,0 +1,102 @@
+"""Локальная замена Redis для проверки RedisBackend (shared_state.py) без сервера Redis: тесты
+и стенд нескольких экземпляров бота (benchmarks/replicas.py)
+
+FakeRedis - подмножество команд redis-py, которое использует RedisBackend: get, set(px=, nx=),
+delete, incrby, pexpire. Значения хранятся как bytes, как их возвращает redis-py.
+serve() делает один экземпляр FakeRedis доступным другим процессам по сети (multiprocessing.managers):
+процессы-экземпляры бота подключаются через connect() и работают с ним, как с общим Redis."""
+
+import time
+import threading
+from multiprocessing.managers import BaseManager
+
+
+class FakeRedis:
+    """Хранилище в памяти с командами redis-py. Потокобезопасный"""
+
+    def __init__(self) -> None:
+        self._data: dict = {}  # key -> (bytes, когда истекает (monotonic) или None)
+        self._lock = threading.Lock()
+        self.commands: int = 0
+
+    def _alive(self, key: str) -> tuple | None:
+        entry = self._data.get(key)
+        if entry is not None and entry[1] is not None and entry[1] <= time.monotonic():
+            del self._data[key]
+            return None
+        return entry
+
+    @staticmethod
+    def _encode(value) -> bytes:
+        return value if isinstance(value, bytes) else str(value).encode()
+
+    def get(self, key: str) -> bytes | None:
+        with self._lock:
+            self.commands += 1
+            entry = self._alive(key)
+            return entry[0] if entry is not None else None
+
+    def set(self, key: str, value, px: int | None = None, nx: bool = False) -> bool | None:
+        with self._lock:
+            self.commands += 1
+            if nx and self._alive(key) is not None:
+                return None
+            self._data[key] = (self._encode(value), time.monotonic() + px / 1000 if px is not None else None)
+            return True
+
+    def delete(self, *keys: str) -> int:
+        with self._lock:
+            self.commands += 1
+            return sum(self._data.pop(key, None) is not None for key in keys)
+
+    def incrby(self, key: str, amount: int = 1) -> int:
+        with self._lock:
+            self.commands += 1
+            entry = self._alive(key)
+            value: int = (int(entry[0]) if entry is not None else 0) + amount
+            self._data[key] = (str(value).encode(), entry[1] if entry is not None else None)
+            return value
+
+    def pexpire(self, key: str, milliseconds: int) -> bool:
+        with self._lock:
+            self.commands += 1
+            entry = self._alive(key)
+            if entry is None:
+                return False
+            self._data[key] = (entry[0], time.monotonic() + milliseconds / 1000)
+            return True
+
+    def stats(self) -> dict:
+        return {'keys': len(self._data), 'commands': self.commands}
+
+
+class _Manager(BaseManager):
+    pass
+
+
+_server: FakeRedis | None = None
+
+
+def _shared_server() -> FakeRedis:
+    """Один FakeRedis на процесс менеджера: все клиенты получают прокси к нему"""
+    global _server
+
+    if _server is None:
+        _server = FakeRedis()
+    return _server
+
+
+def serve(address: tuple = ('127.0.0.1', 0), authkey: bytes = b'fake-redis') -> tuple:
+    """Запускает общий FakeRedis в отдельном процессе. Возвращает (адрес, менеджер); остановка - manager.shutdown()"""
+    _Manager.register('redis', callable=_shared_server)
+    manager = _Manager(address=address, authkey=authkey)
+    manager.start()
+    return manager.address, manager
+
+
+def connect(address: tuple, authkey: bytes = b'fake-redis'):
+    """Клиент общего FakeRedis: прокси с теми же методами"""
+    _Manager.register('redis')
+    manager = _Manager(address=address, authkey=authkey)
+    manager.connect()
+    return manager.redis()
@@ -0,0 +1,80 @@
+"""Хранилище исторических курсов (history_store.py): дни без курсов у сервиса не запрашиваются повторно"""
+
+from datetime import date, timedelta
+
+import pytest
+
+import history_store
+import currency_exchange
+from history_store import HistoryStore
+
+START: date = date(2024, 1, 1)
+END: date = date(2024, 1, 5)
+EMPTY: date = date(2024, 1, 3)  # День, на который у сервиса нет курсов
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = HistoryStore(str(tmp_path / 'history.sqlite3'))
+    yield store
+    store.close()
+
+
+def test_no_data_day_not_missing(store):
+    store.put('USD', START, {'USD': 1.0, 'EUR': 0.9})
+    store.put_no_data('USD', EMPTY)
+    assert store.missing_days('USD', START, END) == [date(2024, 1, 2), date(2024, 1, 4), END]
+    assert store.has_no_data('USD', EMPTY)
+    assert not store.has_no_data('EUR', EMPTY)
+
+
+def test_recent_no_data_expires(store, monkeypatch):
+    """Отметка недавнего дня действует HISTORY_NO_DATA_TTL: курсы за него могут появиться"""
+    yesterday: date = date.today() - timedelta(days=1)
+    monkeypatch.setattr(history_store, 'HISTORY_NO_DATA_TTL', -1.0)
+    store.put_no_data('USD', yesterday)
+    store.put_no_data('USD', EMPTY)
+    assert not store.has_no_data('USD', yesterday)
+    assert store.has_no_data('USD', EMPTY)  # Давний день отмечен навсегда
+
+
+def test_put_replaces_no_data(store):
+    store.put_no_data('USD', EMPTY)
+    store.put('USD', EMPTY, {'USD': 1.0, 'EUR': 0.9})
+    assert not store.has_no_data('USD', EMPTY)
+    assert store.series('USD', 'EUR', START, END) == [(EMPTY, 0.9)]
+
+
+class FakeResponse:
+    """Ответ exchangerate-api на запрос history"""
+
+    def __init__(self, data: dict) -> None:
+        self.data: dict = data
+
+    def json(self) -> dict:
+        return self.data
+
+    def raise_for_status(self) -> None:
+        pass
+
+
+def test_history_range_skips_no_data_days(store, monkeypatch):
+    requested: list = []
+
+    def exchange_get(url: str) -> FakeResponse:
+        requested.append(url)
+        if url.endswith('/2024/1/3'):
+            return FakeResponse({'result': 'error', 'error-type': 'no-data-available'})
+        return FakeResponse({'result': 'success', 'conversion_rates': {'USD': 1.0, 'EUR': 0.9}})
+
+    monkeypatch.setattr(currency_exchange, 'get_store', lambda: store)
+    monkeypatch.setattr(currency_exchange, 'exchange_get', exchange_get)
+
+    series: list = currency_exchange.get_history_range('key', 'USD', 'EUR', START, END)
+    assert [day for day, _ in series] == [day for day in history_store.date_range(START, END) if day != EMPTY]
+    assert len(requested) == 5
+
+    currency_exchange.get_history_range('key', 'USD', 'EUR', START, END)
+    assert len(requested) == 5  # Повторный вызов ничего не запрашивает
+    assert currency_exchange.get_history_exchange_rate('key', 'USD', 'EUR', '2024', '01', '03') is None
+    assert len(requested) == 5
@@ -0,0 +1,71 @@
+"""Планировщик подписок (scheduler.py): слот погоды не запускается дважды, уведомление о курсе, которое
+очередь не приняла, повторяется при следующей проверке"""
+
+import asyncio
+
+import pytest
+
+from scheduler import SubscriptionScheduler
+from subscriptions import Subscription, SubscriptionStore, RATE, WEATHER
+
+
+class FakeNotifier:
+    """Очередь рассылки, которая принимает сообщения, только если accept"""
+
+    def __init__(self) -> None:
+        self.accept: bool = True
+        self.sent: list = []
+
+    def notify(self, chat_id: int, text: str) -> bool:
+        if self.accept:
+            self.sent.append((chat_id, text))
+        return self.accept
+
+
+class FakeTable:
+    def rate(self, base: str, target: str) -> float:
+        return 0.9
+
+
+class FakeRateEngine:
+    async def table_async(self) -> FakeTable:
+        return FakeTable()
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = SubscriptionStore(str(tmp_path / 'subscriptions.sqlite3'))
+    yield store
+    store.close()
+
+
+def test_readded_minute_runs_once(store, monkeypatch):
+    """Минута убрана (подписок не осталось) и снова добавлена: в куче две задачи, запускается одна"""
+    scheduler = SubscriptionScheduler(FakeRateEngine(), FakeNotifier(), store)
+    started: list = []
+    monkeypatch.setattr(scheduler, '_start_job', started.append)
+    when: float = 1000.0
+    monkeypatch.setattr(scheduler, 'next_run', lambda minute, now=None: when)
+
+    scheduler.schedule_minute(420)
+    scheduler._minutes.pop(420)  # Как в run_weather, когда подписок на минуту не осталось
+    scheduler.schedule_minute(420)
+    when = 1000.0 + 86400  # Следующий запуск - завтра
+
+    scheduler._pop_due(1000.0)
+    assert [job[:2] for job in started] == [(WEATHER, 420)]
+    assert len(scheduler._heap) == 1  # Старая задача минуты не вернулась в кучу
+
+
+def test_rejected_rate_alert_retried(store):
+    """Очередь не приняла уведомление о курсе: правило не считается сработавшим"""
+    notifier = FakeNotifier()
+    scheduler = SubscriptionScheduler(FakeRateEngine(), notifier, store)
+    store.add(Subscription(1, RATE, base='USD', target='EUR', op='>', threshold=0.5))
+
+    notifier.accept = False
+    assert asyncio.run(scheduler.run_rates()) == 0
+    notifier.accept = True
+    assert asyncio.run(scheduler.run_rates()) == 1
+    assert asyncio.run(scheduler.run_rates()) == 0  # Отправленное правило повторно не срабатывает
+    assert len(notifier.sent) == 1
@@ -0,0 +1,202 @@
+"""Контракт хранилищ общего состояния (shared_state.py) и single-flight общего кэша
+
+Каждый тест контракта получает два хранилища, которые видят одни и те же данные: для SQLite - два
+соединения с одним файлом, для Redis - два RedisBackend поверх одного FakeRedis (tests/fake_redis.py),
+для local - один и тот же объект. Так проверяется, что блокировки и счетчики работают между экземплярами."""
+
+import time
+import asyncio
+import threading
+
+import pytest
+
+import shared_state
+from cache import TTLCache
+from shared_state import LocalBackend, SQLiteBackend, RedisBackend, SharedCache
+from fake_redis import FakeRedis
+
+TTL: float = 0.05  # Короткий срок жизни для проверки истечения, сек
+
+
+@pytest.fixture(params=['local', 'sqlite', 'redis'])
+def backends(request, tmp_path) -> tuple:
+    """Два хранилища с общими данными (как у двух экземпляров бота)"""
+    if request.param == 'local':
+        backend = LocalBackend()
+        return backend, backend
+    if request.param == 'sqlite':
+        path: str = str(tmp_path / 'shared.sqlite3')
+        return SQLiteBackend(path), SQLiteBackend(path)
+    client = FakeRedis()
+    return RedisBackend(client), RedisBackend(client)
+
+
+@pytest.fixture
+def local_backend():
+    """Хранилище local на время теста (прежнее хранилище процесса восстанавливается)"""
+    previous = shared_state._backend
+    backend = LocalBackend()
+    shared_state.set_backend(backend)
+    yield backend
+    shared_state.set_backend(previous)
+
+
+def test_incomplete_backend_rejected():
+    """Хранилище без части методов не создается (ошибка сразу, а не при первом вызове)"""
+    class Incomplete(shared_state.SharedBackend):
+        def get(self, key: str) -> bytes | None:
+            return None
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+def test_set_get_delete(backends):
+    first, second = backends
+    assert second.get('key') is None
+    first.set('key', b'value')
+    assert second.get('key') == b'value'
+    second.delete('key')
+    assert first.get('key') is None
+
+
+def test_add_only_if_missing(backends):
+    first, second = backends
+    assert first.add('lock', b'first', 10)
+    assert not second.add('lock', b'second', 10)
+    assert second.get('lock') == b'first'
+
+
+def test_delete_if_owner(backends):
+    first, second = backends
+    first.add('lock', b'token', 10)
+    assert not second.delete_if('lock', b'other')
+    assert second.get('lock') == b'token'
+    assert second.delete_if('lock', b'token')
+    assert first.add('lock', b'next', 10)
+
+
+def test_incr(backends):
+    first, second = backends
+    assert first.incr('counter') == 1
+    assert second.incr('counter', 5) == 6
+    assert first.incr('counter') == 7
+
+
+def test_incr_concurrent(backends):
+    first, second = backends
+
+    def worker(backend) -> None:
+        for _ in range(100):
+            backend.incr('counter')
+
+    threads: list = [threading.Thread(target=worker, args=(backend,)) for backend in (first, second) * 2]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert first.incr('counter', 0) == 400
+
+
+def test_ttl_expiry(backends):
+    first, second = backends
+    first.set('key', b'value', TTL)
+    assert first.add('lock', b'token', TTL)
+    assert first.incr('counter', 1, TTL) == 1
+    assert second.get('key') == b'value'
+
+    time.sleep(TTL * 3)
+    assert second.get('key') is None
+    assert second.add('lock', b'other', TTL)  # Блокировка упавшего владельца истекла
+    assert second.incr('counter', 1, TTL) == 1
+
+
+def test_shared_cache_between_instances(backends, monkeypatch):
+    """Значение, полученное одним экземпляром, другой берет из хранилища без запроса"""
+    first, second = backends
+    if first.local:
+        pytest.skip('local - хранилище одного процесса, значения SharedCache в нем не хранятся')
+    cache = SharedCache('test', ttl=60, dumps=str.encode, loads=bytes.decode)
+    calls: list = []
+
+    def fetch() -> str:
+        calls.append(1)
+        return 'value'
+
+    monkeypatch.setattr(shared_state, '_backend', first)
+    assert cache.fetch('key', fetch)[0] == 'value'
+    monkeypatch.setattr(shared_state, '_backend', second)
+    value, age = cache.fetch('key', fetch)
+    assert (value, len(calls)) == ('value', 1)
+    assert age >= 0.0
+
+
+def test_single_flight_async_local(local_backend):
+    """Одновременные промахи процесса - один запрос, без блокировки и опроса хранилища"""
+    # Опрос раз в секунду: если промахи снова пойдут через блокировку, тест заметно замедлится
+    cache = SharedCache('test', ttl=60, dumps=str.encode, loads=bytes.decode, poll_interval=1.0)
+    calls: list = []
+
+    async def fetch() -> str:
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return 'value'
+
+    async def run() -> list:
+        return await asyncio.gather(*(cache.fetch_async('key', fetch) for _ in range(5)))
+
+    started: float = time.perf_counter()
+    results: list = asyncio.run(run())
+    elapsed: float = time.perf_counter() - started
+
+    assert [value for value, _ in results] == ['value'] * 5
+    assert len(calls) == 1
+    assert elapsed < 0.5
+    assert cache.flight_async.stats()['saved'] == 4
+
+
+def test_single_flight_threads_local(local_backend):
+    """То же для потоков (синхронный fetch)"""
+    cache = SharedCache('test', ttl=60, dumps=str.encode, loads=bytes.decode, poll_interval=1.0)
+    calls: list = []
+    started = threading.Event()
+
+    def fetch() -> str:
+        calls.append(1)
+        started.set()
+        time.sleep(0.1)
+        return 'value'
+
+    results: list = []
+    threads: list = [threading.Thread(target=lambda: results.append(cache.fetch('key', fetch)[0])) for _ in range(5)]
+    begin: float = time.perf_counter()
+    threads[0].start()
+    started.wait()  # Остальные потоки приходят, пока первый запрос выполняется
+    for thread in threads[1:]:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == ['value'] * 5
+    assert len(calls) == 1
+    assert time.perf_counter() - begin < 0.5
+    assert cache.flight.stats()['saved'] == 4
+
+
+def test_local_backend_keeps_lru_bound(local_backend):
+    """С хранилищем local кэш процесса остается ограниченным: значения не копируются в хранилище,
+    а вытесненный из LRU ключ запрашивается заново"""
+    cache = TTLCache(ttl=60, maxsize=10, shared=SharedCache('test', ttl=60, dumps=str.encode, loads=bytes.decode))
+    calls: list = []
+
+    def fetch(key: int) -> str:
+        calls.append(key)
+        return f'value{key}'
+
+    for key in range(1000):
+        cache.get_or_fetch(key, lambda: fetch(key))
+    assert len(cache) == 10
+    assert not local_backend._data
+
+    assert cache.get_or_fetch(0, lambda: fetch(0)) == 'value0'
+    assert calls.count(0) == 2
@@ -0,0 +1,53 @@
+"""Метрика сэкономленных запросов single-flight (single_flight_saved_total)"""
+
+import time
+import asyncio
+import threading
+
+from single_flight import SingleFlight, AsyncSingleFlight, single_flight_saved
+
+
+def test_async_saved_exported():
+    flight = AsyncSingleFlight('test_async')
+    before: float = single_flight_saved.value(name='test_async')
+
+    async def fetch() -> str:
+        await asyncio.sleep(0.05)
+        return 'value'
+
+    async def run() -> list:
+        return await asyncio.gather(*(flight.do('key', fetch) for _ in range(5)))
+
+    assert asyncio.run(run()) == ['value'] * 5
+    assert single_flight_saved.value(name='test_async') - before == flight.stats()['saved'] == 4
+
+
+def test_threads_saved_exported():
+    flight = SingleFlight('test_threads')
+    before: float = single_flight_saved.value(name='test_threads')
+    started = threading.Event()
+
+    def fetch() -> str:
+        started.set()
+        time.sleep(0.1)
+        return 'value'
+
+    threads: list = [threading.Thread(target=flight.do, args=('key', fetch)) for _ in range(5)]
+    threads[0].start()
+    started.wait()
+    for thread in threads[1:]:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert single_flight_saved.value(name='test_threads') - before == flight.stats()['saved'] == 4
+
+
+def test_unnamed_not_exported():
+    flight = AsyncSingleFlight()
+
+    async def run() -> list:
+        return await asyncio.gather(*(flight.do('key', lambda: asyncio.sleep(0.01)) for _ in range(3)))
+
+    asyncio.run(run())
+    assert flight.stats()['saved'] == 2
+    assert all('name=""' not in sample for sample in single_flight_saved.samples())
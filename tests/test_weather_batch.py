@@ -0,0 +1,57 @@
+"""Пакетный режим weather.py: лимитер запросов пакета не остается в процессе после run_batch,
+параметры --concurrency и --rps проверяются при разборе аргументов"""
+
+import io
+import argparse
+import asyncio
+
+import pytest
+
+import http_client
+import weather
+
+
+@pytest.fixture
+def limiter(monkeypatch):
+    """Лимитер процесса на время теста"""
+    previous = object()
+    monkeypatch.setattr(http_client, 'rate_limiter', previous)
+    return previous
+
+
+def test_run_batch_restores_limiter(limiter, monkeypatch):
+    async def fetch_city_async(city: str, image: bool, text: bool) -> dict:
+        assert http_client.rate_limiter is not limiter  # Пакет идет со своим лимитером
+        return {'city': city, 'ok': True, 'weather': None, 'image': None, 'error': None}
+
+    monkeypatch.setattr(weather, 'fetch_city_async', fetch_city_async)
+    errors: int = asyncio.run(weather.run_batch(['Уфа', 'Казань'], False, True, 2, 5.0, 'jsonl', io.StringIO()))
+    assert errors == 0
+    assert http_client.rate_limiter is limiter
+
+
+def test_run_batch_restores_limiter_on_error(limiter, monkeypatch):
+    async def fetch_city_async(city: str, image: bool, text: bool) -> dict:
+        raise RuntimeError('batch failed')
+
+    monkeypatch.setattr(weather, 'fetch_city_async', fetch_city_async)
+    with pytest.raises(RuntimeError):
+        asyncio.run(weather.run_batch(['Уфа'], False, True, 2, 5.0, 'jsonl', io.StringIO()))
+    assert http_client.rate_limiter is limiter
+
+
+@pytest.mark.parametrize('value', ['0', '-1', '2.5', 'x'])
+def test_concurrency_must_be_positive(value):
+    with pytest.raises(argparse.ArgumentTypeError):
+        weather.validate_concurrency_arg(value)
+
+
+@pytest.mark.parametrize('value', ['0', '-0.5', 'nan', 'inf', 'x'])
+def test_rps_must_be_positive(value):
+    with pytest.raises(argparse.ArgumentTypeError):
+        weather.validate_rps_arg(value)
+
+
+def test_batch_limits_accepted():
+    assert weather.validate_concurrency_arg('20') == 20
+    assert weather.validate_rps_arg('0.5') == 0.5
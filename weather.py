@@ -1,130 +1,279 @@
 import os
-import requests
+import sys
+import json
+import shutil
+import contextlib
+import asyncio
+import http_client
+import locations
+import metrics
+from metrics import log
+from single_flight import SingleFlight, AsyncSingleFlight
+from cache import TTLCache
+from rate_limit import HostRateLimiter
+from circuit_breaker import breakers
+from shared_state import SharedCache
+from weather_model import CurrentWeather, parse_current_weather
+from image_cache import CachedImage, ImageCache, get_image_cache
+from lazy_import import lazy_import
 import argparse
 from datetime import datetime
 #from typing import Optional
-#import json
+
+# requests и aiohttp загружаются при первом обращении: CLI пользуется только одной из библиотек
+requests = lazy_import('requests')
+aiohttp = lazy_import('aiohttp')
+
+# Адрес wttr.in (можно заменить на локальный стенд для тестов и бенчмарков)
+WTTR_URL: str = os.getenv("WTTR_URL", "https://wttr.in")
+# Circuit breaker: при серии таймаутов и 5xx запросы к wttr.in сразу завершаются ошибкой, а из кэша
+# отдаются последние известные данные (WEATHER_CACHE_STALE_IF_ERROR, ImageCache.latest)
+breakers.register(WTTR_URL, 'wttr.in')
+
+# Кэш ответов wttr.in (format=j1) по нормализованному названию места.
+# Данные wttr.in обновляются раз в несколько минут, поэтому повторные запросы отдаются из памяти
+WEATHER_CACHE_TTL: float = float(os.getenv("WEATHER_CACHE_TTL", "300"))      # Время жизни записи, сек
+WEATHER_CACHE_SIZE: int = int(os.getenv("WEATHER_CACHE_SIZE", "256"))        # Максимум мест в кэше
+WEATHER_CACHE_STALE: float = float(os.getenv("WEATHER_CACHE_STALE", "0"))    # stale-while-revalidate, сек (0 - выкл.)
+WEATHER_CACHE_STALE_IF_ERROR: float = float(os.getenv("WEATHER_CACHE_STALE_IF_ERROR", "3600"))  # Старые данные при сбое, сек
+
+# Второй уровень - общий кэш экземпляров бота (SHARED_BACKEND): место запрашивается у wttr.in одним экземпляром
+weather_shared: SharedCache = SharedCache('weather', ttl=WEATHER_CACHE_TTL,
+                                          dumps=lambda weather: json.dumps(weather.to_dict()).encode(),
+                                          loads=lambda data: CurrentWeather(**json.loads(data)))
+weather_cache: TTLCache = TTLCache(ttl=WEATHER_CACHE_TTL, maxsize=WEATHER_CACHE_SIZE, stale_ttl=WEATHER_CACHE_STALE,
+                                   name='weather', stale_if_error=WEATHER_CACHE_STALE_IF_ERROR, shared=weather_shared)
+
+# Одинаковые одновременные запросы к wttr.in (по URL) выполняются один раз
+weather_flight: SingleFlight = SingleFlight('wttr')
+weather_flight_async: AsyncSingleFlight = AsyncSingleFlight('wttr')
 
 def get_weather_on_cmd_line(location: str='Москва') -> None:
     """Получает текущую погоду из сервиса wttr.in и выводит в консоль"""
 
-    location: str = encode_location(location)
-    location: str = validate_city_ufa(location)
+    weather: CurrentWeather | None = get_weather_data(location)
+    if weather is None:
+        return
+
+    print(f"[°С] {format_weather(weather)}")
+
+    #ValueError → "У меня есть эта вещь, но она неправильная". Используется при при валидации введенных пользователем данных
+    #KeyError → "У меня вообще нет такой вещи". Используется при разборе JSON ответов от API
+
+def get_weather_data(location: str='Москва') -> CurrentWeather | None:
+    """Возвращает текущую погоду из кэша или из wttr.in. None при ошибке"""
+    location: str = normalize_location(location)
+    return weather_cache.get_or_fetch(location, lambda: fetch_weather_data(location))
 
-    url: str = f"https://wttr.in/{location}?format=j1&lang=ru"
+def fetch_weather_data(location: str) -> CurrentWeather | None:
+    """Запрашивает текущую погоду у wttr.in (без кэша). None при ошибке.
+    Из большого ответа j1 разбираются только нужные поля (parse_current_weather)"""
+
+    url: str = f"{WTTR_URL}/{location}?format=j1&lang=ru"
 
     try:
-        print(f'[->] Запрос по адресу {url}')
-        response: requests.Response = requests.get(url, timeout=10)
+        log(f'[->] Запрос по адресу {url}')
+        response: requests.Response = weather_flight.do(url, lambda: http_client.get(url))
         response.raise_for_status()  # Проверка на ошибки HTTP, если статус 4xx/5xx → HTTPError
 
+        # Сохранение JSON в файл для отладки
+        #with open(f'json_{location}.txt', 'wb') as file:
+        #file.write(response.content)
+
         try:
-            data: dict = response.json()
-            # Сохранение JSON в файл для отладки
-            #with open(f'json_{location}.txt', 'w') as file:
-            #json.dump(data, file, indent=4, ensure_ascii=False)
+            with metrics.parse_seconds.time(kind='j1'):
+                weather: CurrentWeather = parse_current_weather(response.content)
         except ValueError as e:
-            print(f"[!] Ошибка декодирования JSON: {e}")
-
-        current_weather: dict = data['current_condition'][0]
-
-        temperature: str = current_weather['temp_C']
-        feels_like: str = current_weather['FeelsLikeC']
-        pressure: str = current_weather['pressure']
-        humidity: str = current_weather['humidity']
-        wind_speed: str = current_weather['windspeedKmph']
-        weather_desc: str = current_weather['lang_ru'][0]['value']
-        latitude: str = data['nearest_area'][0]['latitude']
-        longitude: str = data['nearest_area'][0]['longitude']
-        area_name: str = data['nearest_area'][0]['areaName'][0]['value']
-
-        print(f"""[°С] Погода в городе {area_name}:
-            Температура: {temperature}°C
-            Ощущается как: {feels_like}°C
-            Влажность: {humidity}%
-            Скорость ветра: {wind_speed} км/ч
-            Давление: {pressure} кРа
-            Описание: {weather_desc}
-            Координаты: {latitude}, {longitude}""")
+            log(f"[!] Ошибка декодирования JSON: {e}")
+            return None
+
+        # По координатам wttr.in называет ближайший населенный пункт - выводим название города из индекса
+        weather.area_name = locations.name_for_key(location) or weather.area_name
+        return weather
 
     except requests.exceptions.Timeout:
-        print("[!] Таймаут при запросе к серверу")
+        log("[!] Таймаут при запросе к серверу")
     except requests.exceptions.ConnectionError:
-        print("[!] Ошибка подключения: сервер недоступен")
+        log("[!] Ошибка подключения: сервер недоступен")
     except requests.exceptions.HTTPError as e:
-        print(f"[!] HTTP ошибка: {e}")
+        log(f"[!] HTTP ошибка: {e}")
     except requests.RequestException as e: # Включает в себя Timeout, ConnectionError, HTTPError и др.
-        print(f"[!] Ошибка при запросе: {e}")
-    except KeyError as e:   # При обработке данных JSON (dict), когда нет нужного ключа
-        print(f"[!] Ошибка при обработке данных: {e}")
+        log(f"[!] Ошибка при запросе: {e}")
+    except KeyError as e:   # При обработке данных JSON, когда нет нужного ключа
+        log(f"[!] Ошибка при обработке данных: {e}")
+    return None
 
-    #ValueError → "У меня есть эта вещь, но она неправильная". Используется при при валидации введенных пользователем данных
-    #KeyError → "У меня вообще нет такой вещи". Используется при разборе JSON ответов от API
+async def get_weather_async(location: str='Москва') -> str | None:
+    """Асинхронная версия get_weather_on_cmd_line для бота.
+    Не блокирует event loop и возвращает текст с погодой (None при ошибке)"""
 
-def save_weather_to_png(location: str='Москва', file_name: str | None = None) -> None:
-    """Сохраняет текущую погоду из сервиса wttr.in в указанный файл PNG"""
+    weather: CurrentWeather | None = await get_weather_data_async(location)
+    return format_weather(weather) if weather is not None else None
 
-    # Проверка имени города для запроса
-    encoded_location: str = encode_location(location)
-    encoded_location: str = validate_city_ufa(encoded_location)
+async def get_weather_data_async(location: str='Москва') -> CurrentWeather | None:
+    """Асинхронная версия get_weather_data"""
+    location: str = normalize_location(location)
+    return await weather_cache.get_or_fetch_async(location, lambda: fetch_weather_data_async(location))
 
-    url: str = f'https://wttr.in/{encoded_location}_pm_lang=ru.png'
+async def fetch_weather_data_async(location: str) -> CurrentWeather | None:
+    """Асинхронная версия fetch_weather_data"""
 
-    # Текущее время
-    time_now: str = get_time_now()
+    url: str = f"{WTTR_URL}/{location}?format=j1&lang=ru"
+
+    try:
+        log(f'[->] Запрос по адресу {url}')
+        response: http_client.AsyncResponse = await weather_flight_async.do(url, lambda: http_client.get_async(url))
+        response.raise_for_status()  # Проверка на ошибки HTTP, если статус 4xx/5xx → ClientResponseError
+
+        try:
+            with metrics.parse_seconds.time(kind='j1'):
+                weather: CurrentWeather = parse_current_weather(response.content)
+        except ValueError as e:
+            log(f"[!] Ошибка декодирования JSON: {e}")
+            return None
+
+        # По координатам wttr.in называет ближайший населенный пункт - выводим название города из индекса
+        weather.area_name = locations.name_for_key(location) or weather.area_name
+        return weather
+
+    except asyncio.TimeoutError:
+        log("[!] Таймаут при запросе к серверу")
+    except aiohttp.ClientResponseError as e:
+        log(f"[!] HTTP ошибка: {e}")
+    except aiohttp.ClientConnectionError:
+        log("[!] Ошибка подключения: сервер недоступен")
+    except aiohttp.ClientError as e: # Базовый класс для всех ошибок aiohttp
+        log(f"[!] Ошибка при запросе: {e}")
+    except KeyError as e:   # При обработке данных JSON, когда нет нужного ключа
+        log(f"[!] Ошибка при обработке данных: {e}")
+    return None
+
+def format_weather(weather: CurrentWeather) -> str:
+    """Формирует текст с текущей погодой"""
+
+    return f"""Погода в городе {weather.area_name}:
+            Температура: {weather.temperature}°C
+            Ощущается как: {weather.feels_like}°C
+            Влажность: {weather.humidity}%
+            Скорость ветра: {weather.wind_speed} км/ч
+            Давление: {weather.pressure} кРа
+            Описание: {weather.weather_desc}
+            Координаты: {weather.latitude}, {weather.longitude}"""
+
+def save_weather_to_png(location: str='Москва', file_name: str | None = None, card: bool = False) -> None:
+    """Сохраняет текущую погоду из сервиса wttr.in в указанный файл PNG.
+    Если картинка для места уже есть в кэше картинок и она свежая - запрос не нужен.
+    card=True - сохраняется уменьшенная и сжатая карточка (image_pipeline.py)"""
+
+    image: CachedImage | None = get_weather_png(location)
+    if image is None:
+        return
+    if card:
+        from image_pipeline import get_pipeline  # Пул процессов и Pillow нужны только для карточки
+
+        image = get_pipeline().render_sync([image])
 
     # Проверка имени файла для сохранения
-    file_name = file_name or f'{location}_{time_now}.png'
+    file_name = file_name or f'{location}_{get_time_now()}.png'
     if '.png' not in file_name:
         file_name += '.png'
 
-    # Проверка на уже существующий файл
-    if should_fetch_weather_data(location, time_now, folder_path='.'):
-        try:
-            print(f'[->] Запрос по адресу {url}')
-            response: requests.Response = requests.get(url, timeout=10)
-            response.raise_for_status()  # Проверка на ошибки HTTP, если статус 4xx/5xx → HTTPError
-
-            with open(os.path.join('images', file_name), 'wb') as file:
-                file.write(response.content)
-
-            print(f"[+] Погода для города {location} сохранена в файл {file_name}")
-
-        except requests.exceptions.Timeout:
-            print("[!] Таймаут при запросе к серверу")
-        except requests.exceptions.ConnectionError:
-            print("[!] Ошибка подключения: сервер недоступен")
-        except requests.exceptions.HTTPError as e:
-            print(f"[!] HTTP ошибка: {e}")
-        except requests.RequestException as e:  # Включает в себя Timeout, ConnectionError, HTTPError и др.
-            print(f"[!] Ошибка при запросе: {e}")
-    else:
-        print(f"[i] Файл {file_name} уже существует. Пропуск запроса.")
+    export_image(image.path, os.path.join('images', file_name))
+    print(f"[+] Погода для города {location} сохранена в файл {file_name}")
+
+def get_weather_png(location: str='Москва') -> CachedImage | None:
+    """Возвращает картинку погоды из кэша картинок или запрашивает ее у wttr.in.
+    При ошибке - последняя сохраненная картинка для места, а если ее нет - None"""
+
+    # Проверка имени города для запроса
+    location: str = normalize_location(location)
+    image_cache: ImageCache = get_image_cache()
+
+    image: CachedImage | None = image_cache.get(location)
+    if image is not None:
+        log(f"[i] Картинка для {location} есть в кэше. Пропуск запроса.")
+        return image
+
+    url: str = f'{WTTR_URL}/{location}_pm_lang=ru.png'
 
-def should_fetch_weather_data(city: str, time: str, folder_path: str = ".") -> bool:
-    """Проверяет, нужно ли запрашивать новые данные о погоде на основе времени последнего сохранения файла.
-    True - нужно запрашивать, тк файл не существует
-    False - не нужно запрашивать, тк файл уже есть"""
+    try:
+        log(f'[->] Запрос по адресу {url}')
+        response: requests.Response = weather_flight.do(url, lambda: http_client.get(url))
+        response.raise_for_status()  # Проверка на ошибки HTTP, если статус 4xx/5xx → HTTPError
+
+        return image_cache.put(location, response.content)
+
+    except requests.exceptions.Timeout:
+        log("[!] Таймаут при запросе к серверу")
+    except requests.exceptions.ConnectionError:
+        log("[!] Ошибка подключения: сервер недоступен")
+    except requests.exceptions.HTTPError as e:
+        log(f"[!] HTTP ошибка: {e}")
+    except requests.RequestException as e:  # Включает в себя Timeout, ConnectionError, HTTPError и др.
+        log(f"[!] Ошибка при запросе: {e}")
+    return image_cache.latest(location)  # Свежую получить не удалось - отдаем последнюю сохраненную
+
+async def get_weather_png_async(location: str='Москва') -> CachedImage | None:
+    """Асинхронная версия get_weather_png для бота.
+    Картинку можно отправить прямо с диска (image.path) или по file_id Telegram (image.file_id)"""
+
+    # Проверка имени города для запроса
+    location: str = normalize_location(location)
+    image_cache: ImageCache = get_image_cache()
+
+    # Поиск в индексе - быстрый запрос к SQLite по первичному ключу, его делаем прямо в loop
+    image: CachedImage | None = image_cache.get(location)
+    if image is not None:
+        log(f"[i] Картинка для {location} есть в кэше. Пропуск запроса.")
+        return image
 
-    file_name = f"{city}_{time}.png"
-    file_path = os.path.join(folder_path, 'images', file_name)
+    url: str = f'{WTTR_URL}/{location}_pm_lang=ru.png'
 
-    return False if os.path.exists(file_path) else True
+    try:
+        log(f'[->] Запрос по адресу {url}')
+        response: http_client.AsyncResponse = await weather_flight_async.do(url, lambda: http_client.get_async(url))
+        response.raise_for_status()  # Проверка на ошибки HTTP, если статус 4xx/5xx → ClientResponseError
+
+        # Запись на диск небольшая, но все равно уносим ее из event loop
+        return await asyncio.to_thread(image_cache.put, location, response.content)
+
+    except asyncio.TimeoutError:
+        log("[!] Таймаут при запросе к серверу")
+    except aiohttp.ClientResponseError as e:
+        log(f"[!] HTTP ошибка: {e}")
+    except aiohttp.ClientConnectionError:
+        log("[!] Ошибка подключения: сервер недоступен")
+    except aiohttp.ClientError as e:  # Базовый класс для всех ошибок aiohttp
+        log(f"[!] Ошибка при запросе: {e}")
+    return image_cache.latest(location)  # Свежую получить не удалось - отдаем последнюю сохраненную
+
+def export_image(source_path: str, file_path: str) -> None:
+    """Кладет картинку из кэша в файл пользователя: жесткая ссылка, а если нельзя - копия"""
+    if os.path.exists(file_path):
+        os.remove(file_path)
+    try:
+        os.link(source_path, file_path)
+    except OSError:
+        shutil.copyfile(source_path, file_path)
 
 def encode_location(location: str) -> str:
     """Меняет все пробелы на '+' для URL по требованию API"""
     return location.replace(' ', '+')
 
+def normalize_location(location: str) -> str:
+    """Приводит название места к единому виду для запроса и ключа кэша. Город из индекса (locations.py) -
+    его координаты: 'Москва', ' москва ', 'Moscow', 'Мсква' и 'мск' → '55.756,37.617'.
+    Остальные места (и опечатки, которые нельзя исправить однозначно: 'Орск', 'Пинск') - название
+    в нижнем регистре, его ищет wttr.in"""
+    place: locations.Location | None = locations.lookup(location)
+    if place is not None:
+        return place.key
+    return encode_location(' '.join(location.split()).lower())
+
 def get_time_now() -> str:
     """Возвращает текущее время в формате ГГГГ.ММ.ДД_ЧЧММ"""
     return datetime.now().strftime("%Y.%m.%d_%H%M")
 
-def validate_city_ufa(city: str) -> str:
-    """Специальная валидация для города Уфа"""
-    if city.strip().lower() in ['уфа', 'ufa']:
-        return '54.775,56.038'  # Координаты Уфы
-    return city
-
 def validate_city_arg(city: str) -> str:
     """Проверяет, что город состоит из букв, дефисов и пробелов"""
     city = city.strip()
@@ -137,13 +286,116 @@ def validate_city_arg(city: str) -> str:
     if any(char.isdigit() for char in city):
         raise argparse.ArgumentTypeError(f"[!] Название города не должно содержать цифры: '{city}'")
 
-    return city.title()  # Приводим к нормальному виду
+    # Город из индекса - его название без опечаток, остальные места приводим к нормальному виду
+    place: locations.Location | None = locations.lookup(city)
+    return place.name if place is not None else city.title()
 
-def main() -> None:
-    """Точка входа с парсингом аргументов из командной строки."""
-
-    # Получаем текущее время
-    print(f"[t] Текущее время: {get_time_now()}")
+def validate_concurrency_arg(value: str) -> int:
+    """Проверяет --concurrency: целое больше нуля (при 0 пакет ждал бы семафор бесконечно)"""
+    try:
+        concurrency: int = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"[!] Нужно целое число: '{value}'") from None
+    if concurrency <= 0:
+        raise argparse.ArgumentTypeError(f"[!] Число городов одновременно должно быть больше нуля: '{value}'")
+    return concurrency
+
+def validate_rps_arg(value: str) -> float:
+    """Проверяет --rps: число больше нуля"""
+    try:
+        rps: float = float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"[!] Нужно число: '{value}'") from None
+    if not rps > 0 or rps == float('inf'):  # NaN тоже отклоняется
+        raise argparse.ArgumentTypeError(f"[!] Число запросов в секунду должно быть больше нуля: '{value}'")
+    return rps
+
+def read_cities(cities: list | None, cities_file: str | None) -> list:
+    """Собирает список городов для пакетного режима: из аргументов и из файла ('-' - stdin).
+    В файле один город на строку, пустые строки и строки с '#' пропускаются"""
+
+    result: list = list(cities or [])
+    if cities_file:
+        file = sys.stdin if cities_file == '-' else open(cities_file, encoding='utf-8')
+        with file:
+            for line in file:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    result.append(line)
+    return result
+
+async def fetch_city_async(city: str, image: bool, text: bool) -> dict:
+    """Погода для одного города в пакетном режиме. Ошибка по городу не прерывает весь пакет:
+    она записывается в поле error результата"""
+
+    result: dict = {'city': city, 'ok': False, 'weather': None, 'image': None, 'error': None}
+    try:
+        city = validate_city_arg(city)
+        result['city'] = city
+
+        if text:
+            weather: CurrentWeather | None = await get_weather_data_async(city)
+            if weather is None:
+                result['error'] = 'не удалось получить погоду'
+                return result
+            result['weather'] = weather.to_dict()
+
+        if image:
+            cached: CachedImage | None = await get_weather_png_async(city)
+            if cached is None:
+                result['error'] = 'не удалось получить картинку'
+                return result
+            file_path: str = os.path.join('images', f'{city}_{get_time_now()}.png')
+            await asyncio.to_thread(export_image, cached.path, file_path)
+            result['image'] = file_path
+
+        result['ok'] = True
+    except argparse.ArgumentTypeError as e:  # Некорректное название города
+        result['error'] = str(e)
+    except Exception as e:  # Любая другая ошибка по одному городу не должна остановить остальные
+        result['error'] = f'{type(e).__name__}: {e}'
+    return result
+
+async def run_batch(cities: list, image: bool, text: bool, concurrency: int, rps: float,
+                    output_format: str, output=None) -> int:
+    """Пакетный режим: погода для многих городов параллельно.
+    Не больше concurrency городов одновременно и не больше rps запросов в секунду к одному хосту.
+    Результаты выводятся по мере готовности (JSONL или текст). Возвращает количество ошибок"""
+
+    output = output or sys.stdout
+    # Лимитер только на время пакета: в демоне CLI (cli_daemon.py) следующие команды идут с прежним
+    previous_limiter: HostRateLimiter | None = http_client.rate_limiter
+    http_client.rate_limiter = HostRateLimiter(rps, min_rate=rps / 20)  # При 429/503 скорость снижается
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def limited(city: str) -> dict:
+        async with semaphore:
+            return await fetch_city_async(city, image, text)
+
+    errors: int = 0
+    try:
+        for future in asyncio.as_completed([limited(city) for city in cities]):
+            result: dict = await future
+            errors += not result['ok']
+
+            if output_format == 'jsonl':
+                output.write(json.dumps(result, ensure_ascii=False) + '\n')
+                output.flush()
+            elif not result['ok']:
+                print(f"[!] {result['city']}: {result['error']}", file=output)
+            else:
+                if result['weather'] is not None:
+                    print(f"[°С] {format_weather(CurrentWeather(**result['weather']))}", file=output)
+                if result['image'] is not None:
+                    print(f"[+] Погода для города {result['city']} сохранена в файл {result['image']}", file=output)
+    finally:
+        http_client.rate_limiter = previous_limiter
+        await http_client.close_async_session()
+
+    return errors
+
+def main(argv: list | None = None) -> None:
+    """Точка входа с парсингом аргументов из командной строки (argv - вместо sys.argv[1:], для cli_daemon.py)"""
 
     # Создаем парсер и описание
     parser: argparse.ArgumentParser = argparse.ArgumentParser(description="""
@@ -154,7 +406,10 @@ def main() -> None:
     python weather.py --city Уфа
     python weather.py --city Казань --filename Kazan_weather.png
     python weather.py --city Москва --filename Москва_погода
-    python weather.py --city 'New York' --noimage    """,
+    python weather.py --city Уфа --card
+    python weather.py --city 'New York' --noimage
+    python weather.py --cities Уфа Казань Москва --both
+    python weather.py --cities-file cities.txt --noimage --format jsonl --concurrency 20    """,
     formatter_class=argparse.RawDescriptionHelpFormatter)
 
     # Создаем папку для изображений, если ее нет
@@ -172,15 +427,63 @@ def main() -> None:
     parser.add_argument('--filename',
                         type=str,
                         help='Имя файла для сохранения изображения погоды в формате PNG (по умолчанию <город>_<ГГГГ.ММ.ДД>_<ЧЧММ>.png)')
+    parser.add_argument('--card',
+                        default=False,
+                        action='store_true',
+                        help='Сохранить уменьшенную и сжатую карточку вместо исходной картинки wttr.in (нужен Pillow)')
+
+    # Пакетный режим
+    parser.add_argument('--cities',
+                        nargs='+',
+                        help='Несколько городов для пакетного режима')
+    parser.add_argument('--cities-file',
+                        help="Файл со списком городов для пакетного режима, по одному на строку ('-' - stdin)")
+    parser.add_argument('--both',
+                        default=False,
+                        action='store_true',
+                        help='Пакетный режим: получить и текст, и картинку')
+    parser.add_argument('--concurrency',
+                        type=validate_concurrency_arg,
+                        default=10,
+                        help='Пакетный режим: сколько городов обрабатывать одновременно')
+    parser.add_argument('--rps',
+                        type=validate_rps_arg,
+                        default=5.0,
+                        help='Пакетный режим: максимум запросов в секунду к одному хосту')
+    parser.add_argument('--format',
+                        choices=['text', 'jsonl'],
+                        default='text',
+                        help='Пакетный режим: формат вывода результатов')
 
     # Парсим аргументы
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
+
+    # Получаем текущее время (при выводе JSONL служебные сообщения идут в stderr)
+    print(f"[t] Текущее время: {get_time_now()}", file=sys.stderr if args.format == 'jsonl' else sys.stdout)
 
     # Выполняем действия в зависимости от аргументов
-    if args.noimage:
+    if args.cities or args.cities_file:
+        cities: list = read_cities(args.cities, args.cities_file)
+        image: bool = args.both or not args.noimage
+        text: bool = args.both or args.noimage
+        if args.format == 'jsonl':
+            # stdout только для JSONL, служебные сообщения уходят в stderr
+            output = sys.stdout
+            with contextlib.redirect_stdout(sys.stderr):
+                errors = asyncio.run(run_batch(cities, image, text, args.concurrency, args.rps, 'jsonl', output))
+        else:
+            errors = asyncio.run(run_batch(cities, image, text, args.concurrency, args.rps, 'text'))
+        print(f"[i] Обработано городов: {len(cities)}, ошибок: {errors}", file=sys.stderr)
+    elif args.noimage:
         get_weather_on_cmd_line(args.city)
     else:
-        save_weather_to_png(args.city, args.filename)
+        save_weather_to_png(args.city, args.filename, args.card)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    # Если запущен демон CLI (cli_daemon.py, CLI_DAEMON_SOCKET) - команда выполняется в нем
+    import cli_daemon
+    code = cli_daemon.forward('weather')
+    if code is None:
+        main()
+    else:
+        sys.exit(code)
@@ -0,0 +1,73 @@
+"""Модель текущей погоды и выборочный разбор ответа wttr.in (format=j1)
+
+Ответ j1 большой: прогноз по часам на 3 дня, астрономия, переводы. Из него нужны только
+current_condition[0] и nearest_area[0]. parse_current_weather разбирает только эти два значения
+(json.JSONDecoder.raw_decode с позиции ключа), а массив прогноза "weather" не разбирается вовсе.
+В кэше хранится компактный CurrentWeather (__slots__) вместо словаря со всем документом."""
+
+import json
+from dataclasses import dataclass, asdict
+
+_decoder = json.JSONDecoder()
+
+
+@dataclass(slots=True)
+class CurrentWeather:
+    """Текущая погода: девять полей, которые выводятся пользователю"""
+    area_name: str
+    temperature: str
+    feels_like: str
+    humidity: str
+    wind_speed: str
+    pressure: str
+    weather_desc: str
+    latitude: str
+    longitude: str
+
+    @classmethod
+    def from_json(cls, current_condition: dict, nearest_area: dict) -> 'CurrentWeather':
+        """Создает модель из current_condition[0] и nearest_area[0]. При отсутствии ключа получим KeyError"""
+        return cls(area_name=nearest_area['areaName'][0]['value'],
+                   temperature=current_condition['temp_C'],
+                   feels_like=current_condition['FeelsLikeC'],
+                   humidity=current_condition['humidity'],
+                   wind_speed=current_condition['windspeedKmph'],
+                   pressure=current_condition['pressure'],
+                   weather_desc=current_condition['lang_ru'][0]['value'],
+                   latitude=nearest_area['latitude'],
+                   longitude=nearest_area['longitude'])
+
+    def to_dict(self) -> dict:
+        """Поля модели словарем (для JSONL)"""
+        return asdict(self)
+
+
+def _find_value(text: str, key: str):
+    """Разбирает только значение ключа верхнего уровня key. KeyError - ключа нет"""
+    marker: str = f'"{key}"'
+    position: int = text.find(marker)
+    while position != -1:
+        index: int = position + len(marker)
+        while index < len(text) and text[index] in ' \t\r\n':
+            index += 1
+        if index < len(text) and text[index] == ':':
+            index += 1
+            while text[index] in ' \t\r\n':
+                index += 1
+            return _decoder.raw_decode(text, index)[0]
+        position = text.find(marker, position + 1)  # Совпадение внутри строки, а не ключ - ищем дальше
+    raise KeyError(key)
+
+
+def parse_current_weather(content: bytes) -> CurrentWeather:
+    """Достает текущую погоду из тела ответа j1, не разбирая весь документ.
+    Если выборочный разбор не удался - разбирает документ целиком.
+    Ошибки: ValueError - некорректный JSON, KeyError - нет нужного ключа"""
+    text: str = content.decode('utf-8')
+    try:
+        current_condition = _find_value(text, 'current_condition')
+        nearest_area = _find_value(text, 'nearest_area')
+    except (KeyError, ValueError, IndexError):
+        data: dict = json.loads(text)
+        current_condition, nearest_area = data['current_condition'], data['nearest_area']
+    return CurrentWeather.from_json(current_condition[0], nearest_area[0])